@@ -100,6 +100,7 @@ Usage:
 import argparse
 import fcntl
 import fnmatch
+import importlib.util
 try:
     import xxhash
     _USE_XXHASH = True
@@ -118,6 +119,7 @@ import subprocess
 import sys
 import threading
 import time
+import unicodedata
 
 # ─── Optional: PyObjC for native frontmost-app detection ─────────────────────
 try:
@@ -168,6 +170,17 @@ DEFAULTS = {
     "conflict_backup_dir":    "",
     "daemon_debounce_seconds": 3.0,
     "daemon_retry_seconds":   5.0,
+    "engine_mode":            "inprocess",
+    "image_store":            "",
+    "image_link":             "auto",
+    "tag_folders":            False,
+    "tag_links":              "hardlink",
+    "image_gc":               "off",
+    "image_gc_grace_seconds": 86400,
+    "mirror_db":              "",
+    "search_index":           False,
+    "link_graph":             False,
+    "profile_dir":            "",
 }
 
 # ─── Cloud-sync junk filtering ───────────────────────────────────────────────
@@ -192,6 +205,15 @@ _NOTE_EXTENSIONS = frozenset((".md", ".txt", ".markdown"))
 _SENTINEL_FILES  = frozenset((".sync-time.log", ".export-time.log"))
 
 
+def _rel_key(path: str, folder: str) -> str:
+    """Relative path of *path* in NFC — the key for snapshots and hash state.
+
+    HFS+ and some sync clients hand names back as NFD; keying by NFC keeps
+    one note from looking deleted-and-recreated between cycles.
+    """
+    return unicodedata.normalize("NFC", os.path.relpath(path, folder))
+
+
 def _is_cloud_junk(path: str) -> bool:
     basename = os.path.basename(path)
     if _CLOUD_JUNK_RE.match(basename):
@@ -305,7 +327,7 @@ class VaultSnapshot:
                         self.junk_files.append(fpath)
                         continue
 
-                    rel = os.path.relpath(fpath, self.folder)
+                    rel = _rel_key(fpath, self.folder)
                     self.notes[rel] = _NoteEntry(fpath, st.st_mtime, st.st_size)
                     if st.st_mtime > self.newest_mtime:
                         self.newest_mtime = st.st_mtime
@@ -316,7 +338,7 @@ class VaultSnapshot:
         tb_text = os.path.join(root, dirname, "text.md")
         try:
             st = os.stat(tb_text)
-            rel = os.path.relpath(os.path.join(root, dirname), self.folder)
+            rel = _rel_key(os.path.join(root, dirname), self.folder)
             self.notes[rel] = _NoteEntry(tb_text, st.st_mtime, st.st_size)
             if st.st_mtime > self.newest_mtime:
                 self.newest_mtime = st.st_mtime
@@ -736,6 +758,28 @@ def _get_python(cfg: dict) -> str:
     return sys.executable
 
 
+# ─── Sync engine (in-process) ─────────────────────────────────────────────────
+#
+# bear_export_sync is loaded straight from script_path and driven through
+# its export()/import_changes() API, so a cycle costs function calls
+# instead of interpreter + pyobjc startups.  The module is reloaded when
+# the script file changes.  engine_mode "subprocess" keeps the old
+# one-process-per-phase isolation.
+
+_engine = None
+_engine_key = None
+
+def _load_engine(script: str):
+    global _engine, _engine_key
+    key = (script, os.path.getmtime(script))
+    if _engine_key != key:
+        spec = importlib.util.spec_from_file_location("bear_export_sync", script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _engine, _engine_key = module, key
+    return _engine
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # CONTENT-HASH CHANGE DETECTION
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -839,7 +883,7 @@ def _hash_folder_notes(folder: str, prev_snapshot: dict = None) -> dict:
                 if entry.endswith(".textbundle"):
                     tb_text = os.path.join(root, entry, "text.md")
                     if os.path.isfile(tb_text):
-                        rel = os.path.relpath(os.path.join(root, entry), folder)
+                        rel = _rel_key(os.path.join(root, entry), folder)
                         hashes[rel] = _stat_and_hash_with_cache(
                             tb_text, rel, prev_snapshot)
         except OSError:
@@ -849,7 +893,7 @@ def _hash_folder_notes(folder: str, prev_snapshot: dict = None) -> dict:
             if _CLOUD_JUNK_RE.match(fname) or not _is_note_file(fname):
                 continue
             fpath = os.path.join(root, fname)
-            rel = os.path.relpath(fpath, folder)
+            rel = _rel_key(fpath, folder)
             hashes[rel] = _stat_and_hash_with_cache(fpath, rel, prev_snapshot)
 
     return hashes
@@ -1030,6 +1074,24 @@ def run_sync(cfg: dict, export_only: bool = False,
 
     bear_settle = max(1, float(cfg.get("bear_settle_seconds", 3)))
 
+    image_store = cfg.get("image_store", "").strip()
+    image_store = _resolve(image_store) if image_store else None
+    image_link = cfg.get("image_link", "auto")
+    tag_folders = bool(cfg.get("tag_folders", False))
+    tag_links = cfg.get("tag_links", "hardlink")
+    image_gc = cfg.get("image_gc", "off")
+    image_gc_grace = int(cfg.get("image_gc_grace_seconds", 86400))
+    mirror_db = cfg.get("mirror_db", "").strip()
+    mirror_db = _resolve(mirror_db) if mirror_db else None
+    # Full-text index of the MD vault, kept beside it as <folder_md>.search.sqlite.
+    search_index = bool(cfg.get("search_index", False))
+    link_graph = bool(cfg.get("link_graph", False))
+    # Latest import/export profile of each cycle, as <phase>.json.
+    profile_dir = cfg.get("profile_dir", "").strip()
+    if profile_dir:
+        profile_dir = _resolve(profile_dir)
+        os.makedirs(profile_dir, exist_ok=True)
+
     for d in (folder_md, folder_tb, backup_md, backup_tb):
         os.makedirs(d, exist_ok=True)
 
@@ -1043,21 +1105,101 @@ def run_sync(cfg: dict, export_only: bool = False,
         if n:
             log.debug("Cleaned %d junk items from %s", n, folder)
 
-    def _run(fmt, out, backup, skip_import=False, skip_export=False):
+    engine = None
+    if cfg.get("engine_mode", "inprocess") != "subprocess":
+        try:
+            engine = _load_engine(script)
+        except Exception as exc:
+            log.warning("In-process engine unavailable (%s) — using subprocess",
+                        exc)
+
+    def _run_engine(skip_import=False, skip_export=False):
+        phase = "export" if skip_import else "import"
+        tag = f"MD+TB-{phase}"
+        config = engine.SyncConfig(
+            out=folder_md, backup=backup_md, format="md",
+            targets=[("tb", folder_tb, backup_tb)],
+            image_store=image_store, image_link=image_link,
+            tag_folders=tag_folders, tag_links=tag_links,
+            image_gc=image_gc, image_gc_grace=image_gc_grace,
+            mirror=mirror_db, search_index="" if search_index else None,
+            link_graph="" if link_graph else None)
+        if profile_dir:
+            config.profile = engine.RunProfile()
+            config.profile.start()
+        t0 = time.monotonic()
+        try:
+            if skip_export:
+                result = engine.import_changes(config)
+                done = result["imported"]
+            else:
+                result = engine.export(config)
+                done = result["exported"]
+                for t in result["targets"]:
+                    log.info("[%s] Target %s exported=%s notes=%d written=%d "
+                             "renamed=%d removed=%d out=%s", tag, t["format"],
+                             t["exported"], t["notes"], t["written"],
+                             t["renamed"], t["removed"], t["out"])
+                    if t.get("error"):
+                        log.error("[%s] Target %s failed: %s", tag,
+                                  t["format"], t["error"])
+                w = result["writes"]
+                log.info("[%s] Writes: %d written (%d KB), %d unchanged (%d KB)",
+                         tag, w["written"], w["written_bytes"] // 1024,
+                         w["unchanged"], w["unchanged_bytes"] // 1024)
+            elapsed = time.monotonic() - t0
+            if done and skip_import:
+                log.info("[%s] exported  %.1fs", tag, elapsed)
+            else:
+                log.info("[%s] ok  %.1fs", tag, elapsed)
+        except Exception as exc:
+            log.error("[%s] %s: %s", tag, type(exc).__name__, exc)
+        finally:
+            if config.profile is not None:
+                config.profile.stop()
+                config.profile.save(os.path.join(profile_dir, f"{phase}.json"))
+
+    def _run(skip_import=False, skip_export=False):
+        if engine is not None:
+            _run_engine(skip_import, skip_export)
+            return
+        # One invocation handles both folders: the MD vault is the primary
+        # target and the TextBundle vault rides along via --target, so
+        # Bear's database is read once per phase instead of once per format.
         cmd = [python, script,
-               "--out", out, "--backup", backup, "--format", fmt]
+               "--out", folder_md, "--backup", backup_md, "--format", "md",
+               "--target", "tb", folder_tb, backup_tb]
+        if image_store:
+            cmd += ["--imageStore", image_store, "--imageLink", image_link]
+        if tag_folders:
+            cmd += ["--tagFolders", "--tagLinks", tag_links]
+        if image_gc != "off":
+            cmd += ["--imageGC", image_gc, "--imageGCGrace", str(image_gc_grace)]
+        if mirror_db:
+            cmd += ["--mirror", mirror_db]
+        if search_index:
+            cmd.append("--searchIndex")
+        if link_graph:
+            cmd.append("--linkGraph")
         if skip_import:
             cmd.append("--skipImport")
         if skip_export:
             cmd.append("--skipExport")
         phase = "export" if skip_import else "import"
-        tag = f"{fmt.upper()}-{phase}"
+        if profile_dir:
+            cmd += ["--profile", os.path.join(profile_dir, f"{phase}.json")]
+        tag = f"MD+TB-{phase}"
         t0 = time.monotonic()
         try:
             r = subprocess.run(cmd, check=False,
                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             elapsed = time.monotonic() - t0
             stderr = r.stderr.decode(errors="replace").strip()
+            for line in r.stdout.decode(errors="replace").splitlines():
+                if line.startswith("Target "):
+                    log.info("[%s] %s", tag, line)
+                elif line.startswith("    error: "):
+                    log.error("[%s] %s", tag, line.strip())
             if r.returncode == 0:
                 log.info("[%s] ok  %.1fs", tag, elapsed)
             elif r.returncode == 1 and skip_import:
@@ -1091,8 +1233,7 @@ def run_sync(cfg: dict, export_only: bool = False,
         pre_md, pre_tb = {}, {}
 
     if need_import:
-        _run("md", folder_md, backup_md, skip_export=True)
-        _run("tb", folder_tb, backup_tb, skip_export=True)
+        _run(skip_export=True)
         pre_mod = _bear_db_max_mod()
         deadline = time.time() + bear_settle
         while time.time() < deadline:
@@ -1102,8 +1243,7 @@ def run_sync(cfg: dict, export_only: bool = False,
                 break
 
     # Export ALWAYS runs (cross-sync guarantee: MD↔Bear↔TB)
-    _run("md", folder_md, backup_md, skip_import=True)
-    _run("tb", folder_tb, backup_tb, skip_import=True)
+    _run(skip_import=True)
 
     # Build post-sync snapshots (single walk per folder for all post-sync needs)
     post_snapshots = _build_snapshots([folder_md, folder_tb])
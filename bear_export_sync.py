@@ -4,11 +4,10 @@
 # Developed with Visual Studio Code with MS Python Extension.
 
 import shlex
-import objc
 import os
+import sys
 import base64
-from AppKit import NSWorkspace, NSWorkspaceOpenConfiguration, NSURL
-from Foundation import NSFileManager, NSDate, NSFileCreationDate
+import io
 
 '''
 # Markdown export from Bear sqlite database
@@ -19,6 +18,7 @@ original author: github/rovest, rorves@twitter
 
 make_tag_folders = False
 multi_tag_folders = True
+tag_folder_links = 'hardlink'
 hide_tags_in_comment_block = False
 only_export_these_tags = []
 
@@ -30,8 +30,15 @@ import urllib.parse
 import time
 import tempfile
 import shutil
+import stat
 import json
 import argparse
+import abc
+import hashlib
+import unicodedata
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # ---------------------------------------------------------------------------
 # Constants pre-computed once at module load
@@ -43,30 +50,16 @@ RE_BEAR_ID_NEW   = re.compile(r'\[\/\/\]: # \(\{BearID:(.+?)\}\)\n?')
 RE_BEAR_ID_OLD   = re.compile(r'\<\!-- ?\{BearID\:(.+?)\} ?--\>\n?')
 RE_BEAR_ID_FIND_NEW = re.compile(r'\[\/\/\]: # \(\{BearID:(.+?)\}\)')
 RE_BEAR_ID_FIND_OLD = re.compile(r'\<\!-- ?\{BearID\:(.+?)\} ?--\>')
-RE_MD_IMAGE      = re.compile(r'!\[(.*?)\]\(([^)]+)\)')
-RE_WIKI_IMAGE    = re.compile(r'!\[\[(.*?)\]\]')
-RE_HTML_IMG_TAG  = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
 RE_HTML_IMG_SRC  = re.compile(r'\bsrc=(["\'])(.*?)\1', re.IGNORECASE)
 RE_HTML_IMG_ALT  = re.compile(r'\balt=(["\'])(.*?)\1', re.IGNORECASE)
-RE_BEAR_IMAGE    = re.compile(r'\[image:(.+?)\]')
-RE_BEAR_IMG_SUB  = re.compile(r'\[image:(.+?)/(.+?)\]')
-RE_TAG_PATTERN1  = re.compile(r'(?<!\S)\#([.\w\/\-]+)[ \n]?(?!([\/ \w]+\w[#]))')
-RE_TAG_PATTERN2  = re.compile(r'(?<![\S])\#([^ \d][.\w\/ ]+?)\#([ \n]|$)')
-RE_REF_DEF       = re.compile(r'^\[(?!\/\/)([^\]]+)\]:\s*(\S+).*$', re.MULTILINE)
-RE_REF_IMG       = re.compile(r'!\[([^\]]*)\]\[([^\]]+)\]')
-RE_REF_IMP       = re.compile(r'!\[([^\[\]]+)\](?!\()')
-RE_REF_LINK      = re.compile(r'(?<!!)\[([^\]]+)\]\[([^\]]+)\]')   # [text][ref] (non-image)
-RE_REF_LINK_IMP  = re.compile(r'(?<!!)\[([^\[\]]+)\](?!\(|\[|:)')  # [text] implicit (non-image)
-RE_REF_CLEAN     = re.compile(r'^\[(?!\/\/)[^\]]+\]:\s*\S+.*$\n?', re.MULTILINE)
-RE_HIDE_TAGS     = re.compile(r'(\n)[ \t]*(\#[^\s#].*)')
 RE_HEADING       = re.compile(r'^#{1,6} ')
 RE_MD_HEADING    = re.compile(r'^#+\s*')
 RE_UUID_DIR      = re.compile(r'/[0-9A-F]{8}-([0-9A-F]{4}-){3}[0-9A-F]{12}/', re.IGNORECASE)
 RE_UUID_ASSET    = re.compile(r'assets/[0-9A-F]{8}-([0-9A-F]{4}-){3}[0-9A-F]{12}_', re.IGNORECASE)
 RE_UUID_FILENAME = re.compile(r'(?i)^[0-9A-F]{8}-([0-9A-F]{4}-){3}[0-9A-F]{12}_')
-RE_TB_ASSET_IMG  = re.compile(r'!\[(.*?)\]\(assets/.+?_(.+?)( ".+?")?\) ?')
 RE_CLEAN_TITLE   = re.compile(r'[\/\\:]')
 RE_TRAILING_DASH = re.compile(r'-$')
+RE_ALLOCATED_SUFFIX = re.compile(r' - \d{2,}$')   # PathAllocator's " - 02"
 RE_IMAGE_UUID_PREFIX = re.compile(r'[0-9A-F]{8}-([0-9A-F]{4}-){3}[0-9A-F]{12}', re.IGNORECASE)
 _IMAGE_FILE_EXTS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.heic', '.bmp', '.tif', '.tiff')
 
@@ -77,7 +70,9 @@ HOME = os.getenv('HOME', '')
 default_out_folder    = os.path.join(HOME, "Work", "BearNotes")
 default_backup_folder = os.path.join(HOME, "Work", "BearSyncBackup")
 
-parser = argparse.ArgumentParser(description="Sync Bear notes")
+parser = argparse.ArgumentParser(
+    description="Sync Bear notes",
+    epilog="Full-text search: bear_export_sync.py search --help")
 parser.add_argument("--out",       default=default_out_folder,    help="Path where Bear notes will be synced")
 parser.add_argument("--backup",    default=default_backup_folder, help="Path where conflicts will be backed up (must be outside --out)")
 parser.add_argument("--images",    default=None,                   help="Path where images will be stored")
@@ -86,45 +81,420 @@ parser.add_argument("--skipExport", action="store_const", const=True, default=Fa
                     help="Only run the import phase; skip export to disk entirely.")
 parser.add_argument("--excludeTag", action="append", default=[],  help="Don't export notes with this tag. Repeatable.")
 parser.add_argument("--hideTags",  action="store_const", const=True, default=False)
-parser.add_argument("--format",    choices=['tb', 'md'], default='md')
-
-parsed_args = vars(parser.parse_args())
-
-if parsed_args.get("format") == 'tb':
-    export_as_textbundles   = True
-    export_as_hybrids       = True
-    export_image_repository = False
-else:
-    export_as_textbundles   = False
-    export_as_hybrids       = False
-    export_image_repository = True
+parser.add_argument("--format",    choices=['tb', 'md', 'zip', 'tar'], default='md',
+                    help="md or tb folders, or zip/tar: one archive per run written into --out.")
+parser.add_argument("--target",    nargs=3, action="append", default=[],
+                    metavar=("FORMAT", "OUT", "BACKUP"),
+                    help="Additional export target served from the same database "
+                         "read (e.g. --target tb ~/TB ~/TBBackup). Repeatable.")
+parser.add_argument("--archiveMode", choices=['full', 'incremental'], default='full',
+                    help="For zip/tar targets: every note, or only notes changed "
+                         "since the previous archive.")
+parser.add_argument("--mirror", default=None, metavar="PATH",
+                    help="Keep a SQLite mirror of note metadata and rendered "
+                         "text at PATH, updated by each export.")
+parser.add_argument("--searchIndex", nargs='?', const='', default=None, metavar="PATH",
+                    help="Keep an SQLite FTS5 index of the notes, updated by each "
+                         "export (default PATH: <out>.search.sqlite). Query it "
+                         "with the search subcommand.")
+parser.add_argument("--linkGraph", nargs='?', const='', default=None, metavar="PATH",
+                    help="Write the note link graph (forward and backward edges "
+                         "by UUID) to PATH as JSON, updated by each export "
+                         "(default PATH: <out>.links.json).")
+parser.add_argument("--writeWorkers", type=int, default=4,
+                    help="Threads for note writes and image copies (1 = sequential).")
+parser.add_argument("--tagFolders", action="store_const", const=True, default=False,
+                    help="Also place each note in a folder per tag.")
+parser.add_argument("--tagLinks",  choices=['copy', 'hardlink', 'symlink'], default='hardlink',
+                    help="How --tagFolders places the extra copies of a note.")
+parser.add_argument("--imageStore", default=None,
+                    help="Content-addressed image store shared by all targets; "
+                         "images are linked from it instead of copied.")
+parser.add_argument("--imageLink", choices=['auto', 'hardlink', 'reflink', 'copy'],
+                    default='auto',
+                    help="How --imageStore places images (auto = hardlink, then reflink, then copy).")
+parser.add_argument("--imageGC", choices=['off', 'dry-run', 'on'], default='off',
+                    help="Remove images in BearImages no note references any more "
+                         "(dry-run only lists them, and root orphans too).")
+parser.add_argument("--imageGCGrace", type=int, default=86400, metavar="SECONDS",
+                    help="How long an image must stay unreferenced before --imageGC removes it.")
+parser.add_argument("--profile", default=None, metavar="PATH",
+                    help="Write per-phase timings, the slowest notes and the "
+                         "tracemalloc peak for this run to PATH as JSON.")
+parser.add_argument("--profileTop", type=int, default=10, metavar="N",
+                    help="How many of the slowest notes --profile lists.")
+parser.add_argument("--cProfile", default=None, metavar="PATH",
+                    help="With --profile, also dump cProfile stats to PATH.")
+
+search_parser = argparse.ArgumentParser(
+    prog="bear_export_sync.py search",
+    description="Search the notes in a --searchIndex full-text index")
+search_parser.add_argument("query", nargs="+", help="Words every result must contain (word* = prefix)")
+search_parser.add_argument("--out", default=default_out_folder, help="Export folder the index belongs to")
+search_parser.add_argument("--index", default=None, help="Index path (default: <out>.search.sqlite)")
+search_parser.add_argument("--limit", type=int, default=20)
+search_parser.add_argument("--raw", action="store_const", const=True, default=False,
+                           help="Pass the query to FTS5 unchanged (AND/OR/NOT, NEAR, title:).")
+search_parser.add_argument("--json", action="store_const", const=True, default=False,
+                           help="Print results as JSON.")
 
 set_logging_on          = True
-export_path             = parsed_args.get("out")
-no_export_tags          = parsed_args.get("excludeTag")
-hide_tags_in_comment_block = parsed_args.get("hideTags")
 
 bear_db      = os.path.join(HOME,
     'Library/Group Containers/9K33E3U3T4.net.shinyfrog.bear/Application Data/database.sqlite')
-sync_backup  = parsed_args.get("backup")
-log_file     = os.path.join(sync_backup, 'bear_export_sync_log.txt')
 
 bear_image_path = os.path.join(HOME,
     'Library/Group Containers/9K33E3U3T4.net.shinyfrog.bear/Application Data/Local Files/Note Images')
-assets_path  = parsed_args.get("images") if parsed_args.get("images") else os.path.join(export_path, 'BearImages')
 
 sync_ts      = '.sync-time.log'
 export_ts    = '.export-time.log'
+export_manifest = '.export-manifest.json'
+image_index_file = '.image-index.json'
+
+# Run settings — installed by configure() from a SyncConfig.
+no_export_tags = []
+write_workers  = 4
+sync_backup    = default_backup_folder
+log_file       = os.path.join(sync_backup, 'bear_export_sync_log.txt')
+targets        = []
+image_store    = None
+image_gc       = 'off'      # off | dry-run | on — see _collect_image_garbage()
+image_gc_grace = 86400      # seconds an asset stays unreferenced before removal
+archive_mode   = 'full'     # full | incremental — see ExportArchive
+run_profile    = None       # RunProfile while --profile is on
+note_indexes   = []         # NoteMirror, SearchIndex, LinkGraph — fed by export_markdown()
+
+
+class SyncConfig:
+    """Settings for one engine run — the programmatic form of the CLI flags.
+
+    *targets* lists extra (format, out, backup) export targets served
+    from the same database read as the primary out/format target.
+    """
+
+    def __init__(self, out=default_out_folder, backup=default_backup_folder,
+                 images=None, format='md', targets=(), exclude_tags=(),
+                 hide_tags=False, write_workers=4, image_store=None,
+                 image_link='auto', tag_folders=False, tag_links='hardlink',
+                 image_gc='off', image_gc_grace=86400, profile=None,
+                 archive_mode='full', mirror=None, search_index=None,
+                 link_graph=None):
+        self.out = out
+        self.backup = backup
+        self.images = images
+        self.format = format
+        self.targets = [tuple(t) for t in targets]
+        self.exclude_tags = list(exclude_tags)
+        self.hide_tags = hide_tags
+        self.write_workers = write_workers
+        self.image_store = image_store
+        self.image_link = image_link
+        self.tag_folders = tag_folders
+        self.tag_links = tag_links
+        self.image_gc = image_gc
+        self.image_gc_grace = image_gc_grace
+        self.profile = profile
+        self.archive_mode = archive_mode
+        self.mirror = mirror
+        self.search_index = search_index    # '' = default_search_index(out)
+        self.link_graph = link_graph        # '' = default_link_graph(out)
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a config from parsed command-line arguments."""
+        for fmt, _, _ in args.target:
+            if fmt not in ('md', 'tb') + ARCHIVE_FORMATS:
+                parser.error(f"--target FORMAT must be md, tb, zip or tar, not '{fmt}'")
+        return cls(out=args.out, backup=args.backup, images=args.images,
+                   format=args.format, targets=args.target,
+                   exclude_tags=args.excludeTag, hide_tags=args.hideTags,
+                   write_workers=args.writeWorkers,
+                   image_store=args.imageStore, image_link=args.imageLink,
+                   tag_folders=args.tagFolders, tag_links=args.tagLinks,
+                   image_gc=args.imageGC, image_gc_grace=args.imageGCGrace,
+                   archive_mode=args.archiveMode, mirror=args.mirror,
+                   search_index=args.searchIndex, link_graph=args.linkGraph)
+
+
+def configure(config):
+    """Install *config* as the module's run settings and build its targets."""
+    global no_export_tags, hide_tags_in_comment_block, write_workers
+    global sync_backup, log_file, targets, image_store
+    global make_tag_folders, tag_folder_links, image_gc, image_gc_grace
+    global run_profile, archive_mode, note_indexes
+    for fmt, _, _ in [(config.format, None, None)] + config.targets:
+        if fmt not in ('md', 'tb') + ARCHIVE_FORMATS:
+            raise ValueError(f"export format must be md, tb, zip or tar, not {fmt!r}")
+    no_export_tags = list(config.exclude_tags)
+    hide_tags_in_comment_block = config.hide_tags
+    write_workers = max(1, config.write_workers)
+    make_tag_folders = config.tag_folders
+    tag_folder_links = config.tag_links
+    image_gc = config.image_gc
+    image_gc_grace = max(0, config.image_gc_grace)
+    run_profile = config.profile
+    archive_mode = config.archive_mode
+    sync_backup = config.backup
+    log_file = os.path.join(sync_backup, 'bear_export_sync_log.txt')
+    targets = [ExportTarget(config.format, config.out, config.backup,
+                            config.images)]
+    targets.extend(ExportTarget(fmt, out, backup)
+                   for fmt, out, backup in config.targets)
+    image_store = (ImageStore(config.image_store, config.image_link)
+                   if config.image_store else None)
+    note_indexes = [NoteMirror(config.mirror)] if config.mirror else []
+    if config.search_index is not None:
+        if not _fts5_available():
+            raise ValueError("--searchIndex needs an SQLite build with FTS5")
+        note_indexes.append(SearchIndex(config.search_index
+                                        or default_search_index(config.out)))
+    if config.link_graph is not None:
+        note_indexes.append(LinkGraph(config.link_graph
+                                      or default_link_graph(config.out)))
+
+
+class ExportTarget:
+    """One export destination: format, note folder, backup folder, images.
+
+    A run reads each changed note from Bear once and fans it out to
+    every target.  An archive target (zip, tar) streams the run into an
+    ExportArchive in the out folder instead of writing note files; its
+    images always go under BearImages/ inside the archive.  Per-run
+    results (note_count, expected_paths, written, renamed, removed) are
+    collected on the target for reporting.
+    """
+
+    def __init__(self, fmt, out, backup, images=None):
+        self.fmt = fmt
+        self.export_path = out
+        self.sync_backup = backup
+        self.is_archive = fmt in ARCHIVE_FORMATS
+        if self.is_archive:
+            images = None
+        self.assets_path = images or os.path.join(out, 'BearImages')
+        self.as_textbundles = fmt == 'tb'
+        self.as_hybrids = fmt == 'tb'
+        self.image_repository = fmt != 'tb'
+        self.sync_ts_file = os.path.join(out, sync_ts)
+        self.export_ts_file = os.path.join(out, export_ts)
+        self.manifest = None
+        self.archive = None
+        self.images = ImageIndex(out)
+        self.allocator = None
+        self.note_count = 0
+        self.expected_paths = set()
+        self.written = 0
+        self.removed = 0
+        self.renamed = 0
+        self.error = None      # first failure of this run, as text
+
+    def begin_export(self):
+        """Create the folder and load the manifest for a new export run.
+
+        A full archive ignores the manifest, so every note is read and
+        archived; an incremental one diffs against it as folders do.
+        """
+        os.makedirs(self.export_path, exist_ok=True)
+        self.manifest = ExportManifest(self.export_path, _manifest_settings(self))
+        if self.is_archive:
+            incremental = archive_mode == 'incremental'
+            if incremental:
+                self.manifest.load()
+            self.archive = ExportArchive(self.export_path, self.fmt, incremental)
+        else:
+            self.manifest.load()
+            self.images.load()
+        self.error = None
+        self.note_count = 0
+        self.expected_paths = set()
+        self.written = 0
+        self.removed = 0
+        self.renamed = 0
 
-sync_ts_file       = os.path.join(export_path, sync_ts)
-export_ts_file_exp = os.path.join(export_path, export_ts)
 
 gettag_sh  = os.path.join(HOME, 'temp/gettag.sh')
 gettag_txt = os.path.join(HOME, 'temp/gettag.txt')
 
-# NSWorkspace configuration — created once
-open_config = NSWorkspaceOpenConfiguration.alloc().init()
-open_config.setActivates_(False)
+
+
+# ===========================================================================
+# Platform services
+# ===========================================================================
+#
+# Everything that needs macOS — opening bear:// URLs, setting file
+# creation dates, handing bundles to Bear, notifications — goes through
+# a backend object created on first use.  pyobjc is imported only when
+# the macOS backend is built, so a no-op export never loads it, and
+# other hosts get StubBackend.
+
+class MacBackend:
+    """macOS services via pyobjc (AppKit/Foundation loaded on construction)."""
+
+    def __init__(self):
+        from AppKit import NSWorkspace, NSWorkspaceOpenConfiguration, NSURL
+        from Foundation import NSFileManager, NSDate, NSFileCreationDate
+        self._workspace = NSWorkspace.sharedWorkspace()
+        self._url = NSURL
+        self._file_manager = NSFileManager.defaultManager()
+        self._date = NSDate
+        self._creation_key = NSFileCreationDate
+        self._open_config = NSWorkspaceOpenConfiguration.alloc().init()
+        self._open_config.setActivates_(False)
+
+    def open_url(self, url_string):
+        """Open *url_string* in the background; False if it is not a valid URL."""
+        url = self._url.URLWithString_(url_string)
+        if url is None:
+            return False
+        self._workspace.openURL_configuration_completionHandler_(
+            url, self._open_config, None)
+        return True
+
+    def set_creation_date(self, filepath, unix_timestamp):
+        ns_date = self._date.dateWithTimeIntervalSince1970_(unix_timestamp)
+        self._file_manager.setAttributes_ofItemAtPath_error_(
+            {self._creation_key: ns_date}, filepath, None)
+
+    def open_in_bear(self, path):
+        subprocess.call(['open', '-a', 'Bear', path])
+
+    def notify(self, title, message):
+        subprocess.call(['/Applications/terminal-notifier.app/Contents/MacOS/terminal-notifier',
+                         '-message', message, "-title", title, '-sound', 'default'])
+
+
+class StubBackend:
+    """Inert services for non-macOS hosts and tests: records, never launches."""
+
+    def __init__(self):
+        self.opened = []
+
+    def open_url(self, url_string):
+        self.opened.append(url_string)
+        return True
+
+    def set_creation_date(self, filepath, unix_timestamp):
+        pass
+
+    def open_in_bear(self, path):
+        self.opened.append(path)
+
+    def notify(self, title, message):
+        print(f"{title}: {message}")
+
+
+_platform = None
+
+
+def platform_backend():
+    """Return the platform backend, creating it on first use."""
+    global _platform
+    if _platform is None:
+        _platform = MacBackend() if sys.platform == 'darwin' else StubBackend()
+    return _platform
+
+
+def set_platform_backend(backend):
+    """Replace the platform backend (e.g. StubBackend() for dry runs)."""
+    global _platform
+    _platform = backend
+
+
+# ===========================================================================
+# Engine API
+# ===========================================================================
+#
+# import_changes() and export() run one phase against the current
+# settings (or the SyncConfig passed in) and return plain dicts, so a
+# caller such as sync_gate can drive the engine in-process.  Settings
+# are module globals, so runs are serialized by _engine_lock.
+
+_engine_lock = threading.Lock()
+
+
+def import_changes(config=None):
+    """Import notes edited on disk into Bear, for every target.
+
+    Returns {"imported": bool, "targets": [{"format", "out", "imported"}],
+    "writes": {...}}.
+    """
+    with _engine_lock:
+        if config is not None:
+            configure(config)
+        write_stats.reset()
+        init_gettag_script()
+        # Archives are write-only snapshots; there is nothing to import.
+        results = [{'format': target.fmt, 'out': target.export_path,
+                    'imported': bool(sync_md_updates(target))}
+                   for target in targets if not target.is_archive]
+    return {'imported': any(r['imported'] for r in results),
+            'targets': results, 'writes': write_stats.as_dict()}
+
+
+def export(config=None):
+    """Export Bear notes to every target whose folder is behind the database.
+
+    Returns {"exported": bool, "targets": [...], "writes": {...}} with
+    one dict per target (format, out, exported, notes, written, renamed,
+    collisions, removed, error) and the run's write_file() tally.
+
+    A target whose notes fail to write is reported with its first
+    error and exported False; it is not stamped and its manifest is
+    not saved, so the next run retries it.  The other targets and the
+    note indexes finish normally.
+    """
+    with _engine_lock:
+        if config is not None:
+            configure(config)
+        write_stats.reset()
+        pending = [t for t in targets if check_db_modified(t)]
+        if pending or any(ix.behind() for ix in note_indexes):
+            for target in pending:
+                target.begin_export()
+            for ix in note_indexes:
+                ix.begin()
+            try:
+                export_markdown(pending)
+            except BaseException:
+                for target in pending:
+                    if target.archive is not None:
+                        target.archive.abort()
+                        target.archive = None
+                for ix in note_indexes:
+                    ix.abort()
+                raise
+            for target in pending:
+                if target.error is None:
+                    try:
+                        finish_export(target)
+                    except Exception as e:
+                        _target_failed(target, target.export_path, e)
+                if target.error is not None and target.archive is not None:
+                    target.archive.abort()
+                    target.archive = None
+            write_log(f'Writes: {write_stats.summary()}')
+            if image_store is not None:
+                if image_gc != 'off' and all(t.error is None for t in pending):
+                    _collect_store_garbage()
+                image_store.save()
+                if image_store.summary():
+                    print(f'Image store: {image_store.summary()}')
+                    write_log(f'Image store: {image_store.summary()}')
+        results = []
+        for target in targets:
+            done = target in pending
+            results.append({
+                'format': target.fmt, 'out': target.export_path,
+                'exported': done and target.error is None,
+                'notes': target.note_count if done else 0,
+                'written': target.written if done else 0,
+                'renamed': target.renamed if done else 0,
+                'collisions': len(target.allocator.collisions) if done else 0,
+                'removed': target.removed if done else 0,
+                'error': target.error if done else None,
+            })
+    return {'exported': any(r['exported'] for r in results), 'targets': results,
+            'writes': write_stats.as_dict()}
 
 
 # ===========================================================================
@@ -132,28 +502,110 @@ open_config.setActivates_(False)
 # ===========================================================================
 
 def main():
-    init_gettag_script()
-    if not parsed_args.get("skipImport"):
-        sync_md_updates()
-    if parsed_args.get("skipExport"):
+    if sys.argv[1:2] == ['search']:
+        exit(search_main(sys.argv[2:]))
+    args = parser.parse_args()
+    config = SyncConfig.from_args(args)
+    if args.profile:
+        config.profile = RunProfile(args.profileTop, args.cProfile)
+        config.profile.start()
+    configure(config)
+    try:
+        _run_cli(args)
+    finally:
+        if config.profile is not None:
+            config.profile.stop()
+            config.profile.save(args.profile)
+
+
+def _run_cli(args):
+    if not args.skipImport:
+        import_changes()
+    if args.skipExport:
         # Import-only mode: no export, no timestamp update.
         exit(0)
-    if check_db_modified():
-        os.makedirs(export_path, exist_ok=True)
-        note_count, expected_paths = export_markdown()
-        write_time_stamp()
-        removed = _cleanup_stale_notes(expected_paths)
-        if removed:
-            print(f'Cleaned {removed} stale files from export folder')
-        removed_orphan_images = _cleanup_root_orphan_images()
-        if removed_orphan_images:
-            print(f'Cleaned {removed_orphan_images} orphan root images')
-        write_log(str(note_count) + ' notes exported to: ' + export_path)
-        exit(1)
-    else:
+    result = export()
+    failed = [t for t in result['targets'] if t['error']]
+    if not result['exported'] and not failed:
         print('*** No notes needed exports')
         exit(0)
 
+    # Per-target status: 1 = exported this run, 0 = already up to date,
+    # 2 = failed (the other targets still finished).
+    for t in result['targets']:
+        status = 2 if t['error'] else int(t['exported'])
+        print(f"Target {t['format']} exit={status} notes={t['notes']} "
+              f"written={t['written']} renamed={t['renamed']} "
+              f"removed={t['removed']} out={t['out']}")
+        if t['error']:
+            print(f"    error: {t['error']}")
+    print(f'Writes: {write_stats.summary()}')
+    exit(2 if failed else 1)
+
+
+def search_main(argv):
+    """The search subcommand: print ranked note paths and snippets.
+
+    Exit status 0 when something matched, 1 when nothing did.
+    """
+    args = search_parser.parse_args(argv)
+    index = args.index or default_search_index(args.out)
+    try:
+        hits = search(index, ' '.join(args.query), args.limit, args.raw)
+    except (OSError, sqlite3.Error) as e:
+        search_parser.error(str(e))
+    for hit in hits:
+        hit['paths'] = [os.path.join(args.out, p) for p in hit['paths']]
+    if args.json:
+        print(json.dumps(hits, ensure_ascii=False, indent=1))
+    else:
+        for hit in hits:
+            print(hit['paths'][0] if hit['paths'] else hit['title'])
+            print(f"    {hit['snippet']}")
+    return 0 if hits else 1
+
+
+def finish_export(target):
+    """Stamp, clean up and save the manifest for *target* after export."""
+    if target.archive is not None:
+        _finish_archive(target)
+        return
+    manifest = target.manifest
+    write_time_stamp(target)
+    with _phase('stale_cleanup'):
+        if manifest.loaded:
+            # Deletions and retitles come straight from the manifest diff.
+            removed = _remove_stale_paths(target, manifest.finish(),
+                                          target.expected_paths)
+        else:
+            # No usable manifest (first run, format change): walk once.
+            manifest.finish()
+            removed = _cleanup_stale_notes(target, target.expected_paths)
+        manifest.save()
+    target.removed = removed
+    for uuid, wanted, got in target.allocator.collisions:
+        write_log(f'Name collision: {os.path.relpath(wanted, target.export_path)} '
+                  f'taken, {uuid} exported as '
+                  f'{os.path.relpath(got, target.export_path)}')
+    if target.allocator.collisions:
+        print(f'Resolved {len(target.allocator.collisions)} filename '
+              f'collisions in {target.export_path}')
+    if removed:
+        print(f'Cleaned {removed} stale files from {target.export_path}')
+    with _phase('orphan_cleanup'):
+        if not target.images.loaded:
+            target.images.rebuild(target.assets_path)
+        removed_orphan_images = _cleanup_root_orphan_images(target)
+        removed_assets = _collect_image_garbage(target)
+        target.images.save()
+    if removed_orphan_images:
+        print(f'Cleaned {removed_orphan_images} orphan root images')
+    if removed_assets:
+        print(f'Cleaned {removed_assets} unreferenced images from {target.assets_path}')
+    write_log(f'{target.note_count} notes exported to: {target.export_path} '
+              f'({target.written} written, {target.renamed} renamed, '
+              f'{removed} removed)')
+
 
 # ===========================================================================
 # Logging
@@ -164,7 +616,8 @@ def write_log(message):
         return
     os.makedirs(sync_backup, exist_ok=True)
     time_stamp = datetime.datetime.now().strftime("%Y-%m-%d at %H:%M:%S")
-    message = message.replace(export_path + '/', '')
+    for target in targets:
+        message = message.replace(target.export_path + '/', '')
     with open(log_file, 'a', encoding='utf-8') as f:
         f.write(time_stamp + ': ' + message + '\n')
 
@@ -197,46 +650,329 @@ def get_file_date(filename):
         return 0
 
 
-def check_db_modified():
-    if not os.path.exists(sync_ts_file):
+def check_db_modified(target):
+    if not os.path.exists(target.sync_ts_file):
         return True
-    return get_file_date(bear_db) > get_file_date(export_ts_file_exp)
+    return get_file_date(bear_db) > get_file_date(target.export_ts_file)
+
+
+# Read tuning for the export snapshot: map up to 256 MB of the database
+# and allow a 64 MB page cache, so a full scan does not re-read pages.
+_SNAPSHOT_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+)
+
+
+def _bear_db_uri():
+    """Read-only SQLite URI for the Bear database — the exporter never
+    opens Bear's own file for writing."""
+    return f"file:{urllib.parse.quote(bear_db)}?mode=ro"
+
+
+def _open_live_snapshot():
+    """Open the live Bear DB read-only and start one read transaction.
+
+    The first read pins a WAL snapshot, so every later query on this
+    connection sees the same consistent database state while Bear keeps
+    writing — no copy of the file is needed.
+    """
+    conn = sqlite3.connect(_bear_db_uri(), uri=True, isolation_level=None)
+    try:
+        for pragma in _SNAPSHOT_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM ZSFNOTE").fetchone()
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def _open_backup_snapshot():
+    """Copy the Bear DB into memory with SQLite's online backup API."""
+    src = sqlite3.connect(_bear_db_uri(), uri=True)
+    try:
+        conn = sqlite3.connect(":memory:")
+        src.backup(conn)
+    finally:
+        src.close()
+    return conn
+
+
+@contextlib.contextmanager
+def _bear_db_snapshot():
+    """Yield a connection holding a consistent view of the Bear database.
+
+    Strategies, first success wins:
+      live    read-only open of the live file inside a single read
+              transaction (no copy)
+      backup  online backup into memory, when the live open fails
+      copy    file copy to a temp path (the pre-snapshot behavior)
+    The strategy used is reported on stdout, and fallbacks are logged.
+    Bear's file is only ever opened read-only; a missing database or a
+    failure of every strategy raises RuntimeError.
+    """
+    if not os.path.isfile(bear_db):
+        raise RuntimeError(f"Bear database not found: {bear_db}")
+    with _phase('db_snapshot'):
+        conn = None
+        temp_db_path = None
+        mode = 'live'
+        errors = []
+        try:
+            conn = _open_live_snapshot()
+        except Exception as e:
+            errors.append(f"live: {e}")
+        if conn is None:
+            mode = 'backup'
+            try:
+                conn = _open_backup_snapshot()
+            except Exception as e:
+                errors.append(f"backup: {e}")
+        if conn is None:
+            mode = 'copy'
+            temp_fd, temp_db_path = tempfile.mkstemp(suffix='.sqlite',
+                                                      prefix='bear_export_')
+            os.close(temp_fd)
+            try:
+                shutil.copy2(bear_db, temp_db_path)
+                conn = sqlite3.connect(temp_db_path)
+            except Exception as e:
+                errors.append(f"copy: {e}")
+                os.remove(temp_db_path)
+                write_log(f"Database snapshot failed ({'; '.join(errors)})")
+                raise RuntimeError("Could not read the Bear database: "
+                                   + '; '.join(errors)) from e
+
+    print(f"Database snapshot: {mode}")
+    if errors:
+        write_log(f"Database snapshot fell back to '{mode}' ({'; '.join(errors)})")
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+        if temp_db_path and os.path.exists(temp_db_path):
+            os.remove(temp_db_path)
 
 
 # ===========================================================================
 # File I/O helpers
 # ===========================================================================
 
-def write_file(filename, file_content, modified, created):
-    # Record whether the file is new *before* we (re-)create it.
-    # The creation date is set via native macOS API (NSFileManager) for
-    # new files only — existing files already have the correct date.
-    is_new_file = not os.path.exists(filename)
+class WriteStats:
+    """Thread-safe tally of write_file() outcomes: written vs unchanged."""
 
-    with open(filename, "w", encoding='utf-8') as f:
-        f.write(file_content)
-    if modified > 0:
-        os.utime(filename, (-1, modified))
-    if created > 0 and is_new_file:
-        _set_creation_date(filename, dt_conv(created))
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
 
+    def reset(self):
+        self.written = self.written_bytes = 0
+        self.unchanged = self.unchanged_bytes = 0
 
-def _set_creation_date(filepath, unix_timestamp):
+    def add(self, size, changed):
+        with self._lock:
+            if changed:
+                self.written += 1
+                self.written_bytes += size
+            else:
+                self.unchanged += 1
+                self.unchanged_bytes += size
+
+    def as_dict(self):
+        return {'written': self.written, 'written_bytes': self.written_bytes,
+                'unchanged': self.unchanged,
+                'unchanged_bytes': self.unchanged_bytes}
+
+    def summary(self):
+        return (f'{self.written} files written ({self.written_bytes / 1024:.0f} KB), '
+                f'{self.unchanged} unchanged ({self.unchanged_bytes / 1024:.0f} KB not rewritten)')
+
+
+write_stats = WriteStats()
+
+
+class RunProfile:
+    """Per-phase wall/CPU time and counts for one run (--profile).
+
+    Code marks a phase with ``with _phase('name'):``.  CPU time is the
+    calling thread's, so phases running on the write pool add up across
+    workers.  Phases may nest — image copies run inside image rewriting
+    ('transform') — so their times are not meant to sum to the total.
+    Every write job and imported file is timed for the slowest-notes
+    list.  start() also turns on tracemalloc and, when *cprofile_path*
+    is set, cProfile; both are imported only then.
+    """
+
+    def __init__(self, top=10, cprofile_path=None):
+        self.top = top
+        self.cprofile_path = cprofile_path
+        self.phases = {}       # name → [wall, cpu, count]
+        self.notes = []        # (wall, label)
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._started = None
+
+    def start(self):
+        import tracemalloc
+        tracemalloc.start()
+        self._started = (time.time(), time.perf_counter(), time.process_time())
+        if self.cprofile_path:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        import tracemalloc
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.cprofile_path)
+        started, t0, c0 = self._started
+        self.total = {'started': datetime.datetime.fromtimestamp(started).isoformat(),
+                      'wall_s': time.perf_counter() - t0,
+                      'cpu_s': time.process_time() - c0}
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        t0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0, time.thread_time() - c0)
+
+    def add(self, name, wall, cpu, count=1):
+        with self._lock:
+            totals = self.phases.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += count
+
+    def note(self, label, wall):
+        """Record the time one note took; only the slowest are kept."""
+        with self._lock:
+            self.notes.append((wall, label))
+            if len(self.notes) > 4 * self.top:
+                self.notes = sorted(self.notes, reverse=True)[:self.top]
+
+    def report(self):
+        return {
+            **self.total,
+            'phases': {name: {'wall_s': w, 'cpu_s': c, 'count': n}
+                       for name, (w, c, n) in sorted(self.phases.items())},
+            'slowest_notes': [{'note': label, 'wall_s': w} for w, label
+                              in sorted(self.notes, reverse=True)[:self.top]],
+            'tracemalloc_peak_bytes': self.peak,
+            'writes': write_stats.as_dict(),
+        }
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+
+_NO_PHASE = contextlib.nullcontext()
+
+
+def _phase(name):
+    """Time the enclosed block as phase *name* when profiling is on."""
+    return run_profile.phase(name) if run_profile is not None else _NO_PHASE
+
+
+def write_file(filename, file_content, modified, created, touch=True,
+               counted=True):
+    """Write *file_content* to *filename* unless it already holds those bytes.
+
+    An unchanged file is only touched for its mtime: set to *modified*,
+    or to now when *modified* is 0 so stamp files still advance — or
+    left alone entirely with touch=False.  A
+    changed file is written to a sibling temp file and renamed over the
+    target, so readers never see a partial note.  When *created* (Core
+    Data time) is known it is set as the creation date after every
+    replace.  Outcomes are counted in write_stats unless counted=False
+    (the stamp files, which change on every run).
     """
-    Set the file's creation date (birthtime) using macOS Foundation API.
+    with _phase('write'):
+        data = file_content.encode('utf-8')
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            st = None
+
+        if st is not None and st.st_size == len(data) and _same_bytes(filename, data):
+            if counted:
+                write_stats.add(len(data), False)
+            if not touch:
+                return
+            if modified <= 0:
+                os.utime(filename)
+            elif st.st_mtime != modified:
+                os.utime(filename, (-1, modified))
+            return
+
+        tmp = _tmp_path(filename)
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            if st is not None:
+                os.chmod(tmp, stat.S_IMODE(st.st_mode))
+            if modified > 0:
+                os.utime(tmp, (-1, modified))
+            os.replace(tmp, filename)
+        except BaseException:
+            _remove_quietly(tmp)
+            raise
+        if counted:
+            write_stats.add(len(data), True)
+
+        # The rename gave the path a new inode, so its birthtime is "now".
+        # Only notes with a known creation date get it back: stamp and
+        # bundle files (created=0) never load the platform backend.
+        if created > 0:
+            _set_creation_date(filename, dt_conv(created))
+
+
+def _same_bytes(filename, data):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def _tmp_path(path):
+    """Sibling temp name unique to this thread, for write-then-rename."""
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
-    Replaces the old `SetFile -d` subprocess call (~50ms per invocation)
-    with a direct NSFileManager attribute write (<1ms, zero process
-    overhead).  For a sync of 20 new files, this saves ~1 second.
 
-    The Foundation framework is part of pyobjc-framework-Cocoa, which
-    is already a dependency (AppKit is imported at the top of this file).
+def _set_creation_date(filepath, unix_timestamp):
+    """
+    Set the file's creation date (birthtime) via the platform backend.
+
+    On macOS this is a direct NSFileManager attribute write (<1ms, zero
+    process overhead) instead of a `SetFile -d` subprocess (~50ms).
+    write_file() calls this after every rewrite of a note with a known
+    creation date, not only for new files: the temp-file rename gives the
+    path a fresh inode whose birthtime is "now".  Foundation is loaded on
+    the first such call.
     """
     try:
-        ns_date = NSDate.dateWithTimeIntervalSince1970_(unix_timestamp)
-        attrs = {NSFileCreationDate: ns_date}
-        NSFileManager.defaultManager().setAttributes_ofItemAtPath_error_(
-            attrs, filepath, None)
+        platform_backend().set_creation_date(filepath, unix_timestamp)
     except Exception as e:
         print(f"Warning: native creation date failed for {filepath}: {e}")
 
@@ -246,374 +982,2704 @@ def read_file(file_name):
         return f.read()
 
 
-def clean_title(title):
-    title = title[:225].strip() or "Untitled"
-    title = RE_CLEAN_TITLE.sub('-', title)
-    title = RE_TRAILING_DASH.sub('', title)
-    return title.strip()
+def clean_title(title):
+    title = unicodedata.normalize('NFC', title)
+    title = title[:225].strip() or "Untitled"
+    title = RE_CLEAN_TITLE.sub('-', title)
+    title = RE_TRAILING_DASH.sub('', title)
+    return title.strip()
+
+
+# ---------------------------------------------------------------------------
+# Path identity
+# ---------------------------------------------------------------------------
+# Exported names are always NFC, but HFS+ hands names back as NFD and some
+# sync clients rewrite them either way.  APFS and HFS+ treat both spellings
+# as one file; ext4 and most NAS shares store them as different bytes.
+# Membership tests on paths therefore go through _nfc(), and a spelling
+# that differs only in normalization is resolved with samefile().
+
+def _nfc(path):
+    return unicodedata.normalize('NFC', path)
+
+
+def _path_key(path):
+    """Identity of *path* on a case-insensitive, normalizing volume."""
+    return _nfc(path).casefold()
+
+
+def _expected_keys(expected_paths):
+    """{NFC path: path} lookup for _is_expected()."""
+    return {_nfc(p): p for p in expected_paths}
+
+
+def _is_expected(path, expected_paths, expected_keys):
+    """True if *path* is one of the expected paths under any normalization.
+
+    A differently-normalized spelling counts only if it is the same file;
+    on byte-preserving file systems it is a leftover duplicate.
+    """
+    if path in expected_paths:
+        return True
+    expected = expected_keys.get(_nfc(path))
+    if expected is None:
+        return False
+    try:
+        return os.path.samefile(path, expected)
+    except OSError:
+        return not os.path.lexists(expected)
+
+
+def _adopt_spelling(path):
+    """Rename a differently-normalized copy of *path* to *path* itself.
+
+    Lets write_file() compare against the existing bytes instead of
+    creating a second file beside the NFD one on ext4-like volumes.
+    """
+    if os.path.lexists(path):
+        return
+    parent, name = os.path.split(path)
+    key = _nfc(name)
+    try:
+        names = os.listdir(parent)
+    except OSError:
+        return
+    for other in names:
+        if _nfc(other) == key:
+            try:
+                os.rename(os.path.join(parent, other), path)
+            except OSError:
+                pass
+            return
+
+
+def _adopt_dir_spelling(path, root):
+    """_adopt_spelling() for each missing folder from *root* down to *path*."""
+    if path == root or not path.startswith(root) or os.path.lexists(path):
+        return
+    _adopt_dir_spelling(os.path.dirname(path), root)
+    _adopt_spelling(path)
+
+
+def _is_under_dir(path, parent):
+    """True if *path* is inside *parent* (both resolved, normalized)."""
+    try:
+        real_path = os.path.realpath(path)
+        real_parent = os.path.realpath(parent)
+        return os.path.commonpath([real_path, real_parent]) == real_parent
+    except Exception:
+        return False
+
+
+def _normalize_local_image_ref(raw_url):
+    """Normalize image URL/path from markdown or HTML src into a local path token."""
+    if raw_url is None:
+        return ""
+    url = urllib.parse.unquote(str(raw_url)).strip()
+    if not url:
+        return ""
+
+    # Strip optional title from markdown image syntax: path "title"
+    # / path 'title' — keep only the path segment.
+    for quote in ('"', "'"):
+        if quote in url:
+            q = url.find(quote)
+            head = url[:q].rstrip()
+            if head:
+                url = head
+                break
+
+    if url.startswith("<") and url.endswith(">"):
+        url = url[1:-1].strip()
+
+    if url.lower().startswith("file://"):
+        parsed = urllib.parse.urlparse(url)
+        fp = urllib.parse.unquote(parsed.path or "")
+        if fp:
+            return fp
+    return url
+
+
+# ---------------------------------------------------------------------------
+# Markdown scanning
+# ---------------------------------------------------------------------------
+# _scan_markdown() walks a note once and yields the link and image
+# constructs the exporter reads or rewrites, as (kind, start, end, text,
+# target) tuples in text order:
+#
+#   bear_image  [image:UUID/name]        text = "UUID/name"
+#   image       ![alt](url "title")      text = alt, target = url "title"
+#   wiki_image  ![[name]]                text = name
+#   html_img    <img src=... alt=...>    text = alt, target = src (or None)
+#   ref_def     [label]: url ...         text = label, target = url
+#   ref_image   ![alt][label], ![alt]    text = alt, target = label or None
+#   link        [text](url)              text = text, target = url
+#   ref_link    [text][label], [text]    text = text, target = label or None
+#   wiki_link   [[name]]                 text = name
+#   code        `span`, fenced block     text = target = None
+#
+# Nothing inside a code span or fence is reported.  A link's text is
+# scanned for nested images, so link spans may enclose others; all other
+# spans are disjoint.  A ref_def span includes its line break.  Inline
+# destinations may contain balanced parentheses.  Brackets, parentheses
+# and backtick runs are paired once per line and substring searches
+# remember their last hit, so time stays linear in the note's length
+# however many unclosed openers a line holds.
+
+# The leading lookahead rejects most positions on their first character;
+# without it every alternative is tried at every offset.
+_MD_TRIGGER = re.compile(
+    r'(?=[`~!\[<]|^ {1,3}[`~])'
+    r'(?:(?P<fence>^ {0,3}(?:`{3,}|~{3,}))|(?P<ticks>`+)|(?P<bang>!)?\[|(?P<img><img\b))',
+    re.MULTILINE | re.IGNORECASE)
+_MD_PAIR = re.compile(r'\\.|[\[\]()]')
+_MD_TICKS = re.compile(r'`+')
+_MD_FENCE_END = {
+    '`': re.compile(r'^ {0,3}(`{3,})[ \t]*$', re.MULTILINE),
+    '~': re.compile(r'^ {0,3}(~{3,})[ \t]*$', re.MULTILINE),
+}
+
+
+def _md_pairs(text, start, end):
+    """{opening index: closing index} for the [] and () pairs in text[start:end]."""
+    pairs = {}
+    square, paren = [], []
+    for m in _MD_PAIR.finditer(text, start, end):
+        c = m.group()
+        if c == '[':
+            square.append(m.start())
+        elif c == '(':
+            paren.append(m.start())
+        elif c == ']':
+            if square:
+                pairs[square.pop()] = m.start()
+        elif c == ')':
+            if paren:
+                pairs[paren.pop()] = m.start()
+    return pairs
+
+
+def _scan_markdown(text):
+    """Yield (kind, start, end, text, target) spans of *text*; see above."""
+    n = len(text)
+    line_start = line_end = -1
+    pairs = ticks = None
+    found = {}          # substring -> (from, limit, index) of its last find
+    skip = None         # (close, end) of the link whose text is being scanned
+
+    def find(sub, i, limit):
+        hit = found.get(sub)
+        if (hit is not None and hit[0] <= i and hit[1] == limit
+                and (hit[2] < 0 or hit[2] >= i)):
+            return hit[2]
+        j = text.find(sub, i, limit)
+        found[sub] = (i, limit, j)
+        return j
+
+    pos = 0
+    while True:
+        m = _MD_TRIGGER.search(text, pos)
+        if m is None:
+            return
+        i = m.start()
+        if skip is not None and i >= skip[0]:
+            # Past the link text: the destination or label is not rescanned.
+            pos, skip = max(pos, skip[1]), None
+            continue
+        if i > line_end:
+            line_start = text.rfind('\n', 0, i) + 1
+            line_end = text.find('\n', i)
+            if line_end < 0:
+                line_end = n
+            pairs = ticks = None
+
+        run = m.group('ticks')
+        fence = m.group('fence')
+        if fence is not None:
+            run = fence.lstrip(' ')
+            if run[0] == '~' or '`' not in text[m.end():line_end]:
+                close = _MD_FENCE_END[run[0]]
+                end = n
+                body = line_end + 1
+                while body < n:
+                    f = close.search(text, body)
+                    if f is None:
+                        break
+                    if len(f.group(1)) >= len(run):
+                        end = f.end()
+                        break
+                    body = f.end() + 1
+                yield ('code', i, end, None, None)
+                pos = end
+                continue
+            i = m.end() - len(run)      # an inline backtick run after all
+
+        if run is not None:
+            if ticks is None:
+                ticks = {}
+                for t in _MD_TICKS.finditer(text, line_start, line_end):
+                    ticks.setdefault(len(t.group()), []).append(t.start())
+                for starts in ticks.values():
+                    starts.reverse()
+            starts = ticks.get(len(run))
+            while starts and starts[-1] <= i:
+                starts.pop()
+            if starts:
+                end = starts.pop() + len(run)
+                yield ('code', i, end, None, None)
+                pos = end
+            else:
+                pos = i + len(run)
+            continue
+
+        if m.group('img') is not None:
+            j = find('>', i + 4, n)
+            if j < 0:
+                pos = i + 4
+                continue
+            tag = text[i:j + 1]
+            src = RE_HTML_IMG_SRC.search(tag)
+            alt = RE_HTML_IMG_ALT.search(tag)
+            yield ('html_img', i, j + 1, alt.group(2) if alt else None,
+                   src.group(2) if src else None)
+            pos = j + 1
+            continue
+
+        if pairs is None:
+            pairs = _md_pairs(text, line_start, line_end)
+        b = m.end() - 1                 # the '['
+        pos = b + 1
+
+        if m.group('bang') is not None:
+            if text.startswith('[[', b):
+                j = find(']]', b + 2, line_end)
+                if j >= 0:
+                    yield ('wiki_image', i, j + 2, text[b + 2:j], None)
+                    pos = j + 2
+                    continue
+            close = pairs.get(b)
+            if close is None:
+                continue
+            alt = text[b + 1:close]
+            nxt = text[close + 1:close + 2]
+            if nxt == '(':
+                end = pairs.get(close + 1)
+                if end is not None:
+                    yield ('image', i, end + 1, alt, text[close + 2:end])
+                    pos = end + 1
+            elif nxt == '[' and pairs.get(close + 1) is not None:
+                end = pairs[close + 1]
+                yield ('ref_image', i, end + 1, alt, text[close + 2:end] or None)
+                pos = end + 1
+            elif alt:
+                yield ('ref_image', i, close + 1, alt, None)
+                pos = close + 1
+            continue
+
+        if text.startswith('[image:', b):
+            j = find(']', b + 7, line_end)
+            if j > b + 7:
+                yield ('bear_image', b, j + 1, text[b + 7:j], None)
+                pos = j + 1
+                continue
+        if text.startswith('[[', b):
+            j = find(']]', b + 2, line_end)
+            if j >= 0:
+                yield ('wiki_link', b, j + 2, text[b + 2:j], None)
+                pos = j + 2
+                continue
+        close = pairs.get(b)
+        if close is None:
+            continue
+        label = text[b + 1:close]
+        nxt = text[close + 1:close + 2]
+        if nxt == ':':
+            if b == line_start and label and not label.startswith('//'):
+                dest = text[close + 2:line_end].split(None, 1)
+                if dest:
+                    end = min(line_end + 1, n)
+                    yield ('ref_def', b, end, label, dest[0])
+                    pos = end
+            continue
+        if nxt in ('(', '['):
+            end = pairs.get(close + 1)
+            if end is None:
+                continue
+            if nxt == '(':
+                yield ('link', b, end + 1, label, text[close + 2:end])
+            else:
+                yield ('ref_link', b, end + 1, label, text[close + 2:end] or None)
+            skip = (close, end + 1)
+        elif label:
+            yield ('ref_link', b, close + 1, label, None)
+            skip = (close, close + 1)
+
+
+def _rewrite_spans(md_text, kinds, replace, spans=None):
+    """Return *md_text* with its *kinds* spans replaced in one pass.
+
+    replace(kind, text, target) returns the new markup, or None to keep
+    the span as it is.  *spans* may be a list from an earlier
+    _scan_markdown() of the same text.  A span inside one already
+    replaced is left alone.
+    """
+    out = []
+    last = 0
+    for kind, start, end, text, target in (
+            _scan_markdown(md_text) if spans is None else spans):
+        if kind not in kinds or start < last:
+            continue
+        new = replace(kind, text, target)
+        if new is None:
+            continue
+        out.append(md_text[last:start])
+        out.append(new)
+        last = end
+    if not out:
+        return md_text
+    out.append(md_text[last:])
+    return ''.join(out)
+
+
+def _html_img_alt(alt):
+    """Markdown alt text for an <img> tag's alt attribute."""
+    alt = (alt if alt is not None else "image").strip() or "image"
+    return alt.replace(']', r'\]')
+
+
+def _html_img_markdown(alt, src):
+    """![alt](src) for an <img> tag's attributes, or None without a src."""
+    src = (src or '').strip()
+    if not src:
+        return None
+    return f"![{_html_img_alt(alt)}]({src})"
+
+
+def _convert_html_img_to_markdown(md_text):
+    """Convert HTML <img ... src=...> tags to markdown image syntax."""
+    return _rewrite_spans(md_text, ('html_img',),
+                          lambda kind, alt, src: _html_img_markdown(alt, src))
+
+# ---------------------------------------------------------------------------
+# Tag scanning
+# ---------------------------------------------------------------------------
+# Bear's tag rules, as the text fallback sees them: a tag starts with '#'
+# at the start of the note or after whitespace, outside code spans and
+# fences.  "#multi word tag#" runs to a closing '#' followed by whitespace
+# (no leading digit or trailing space); otherwise "#name" takes the
+# following run of word characters, '.', '-' and '/' (nested "a/b").
+# Each match stops at the next '#', so a line full of '#' costs time
+# linear in its length.  The pattern starts with the literal '#' so the
+# regex engine can skip ahead to candidates; group 1 is a multi-word tag,
+# group 2 a simple one.
+
+_TAG = re.compile(r'#(?<!\S#)(?=[.\w/\-])'
+                  r'(?:((?!\d)[.\w/][.\w/ ]*?[.\w/])#(?=\s|\Z)|([.\w/\-]+))')
+
+
+def _code_regions(md_text):
+    """(start, end) of each code span and fence in *md_text*."""
+    if '`' not in md_text and '~~~' not in md_text:
+        return []
+    return [(start, end) for kind, start, end, _, _ in _scan_markdown(md_text)
+            if kind == 'code']
+
+
+def _scan_tags(md_text):
+    """Yield (start, end, tag) for each tag in *md_text*, in text order."""
+    code = _code_regions(md_text)
+    if not code:
+        for m in _TAG.finditer(md_text):
+            yield m.start(), m.end(), m.group(1) or m.group(2)
+        return
+    c = 0
+    pos = 0
+    while True:
+        m = _TAG.search(md_text, pos)
+        if m is None:
+            return
+        i = m.start()
+        while c < len(code) and code[c][1] <= i:
+            c += 1
+        if c < len(code) and code[c][0] <= i:
+            pos = code[c][1]
+            continue
+        yield i, m.end(), m.group(1) or m.group(2)
+        pos = m.end()
+
+
+# ===========================================================================
+# Export phase helpers
+# ===========================================================================
+
+# ---------------------------------------------------------------------------
+# Stale-file cleanup (replaces rsync --delete)
+# ---------------------------------------------------------------------------
+
+_CLEANUP_SKIP_DIRS = frozenset({
+    'BearImages', '.obsidian',
+})
+_CLEANUP_SKIP_DIR_PREFIXES = ('.Ulysses',)
+_CLEANUP_SKIP_FILES = frozenset({
+    '.sync-time.log', '.export-time.log', '.export-manifest.json',
+    '.image-index.json',
+})
+
+
+def _cleanup_stale_notes(target, expected_paths: set) -> int:
+    """Remove exported note files/bundles no longer in Bear.
+
+    Walks the target's export folder once, skipping excluded directories (BearImages,
+    .obsidian, .Ulysses*) and sentinel files.  Anything that looks like
+    a note file or textbundle that is NOT in *expected_paths* is deleted.
+    """
+    export_path = target.export_path
+    if not os.path.isdir(export_path):
+        return 0
+    removed = 0
+    empty_dirs = []
+    expected_keys = _expected_keys(expected_paths)
+
+    for root, dirs, files in os.walk(export_path, topdown=True):
+        keep = []
+        for d in dirs:
+            if d in _CLEANUP_SKIP_DIRS:
+                continue
+            if any(d.startswith(pfx) for pfx in _CLEANUP_SKIP_DIR_PREFIXES):
+                continue
+            if d.endswith('.Ulysses_Public_Filter'):
+                continue
+            if d.endswith('.textbundle'):
+                bundle_path = os.path.join(root, d)
+                if not _is_expected(bundle_path, expected_paths, expected_keys):
+                    try:
+                        _remove_path(bundle_path)
+                        removed += 1
+                    except OSError:
+                        pass
+                continue  # don't descend into textbundles either way
+            keep.append(d)
+        dirs[:] = keep
+
+        for fname in files:
+            if fname in _CLEANUP_SKIP_FILES:
+                continue
+            fpath = os.path.join(root, fname)
+            if _is_expected(fpath, expected_paths, expected_keys):
+                continue
+            if any(fname.endswith(ext) for ext in ('.md', '.txt', '.markdown')):
+                try:
+                    os.remove(fpath)
+                    target.images.forget(fpath)
+                    removed += 1
+                except OSError:
+                    pass
+
+        if root != export_path:
+            empty_dirs.append(root)
+
+    # Clean up empty tag directories (deepest first)
+    for d in reversed(sorted(empty_dirs)):
+        try:
+            if os.path.isdir(d) and not os.listdir(d):
+                os.rmdir(d)
+        except OSError:
+            pass
+
+    return removed
+
+
+def _remove_stale_paths(target, stale_paths, expected_paths: set) -> int:
+    """Remove manifest-reported note files/bundles that are no longer expected.
+
+    Empty parent directories (tag folders) are pruned up to the target's
+    export folder.
+    """
+    removed = 0
+    parents = set()
+    expected_keys = _expected_keys(expected_paths)
+    for path in stale_paths:
+        if (_is_expected(path, expected_paths, expected_keys)
+                or not _exact_name_exists(path)):
+            continue
+        try:
+            if _is_real_dir(path) and not path.endswith('.textbundle'):
+                continue
+            if not os.path.lexists(path):
+                continue
+            _remove_path(path)
+            target.images.forget(path)
+            removed += 1
+            parents.add(os.path.dirname(path))
+        except OSError:
+            pass
+
+    root = os.path.normpath(target.export_path)
+    for d in sorted(parents, key=len, reverse=True):
+        while os.path.normpath(d) != root and _is_under_dir(d, root):
+            try:
+                os.rmdir(d)
+            except OSError:
+                break
+            d = os.path.dirname(d)
+    return removed
+
+
+def _exact_name_exists(path):
+    """True if *path* exists under exactly this name.
+
+    On a case-insensitive volume "Note.md" also "exists" after a retitle
+    to "NOTE.md"; checking the directory listing keeps stale-path removal
+    from deleting the renamed file.
+    """
+    parent, name = os.path.split(path)
+    try:
+        return name in os.listdir(parent or '.')
+    except OSError:
+        return False
+
+
+def _local_image_refs(note_text, note_dir):
+    """Absolute local image paths (NFC) linked from *note_text*.
+
+    Relative links resolve against *note_dir*; web links are ignored.
+    """
+    refs = set()
+    for kind, _, _, text, target in _scan_markdown(note_text):
+        if kind == 'image' or kind == 'html_img':
+            img = _normalize_local_image_ref(target)
+        elif kind == 'wiki_image':
+            img = _normalize_local_image_ref(text)
+        else:
+            continue
+        if not img or img.startswith("http://") or img.startswith("https://"):
+            continue
+        abs_img = img if os.path.isabs(img) else os.path.normpath(os.path.join(note_dir, img))
+        refs.add(_nfc(abs_img))
+    return refs
+
+
+def _collect_referenced_local_images(root_path):
+    """Return {note path: local image paths it links} for notes in *root_path*."""
+    refs = {}
+    if not os.path.isdir(root_path):
+        return refs
+
+    for root, dirs, files in os.walk(root_path, topdown=True):
+        dirs[:] = [d for d in dirs
+                   if d not in _CLEANUP_SKIP_DIRS
+                   and d != '.git'
+                   and d != '__pycache__'
+                   and not any(d.startswith(pfx) for pfx in _CLEANUP_SKIP_DIR_PREFIXES)]
+
+        for fname in files:
+            if not (fname.endswith('.md') or fname.endswith('.txt') or fname.endswith('.markdown')):
+                continue
+            note_path = os.path.join(root, fname)
+            try:
+                note_text = read_file(note_path)
+            except Exception:
+                continue
+            refs[note_path] = _local_image_refs(note_text, root)
+
+    return refs
+
+
+class ImageIndex:
+    """Persistent record of which note files link which local images.
+
+    Stored as JSON beside the manifest: note path → image paths, both
+    relative to the export folder; the reverse map (image → notes) is
+    rebuilt in memory on load.  Only notes written, moved, removed or
+    imported in a run are updated.  An image whose last reference goes
+    away becomes *pending*, stamped with that time, so orphan cleanup
+    checks those few images instead of re-reading every note.  Without
+    a usable index the export folder is scanned once to build it.
+    """
+
+    VERSION = 1
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, image_index_file)
+        self.notes = {}        # note rel → [image rel]
+        self.pending = {}      # image rel → time it lost its last reference
+        self.users = {}        # image rel → {note rel}, derived from notes
+        self.loaded = False
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        self.notes, self.pending, self.users = {}, {}, {}
+        self.loaded = self.dirty = False
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (not isinstance(data, dict)
+                or data.get('version') != self.VERSION
+                or not isinstance(data.get('notes'), dict)
+                or not isinstance(data.get('pending'), dict)):
+            return False
+        self.notes = data['notes']
+        self.pending = data['pending']
+        for note, images in self.notes.items():
+            for image in images:
+                self.users.setdefault(image, set()).add(note)
+        self.loaded = True
+        return True
+
+    def rel(self, path):
+        return _nfc(os.path.relpath(path, self.root))
+
+    def set(self, note_path, image_paths):
+        """Record that the file at *note_path* now links *image_paths*."""
+        note = self.rel(note_path)
+        new = sorted({self.rel(p) for p in image_paths})
+        with self._lock:
+            old = self.notes.get(note, [])
+            if old == new:
+                return
+            now = time.time()
+            for image in set(old) - set(new):
+                users = self.users.get(image, set())
+                users.discard(note)
+                if not users:
+                    self.users.pop(image, None)
+                    self.pending.setdefault(image, now)
+            for image in new:
+                self.users.setdefault(image, set()).add(note)
+                self.pending.pop(image, None)
+            if new:
+                self.notes[note] = new
+            else:
+                self.notes.pop(note, None)
+            self.dirty = True
+
+    def forget(self, note_path):
+        """The file at *note_path* was removed or moved away."""
+        self.set(note_path, ())
+
+    def rebuild(self, assets_path):
+        """Scan every note and image once; unlinked images become pending."""
+        self.notes, self.users = {}, {}
+        for note_path, refs in _collect_referenced_local_images(self.root).items():
+            self.set(note_path, refs)
+        candidates = set()
+        try:
+            candidates.update(self.rel(os.path.join(self.root, f))
+                              for f in os.listdir(self.root)
+                              if f.lower().endswith(_IMAGE_FILE_EXTS))
+        except OSError:
+            pass
+        for root, _, files in os.walk(assets_path):
+            candidates.update(self.rel(os.path.join(root, f)) for f in files
+                              if not f.startswith('.'))
+        now = time.time()
+        self.pending = {image: self.pending.get(image, now)
+                        for image in candidates if image not in self.users}
+        self.loaded = self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {'version': self.VERSION, 'notes': self.notes,
+                'pending': self.pending}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def _cleanup_root_orphan_images(target):
+    """Remove root-level images that are no longer referenced and already mirrored in BearImages.
+
+    Candidates are the index's pending images at the top of the export
+    folder.  With --imageGC dry-run they are only listed.
+    """
+    index = target.images
+    export_path = target.export_path
+    assets_rel = index.rel(target.assets_path)
+    candidates = [rel for rel in index.pending
+                  if os.sep not in rel and rel.lower().endswith(_IMAGE_FILE_EXTS)]
+    if not candidates:
+        return 0
+
+    asset_basenames = {os.path.basename(rel) for rel in index.users
+                       if rel.startswith(assets_rel + os.sep)}
+
+    removed = 0
+    for rel in candidates:
+        fpath = os.path.join(export_path, rel)
+        if not os.path.isfile(fpath):
+            del index.pending[rel]
+            index.dirty = True
+            continue
+        if rel not in asset_basenames:
+            # Conservative: only remove when a canonical copy exists in BearImages.
+            continue
+        if image_gc == 'dry-run':
+            print(f'Would remove orphan root image: {rel}')
+            continue
+        try:
+            os.remove(fpath)
+            removed += 1
+            write_log('Removed orphan root image: ' + rel)
+        except OSError:
+            continue
+        del index.pending[rel]
+        index.dirty = True
+    return removed
+
+
+def _collect_image_garbage(target):
+    """Remove images in assets_path that no note has linked for image_gc_grace seconds.
+
+    Only the index's pending images are looked at, so the cost follows
+    what changed.  'dry-run' lists what would go; 'off' does nothing.
+    Empty per-image folders are removed with their last file.
+    """
+    if image_gc == 'off':
+        return 0
+    index = target.images
+    assets_rel = index.rel(target.assets_path)
+    cutoff = time.time() - image_gc_grace
+    due = sorted(rel for rel, since in index.pending.items()
+                 if rel.startswith(assets_rel + os.sep) and since <= cutoff)
+    removed = 0
+    for rel in due:
+        fpath = os.path.join(target.export_path, rel)
+        if rel in index.users or not os.path.isfile(fpath):
+            del index.pending[rel]
+            index.dirty = True
+            continue
+        if image_gc == 'dry-run':
+            print(f'Would remove unreferenced image: {rel}')
+            continue
+        try:
+            os.remove(fpath)
+        except OSError:
+            continue
+        removed += 1
+        write_log('Removed unreferenced image: ' + rel)
+        del index.pending[rel]
+        index.dirty = True
+        parent = os.path.dirname(fpath)
+        if os.path.normpath(parent) != os.path.normpath(target.assets_path):
+            with contextlib.suppress(OSError):
+                os.rmdir(parent)
+    return removed
+
+
+def _collect_store_garbage():
+    """Run ImageStore.collect_garbage() against every target's image index."""
+    referenced = []
+    for target in targets:
+        if target.is_archive:
+            continue
+        if target.images.loaded or target.images.load():
+            referenced += [os.path.join(target.export_path, rel)
+                           for rel in target.images.users]
+    with _phase('orphan_cleanup'):
+        blobs, entries = image_store.collect_garbage(
+            referenced, image_gc_grace, image_gc == 'dry-run')
+    if blobs or entries:
+        print(f'Cleaned {blobs} unused blobs and {entries} stale cache '
+              f'entries from {image_store.root}')
+
+
+def write_time_stamp(target):
+    msg = "Markdown from Bear written at: " + datetime.datetime.now().strftime("%Y-%m-%d at %H:%M:%S")
+    write_file(target.export_ts_file, msg, 0, 0, counted=False)
+    write_file(target.sync_ts_file, msg, 0, 0, counted=False)
+
+
+def hide_tags(md_text):
+    """Blank every line after the first that starts with a tag."""
+    if not hide_tags_in_comment_block or '#' not in md_text:
+        return md_text
+    out = []
+    last = 0
+    line_end = -1
+    for start, _, _ in _scan_tags(md_text):
+        if start <= line_end:
+            continue            # only a line's first tag can open it
+        line_start = md_text.rfind('\n', 0, start) + 1
+        line_end = md_text.find('\n', start)
+        if line_end < 0:
+            line_end = len(md_text)
+        if line_start and not md_text[line_start:start].strip(' \t'):
+            out.append(md_text[last:line_start])
+            last = line_end
+    if not out:
+        return md_text
+    out.append(md_text[last:])
+    return ''.join(out)
+
+
+def restore_tags(md_text):
+    # hide_tags_in_comment_block strips the tag lines on export;
+    # restoring them on import is not straightforward without storing them —
+    # this function is intentionally a no-op (tags are not recoverable from
+    # the stripped file).
+    return md_text
+
+
+# ===========================================================================
+# Export manifest (UUID → exported paths)
+# ===========================================================================
+
+def _content_hash(text):
+    """Hash of a rendered note, used to detect real content changes."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _manifest_settings(target):
+    """Export options that affect *target*'s rendered output or paths.
+
+    A manifest written under different settings is not trusted — the
+    export falls back to the stat-based check and a full cleanup walk.
+    """
+    return {
+        'format': target.fmt,
+        'hide_tags': bool(hide_tags_in_comment_block),
+        'exclude_tags': sorted(no_export_tags),
+        'tag_folders': ([make_tag_folders, multi_tag_folders, tag_folder_links]
+                        if make_tag_folders else [False]),
+        'only_tags': sorted(only_export_these_tags),
+        'assets': os.path.relpath(target.assets_path, target.export_path),
+    }
+
+
+class ExportManifest:
+    """Persistent per-note record of the last export, keyed by Bear UUID.
+
+    Stored as JSON beside .export-time.log.  Each entry holds the note's
+    ZMODIFICATIONDATE, a hash of its rendered text and the paths it was
+    written to (relative to the export folder).  Up-to-date checks,
+    retitles and deletions then come from an in-memory diff instead of
+    a stat per note plus a walk of the whole export folder.
+    """
+
+    VERSION = 1
+
+    def __init__(self, root, settings):
+        self.root = root
+        self.path = os.path.join(root, export_manifest)
+        self.settings = settings
+        self.notes = {}        # uuid → {"mod": float, "hash": str, "paths": [rel]}
+        self.loaded = False    # True once a compatible manifest was read
+        self._seen = set()
+        self._dropped = set()  # rel paths a note no longer exports to
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (not isinstance(data, dict)
+                or data.get('version') != self.VERSION
+                or data.get('settings') != self.settings
+                or not isinstance(data.get('notes'), dict)):
+            return False
+        self.notes = data['notes']
+        self.loaded = True
+        return True
+
+    def paths(self, uuid):
+        """Absolute paths recorded for *uuid* (empty for excluded notes)."""
+        entry = self.notes.get(uuid)
+        if not entry:
+            return []
+        return [os.path.join(self.root, rel) for rel in entry['paths']]
+
+    def unchanged_since(self, uuid, modified):
+        """True if *uuid* still has the modification date last exported."""
+        if not self.loaded:
+            return False
+        entry = self.notes.get(uuid)
+        return bool(entry) and entry.get('mod') == modified
+
+    def on_disk(self, uuid):
+        """True if every path recorded for *uuid* still exists.
+
+        One lstat per path: an exported note the user deleted or moved
+        is written again although Bear's copy did not change.
+        """
+        return all(os.path.lexists(p) for p in self.paths(uuid))
+
+    def keep(self, uuid):
+        """Mark *uuid* as present and unchanged; return its absolute paths."""
+        self._seen.add(uuid)
+        return self.paths(uuid)
+
+    def is_current(self, uuid, digest, stems):
+        """True if *uuid* was last exported with this content to *stems*.
+
+        *stems* are the extension-less target paths for this run; a
+        changed title or tag set makes the note out of date even when
+        its text hash matches.
+        """
+        self._seen.add(uuid)
+        if not self.loaded:
+            return False
+        entry = self.notes.get(uuid)
+        if not entry or entry.get('hash') != digest:
+            return False
+        recorded = sorted(os.path.splitext(p)[0] for p in self.paths(uuid))
+        return recorded == sorted(stems)
+
+    def record(self, uuid, modified, digest, paths):
+        """Record that *uuid* now lives at the absolute *paths*."""
+        self._seen.add(uuid)
+        rel_paths = sorted(_nfc(os.path.relpath(p, self.root)) for p in paths)
+        old = self.notes.get(uuid)
+        if old:
+            self._dropped.update(set(old['paths']) - set(rel_paths))
+        self.notes[uuid] = {'mod': modified, 'hash': digest, 'paths': rel_paths}
+
+    def finish(self):
+        """Forget notes not seen this run; return absolute paths to remove."""
+        stale = set(self._dropped)
+        for uuid in [u for u in self.notes if u not in self._seen]:
+            stale.update(self.notes.pop(uuid)['paths'])
+        self._dropped.clear()
+        return sorted(os.path.join(self.root, rel) for rel in stale)
+
+    def save(self):
+        data = {'version': self.VERSION, 'settings': self.settings,
+                'notes': self.notes}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+
+class PathAllocator:
+    """Hands each note an output stem no other note uses this run.
+
+    clean_title() maps duplicate titles — and titles differing only in
+    case or Unicode normalization, which are one file on APFS — to the
+    same name, so those notes overwrote each other on every run.  Stems
+    are compared by _path_key().  Unchanged notes claim their recorded
+    paths first; a path the manifest recorded for another note still in
+    Bear, and still named after that note's current title, stays
+    reserved for it, so which note gets the bare name does not flip
+    between runs.  A note retitled away from a name releases it in the
+    same run.  The others get " - 02", " - 03", ... which the manifest
+    then records, keeping the suffix stable.
+
+    *live_titles* maps the UUID of every note in Bear to its ZTITLE.
+    """
+
+    def __init__(self, manifest, live_titles):
+        self._owner = {}       # key → uuid that claimed it this run
+        self._reserved = {}    # key → uuid that held it last run
+        if manifest.loaded:
+            for uuid, entry in manifest.notes.items():
+                if uuid not in live_titles or not entry['paths']:
+                    continue
+                name = _path_key(clean_title(live_titles[uuid] or ''))
+                for rel in entry['paths']:
+                    stem = os.path.splitext(os.path.join(manifest.root, rel))[0]
+                    base = os.path.basename(stem)
+                    if name in (_path_key(base),
+                                _path_key(RE_ALLOCATED_SUFFIX.sub('', base))):
+                        self._reserved[_path_key(stem)] = uuid
+        self.collisions = []   # (uuid, wanted stem, assigned stem)
+
+    def claim(self, uuid, paths):
+        """Register the recorded *paths* of a note kept unchanged."""
+        for path in paths:
+            self._owner.setdefault(_path_key(os.path.splitext(path)[0]), uuid)
+
+    def _free(self, key, uuid):
+        return (self._owner.get(key, uuid) == uuid
+                and self._reserved.get(key, uuid) == uuid)
+
+    def allocate(self, uuid, stem):
+        """Return the extension-less path *uuid* should use for *stem*."""
+        candidate, n = stem, 1
+        while not self._free(_path_key(candidate), uuid):
+            n += 1
+            candidate = f'{stem} - {n:02d}'
+        self._owner[_path_key(candidate)] = uuid
+        if candidate != stem:
+            self.collisions.append((uuid, stem, candidate))
+        return candidate
+
+
+# ===========================================================================
+# Archive sink (--format zip / tar)
+# ===========================================================================
+
+ARCHIVE_FORMATS = ('zip', 'tar')
+archive_prefix  = 'bear-export-'
+
+
+RE_ARCHIVE_NAME = re.compile(re.escape(archive_prefix)
+                             + r'(\d{8}-\d{6})(?:-(\d{2,}))?(?:-incremental)?\.(\w+)$')
+
+
+def _latest_archive(folder, fmt):
+    """Name of the newest finished archive of *fmt* in *folder*, or None.
+
+    Ordered by (stamp, sequence) parsed from the name: plain string
+    order would put "-02-incremental" before "-incremental".
+    """
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return None
+    newest, newest_key = None, None
+    for name in names:
+        m = RE_ARCHIVE_NAME.match(name)
+        if m is None or m.group(3) != fmt:
+            continue
+        key = (m.group(1), int(m.group(2) or 1))
+        if newest_key is None or key > newest_key:
+            newest, newest_key = name, key
+    return newest
+
+
+class ExportArchive:
+    """One export run streamed into a single zip or tar file in *folder*.
+
+    Notes are added as Markdown members, and their images under
+    BearImages/, as they leave the export loop, so a snapshot is one
+    sequential write instead of a folder of small files archived
+    afterwards.  Images are stored as they are; zip note members are
+    deflated.  Tag-folder copies are hard-link members in a tar and
+    plain duplicates in a zip.
+
+    The file is written under a temp name and renamed into place by
+    close(), which adds index.json last: each UUID's member names, the
+    image members and, for an incremental archive, *base* (the previous
+    archive in the folder) and the members removed since.
+    """
+
+    def __init__(self, folder, fmt, incremental=False):
+        self.fmt = fmt
+        self.incremental = incremental
+        self.base = _latest_archive(folder, fmt) if incremental else None
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        kind = '-incremental' if incremental else ''
+        self.name = f'{archive_prefix}{stamp}{kind}.{fmt}'
+        n = 1
+        while os.path.exists(os.path.join(folder, self.name)):
+            n += 1
+            self.name = f'{archive_prefix}{stamp}-{n:02d}{kind}.{fmt}'
+        self.path = os.path.join(folder, self.name)
+        self.notes = {}        # uuid → [member]
+        self.images = []
+        self._members = set()
+        self._tmp = _tmp_path(self.path)
+        if fmt == 'zip':
+            import zipfile
+            self._zipfile = zipfile
+            self._file = zipfile.ZipFile(self._tmp, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            import tarfile
+            self._tarfile = tarfile
+            self._file = tarfile.open(self._tmp, 'w', format=tarfile.PAX_FORMAT)
+
+    def _add_bytes(self, member, data, mtime):
+        if self.fmt == 'zip':
+            zipfile = self._zipfile
+            # Zip timestamps start at 1980.
+            info = zipfile.ZipInfo(member, time.localtime(max(mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self._file.writestr(info, data)
+        else:
+            info = self._tarfile.TarInfo(member)
+            info.size = len(data)
+            info.mtime = mtime
+            info.mode = 0o644
+            self._file.addfile(info, io.BytesIO(data))
+        self._members.add(member)
+
+    def add_note(self, uuid, member, md_text, mtime, same_as=None):
+        """Add a note; *same_as* names a member already holding this text."""
+        with _phase('write'):
+            data = md_text.encode('utf-8')
+            if same_as is not None and self.fmt == 'tar':
+                info = self._tarfile.TarInfo(member)
+                info.type = self._tarfile.LNKTYPE
+                info.linkname = same_as
+                info.mtime = mtime
+                info.mode = 0o644
+                self._file.addfile(info)
+                self._members.add(member)
+            else:
+                self._add_bytes(member, data, mtime)
+            self.notes.setdefault(uuid, []).append(member)
+            write_stats.add(len(data), True)
+
+    def add_image(self, src, member):
+        """Add the image file *src* as *member* unless it is already in."""
+        if member in self._members:
+            return
+        with _phase('image_copy'):
+            if self.fmt == 'zip':
+                self._file.write(src, member, compress_type=self._zipfile.ZIP_STORED)
+            else:
+                self._file.add(src, member, recursive=False)
+            self._members.add(member)
+            self.images.append(member)
+            write_stats.add(os.path.getsize(src), True)
+
+    def close(self, removed=()):
+        """Write index.json, finish the file and move it into place."""
+        index = {
+            'version': 1,
+            'archive': self.name,
+            'mode': 'incremental' if self.incremental else 'full',
+            'base': self.base,
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'notes': self.notes,
+            'images': sorted(self.images),
+            'removed': sorted(removed),
+        }
+        data = json.dumps(index, ensure_ascii=False, indent=1).encode('utf-8')
+        self._add_bytes('index.json', data, time.time())
+        self._file.close()
+        os.replace(self._tmp, self.path)
+        return self.path
+
+    def abort(self):
+        """Drop the unfinished archive."""
+        try:
+            self._file.close()
+        except Exception:
+            pass
+        _remove_quietly(self._tmp)
+
+
+def _archive_note(target, uuid, md_text, file_list, mod_dt, image_map, image_dirs):
+    """Add a note and its images to *target*'s archive; return its paths.
+
+    Paths are the notes' would-be locations under the export folder, so
+    the manifest and PathAllocator treat them like files on disk.
+    """
+    with _phase('transform'):
+        md_proc = process_image_links(md_text, file_list[0], image_map,
+                                      image_dirs, target)
+    paths = []
+    for filepath in file_list:
+        out = filepath + '.md'
+        member = _nfc(os.path.relpath(out, target.export_path)).replace(os.sep, '/')
+        target.archive.add_note(uuid, member, md_proc, mod_dt,
+                                same_as=target.archive.notes[uuid][0]
+                                if paths else None)
+        paths.append(out)
+    return paths
+
+
+def _finish_archive(target):
+    """Close *target*'s archive, then stamp it and save the manifest."""
+    manifest = target.manifest
+    stale = manifest.finish()
+    removed = [_nfc(os.path.relpath(p, target.export_path)).replace(os.sep, '/')
+               for p in stale]
+    archive = target.archive
+    target.archive = None
+    target.removed = len(removed)
+    if archive.incremental and not (archive.notes or archive.images or removed):
+        # Nothing added or removed: an empty incremental is just noise.
+        archive.abort()
+        path = None
+    else:
+        path = archive.close(removed if archive.incremental else ())
+    write_time_stamp(target)
+    manifest.save()
+    if path is None:
+        print(f'No changes since {archive.base}, no archive written')
+        write_log(f'No changes since {archive.base}, no archive written '
+                  f'to: {target.export_path}')
+        return
+    print(f'Archived {target.written} notes to {path}')
+    write_log(f'{target.written} notes archived to: {path} '
+              f'({len(removed)} removed since the last archive)')
+
+
+# ===========================================================================
+# Note indexes (--mirror)
+# ===========================================================================
+
+class ExportedNote:
+    """One note as export_markdown() hands it to the note indexes.
+
+    *created* and *modified* are Unix timestamps; *text* is the rendered
+    Markdown before per-target image rewriting; *paths* are the note's
+    files relative to the primary export folder.
+    """
+    __slots__ = ('uuid', 'title', 'created', 'modified', 'tags',
+                 'attachments', 'text', 'paths')
+
+    def __init__(self, uuid, title, created, modified, tags, attachments,
+                 text, paths):
+        self.uuid = uuid
+        self.title = title
+        self.created = created
+        self.modified = modified
+        self.tags = tags
+        self.attachments = attachments
+        self.text = text
+        self.paths = paths
+
+
+def _primary_manifest():
+    """The primary target's manifest: this run's, or the one on disk."""
+    target = targets[0]
+    if target.manifest is not None:
+        return target.manifest
+    manifest = ExportManifest(target.export_path, _manifest_settings(target))
+    manifest.load()
+    return manifest
+
+
+def _index_settings():
+    """Options the note indexes' stored rows depend on.
+
+    hide_tags changes the rendered text; the primary target's folder and
+    path settings (format, tag folders, ...) change ExportedNote.paths.
+    An index stored under other settings refreshes every note.
+    """
+    primary = targets[0] if targets else None
+    return {'hide_tags': bool(hide_tags_in_comment_block),
+            'paths': ([primary.export_path, _manifest_settings(primary)]
+                      if primary is not None else None)}
+
+
+class SQLiteNoteIndex(abc.ABC):
+    """Base for the SQLite files export_markdown() keeps in step with Bear.
+
+    Subclasses define _SCHEMA (with a notes table holding uuid and
+    modified), _TABLES, update() and _delete().  A note is rewritten only
+    when its modification date differs from the one stored, notes gone
+    from Bear are deleted, and each run is one transaction.  WAL mode
+    lets readers query the file while an export writes.
+    """
+
+    VERSION = 1
+    _SCHEMA = ()
+    _TABLES = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.settings = None
+        self._conn = None
+        self._mods = {}        # uuid → modified, as stored
+        self.updated = 0
+        self.removed = 0
+
+    def _meta(self, conn, key):
+        try:
+            row = conn.execute("SELECT value FROM index_meta WHERE key = ?",
+                               (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(row[0]) if row else None
+
+    def behind(self):
+        """True if Bear's database changed since the index was last updated."""
+        if not os.path.exists(self.path):
+            return True
+        conn = sqlite3.connect(self.path)
+        try:
+            stamp = self._meta(conn, 'db_mtime')
+        finally:
+            conn.close()
+        return stamp is None or get_file_date(bear_db) > stamp
+
+    def begin(self):
+        """Open the index and load the modification dates it holds.
+
+        An index written by another schema version is rebuilt; one made
+        with other _index_settings() is refreshed note by note.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.settings = _index_settings()
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS index_meta ("
+                     "  key TEXT PRIMARY KEY, value TEXT)")
+        if self._meta(conn, 'version') not in (None, self.VERSION):
+            for table in self._TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute("DELETE FROM index_meta")
+        for stmt in self._SCHEMA:
+            conn.execute(stmt)
+        self._mods = {}
+        if self._meta(conn, 'settings') == self.settings:
+            self._mods = dict(conn.execute("SELECT uuid, modified FROM notes"))
+        self._conn = conn
+        self.updated = self.removed = 0
+
+    def is_current(self, uuid, modified):
+        """True if *uuid* is stored with Bear modification date *modified*."""
+        return self._mods.get(uuid) == dt_conv(modified)
+
+    @abc.abstractmethod
+    def update(self, note):
+        """Insert or replace *note* (an ExportedNote)."""
+
+    @abc.abstractmethod
+    def _delete(self, uuid):
+        """Delete *uuid*'s rows from every table."""
+
+    def remove(self, uuid):
+        """Delete *uuid* from the index."""
+        self._delete(uuid)
+        if self._mods.pop(uuid, None) is not None:
+            self.removed += 1
+
+    def finish(self, live):
+        """Delete notes not in *live*, stamp the run and commit."""
+        for uuid in [u for u in self._mods if u not in live]:
+            self.remove(uuid)
+        for key, value in (('version', self.VERSION),
+                           ('settings', self.settings),
+                           ('db_mtime', get_file_date(bear_db))):
+            self._conn.execute(
+                "INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)))
+        self._conn.commit()
+        self._conn.close()
+        self._conn = None
+        write_log(f'{type(self).__name__} {self.path}: {self.updated} notes '
+                  f'updated, {self.removed} removed')
+
+    def abort(self):
+        """Roll back this run's changes."""
+        if self._conn is not None:
+            self._conn.rollback()
+            self._conn.close()
+            self._conn = None
+
+
+class NoteMirror(SQLiteNoteIndex):
+    """SQLite copy of every exported note's metadata and rendered text.
+
+    Downstream tools query it by UUID, tag or date instead of walking
+    and parsing the export folder.
+
+    Tables: notes (uuid, title, created, modified, text, paths — dates
+    in Unix seconds, paths a JSON list relative to the primary export
+    folder), note_tags (uuid, tag — nested tags only, "a/b" without
+    "a") and attachments (uuid, filename, file_uuid).
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS notes ("
+        "  uuid TEXT PRIMARY KEY, title TEXT NOT NULL,"
+        "  created REAL, modified REAL, text TEXT NOT NULL,"
+        "  paths TEXT NOT NULL DEFAULT '[]')",
+        "CREATE INDEX IF NOT EXISTS notes_modified ON notes (modified)",
+        "CREATE INDEX IF NOT EXISTS notes_created ON notes (created)",
+        "CREATE INDEX IF NOT EXISTS notes_title ON notes (title)",
+        "CREATE TABLE IF NOT EXISTS note_tags ("
+        "  tag TEXT NOT NULL, uuid TEXT NOT NULL,"
+        "  PRIMARY KEY (tag, uuid)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS note_tags_uuid ON note_tags (uuid)",
+        "CREATE TABLE IF NOT EXISTS attachments ("
+        "  uuid TEXT NOT NULL, filename TEXT NOT NULL, file_uuid TEXT,"
+        "  PRIMARY KEY (uuid, filename)) WITHOUT ROWID",
+    )
+    _TABLES = ('notes', 'note_tags', 'attachments')
+
+    def update(self, note):
+        """Insert or replace *note* (an ExportedNote)."""
+        conn = self._conn
+        conn.execute(
+            "INSERT OR REPLACE INTO notes "
+            "(uuid, title, created, modified, text, paths) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (note.uuid, note.title, note.created, note.modified, note.text,
+             json.dumps(note.paths, ensure_ascii=False)))
+        conn.execute("DELETE FROM note_tags WHERE uuid = ?", (note.uuid,))
+        conn.executemany("INSERT OR IGNORE INTO note_tags (tag, uuid) VALUES (?, ?)",
+                         [(tag, note.uuid) for tag in note.tags])
+        conn.execute("DELETE FROM attachments WHERE uuid = ?", (note.uuid,))
+        conn.executemany(
+            "INSERT INTO attachments (uuid, filename, file_uuid) VALUES (?, ?, ?)",
+            [(note.uuid, name, file_uuid)
+             for name, file_uuid in sorted(note.attachments.items())])
+        self._mods[note.uuid] = note.modified
+        self.updated += 1
+
+    def _delete(self, uuid):
+        for table in self._TABLES:
+            self._conn.execute(f"DELETE FROM {table} WHERE uuid = ?", (uuid,))
+
+
+# ===========================================================================
+# Full-text search (--searchIndex, search subcommand)
+# ===========================================================================
+
+def default_search_index(out):
+    """Search index path for the export folder *out*: a sibling file."""
+    return os.path.normpath(out) + '.search.sqlite'
+
+
+def _fts5_available():
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+class SearchIndex(SQLiteNoteIndex):
+    """SQLite FTS5 index of exported notes' titles and text.
+
+    Each note is one row of notes_fts, whose rowid is the note's id in
+    notes (uuid, modified, title, paths), so an edited note replaces its
+    row and a deleted one drops it.  Titles weigh ten times the body in
+    the bm25 ranking; search() returns paths and snippets.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS notes ("
+        "  id INTEGER PRIMARY KEY, uuid TEXT NOT NULL UNIQUE,"
+        "  modified REAL, title TEXT NOT NULL, paths TEXT NOT NULL DEFAULT '[]')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5("
+        "  title, body, tokenize = 'unicode61 remove_diacritics 2')",
+    )
+    _TABLES = ('notes', 'notes_fts')
+
+    def update(self, note):
+        """Insert or replace *note* (an ExportedNote)."""
+        self._delete(note.uuid)
+        body = note.text.replace(f'[//]: # ({{BearID:{note.uuid}}})\n', '', 1)
+        cur = self._conn.execute(
+            "INSERT INTO notes (uuid, modified, title, paths) VALUES (?, ?, ?, ?)",
+            (note.uuid, note.modified, note.title,
+             json.dumps(note.paths, ensure_ascii=False)))
+        self._conn.execute(
+            "INSERT INTO notes_fts (rowid, title, body) VALUES (?, ?, ?)",
+            (cur.lastrowid, note.title, body))
+        self._mods[note.uuid] = note.modified
+        self.updated += 1
+
+    def _delete(self, uuid):
+        row = self._conn.execute("SELECT id FROM notes WHERE uuid = ?",
+                                 (uuid,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM notes_fts WHERE rowid = ?", row)
+            self._conn.execute("DELETE FROM notes WHERE id = ?", row)
+
+
+def _fts_query(text):
+    """Plain search words as an FTS5 query: every word, as typed.
+
+    Each word is quoted so punctuation is matched, not parsed; a
+    trailing * keeps prefix matching.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*') and len(word) > 1
+        word = word.rstrip('*') if prefix else word
+        terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search(index_path, query, limit=20, raw=False):
+    """Rank notes in the search index at *index_path* against *query*.
+
+    Returns [{"uuid", "title", "paths", "snippet", "score"}], best first;
+    paths are relative to the export folder.  *raw* passes *query* to
+    FTS5 unchanged (AND/OR/NOT, NEAR, column filters).
+    """
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f'No search index at {index_path}')
+    match = query if raw else _fts_query(query)
+    if not match:
+        return []
+    conn = sqlite3.connect(f"file:{urllib.parse.quote(index_path)}?mode=ro",
+                           uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT n.uuid, n.title, n.paths, "
+            "       snippet(notes_fts, 1, '[', ']', '…', 12), "
+            "       bm25(notes_fts, 10.0, 1.0) AS score "
+            "FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid "
+            "WHERE notes_fts MATCH ? ORDER BY score LIMIT ?",
+            (match, limit)).fetchall()
+    finally:
+        conn.close()
+    return [{'uuid': uuid, 'title': title, 'paths': json.loads(paths),
+             'snippet': ' '.join(snip.split()), 'score': round(-score, 3)}
+            for uuid, title, paths, snip, score in rows]
+
+
+# ===========================================================================
+# Link graph (--linkGraph)
+# ===========================================================================
+
+_BEAR_OPEN_NOTE = re.compile(r'bear://x-callback-url/open-note\?([^\s()<>\[\]"\']+)')
+
+
+def default_link_graph(out):
+    """Link graph path for the export folder *out*: a sibling file."""
+    return os.path.normpath(out) + '.links.json'
+
+
+def _note_links(md_text):
+    """Outgoing note references in *md_text*, in text order, deduplicated.
+
+    Returns [["title", name] | ["id", UUID]] from [[wiki links]] (alias
+    after | dropped) and bear://x-callback-url/open-note links with an
+    id or title, in Markdown links or bare; code is skipped.
+    """
+    refs = {}
+    has_url = 'bear://' in md_text
+    spans = (list(_scan_markdown(md_text))
+             if has_url or '[[' in md_text else [])
+    for kind, _, _, name, _ in spans:
+        if kind == 'wiki_link':
+            name = name.split('|', 1)[0].strip()
+            if name:
+                refs[('title', name)] = None
+    if has_url:
+        code = [(start, end) for kind, start, end, _, _ in spans if kind == 'code']
+        c = 0
+        for m in _BEAR_OPEN_NOTE.finditer(md_text):
+            while c < len(code) and code[c][1] <= m.start():
+                c += 1
+            if c < len(code) and code[c][0] <= m.start():
+                continue
+            query = urllib.parse.parse_qs(m.group(1).replace('&amp;', '&'))
+            if query.get('id'):
+                refs[('id', query['id'][0].strip())] = None
+            elif query.get('title'):
+                refs[('title', query['title'][0].strip())] = None
+    return [list(ref) for ref in refs]
+
+
+def _title_key(title):
+    return _nfc(title).strip().casefold()
+
+
+class LinkGraph:
+    """Note-to-note links of the export as one JSON adjacency file.
+
+    Links are extracted (see _note_links) only from notes whose
+    modification date changed; the per-note references are kept in the
+    file, and finish() resolves them all against the current titles, so
+    a link to a note created or retitled later resolves without
+    rescanning the linking note.  The file holds, keyed by UUID:
+
+      notes       {title, mod, paths, links} — the raw references
+      forward     UUIDs each note links to
+      backward    UUIDs linking to each note
+      unresolved  references matching no exported note
+
+    Wiki links try the whole name, then the part before "#" or the last
+    "/" (a heading); titles compare case-insensitively, and the lowest
+    UUID wins between duplicate titles.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.settings = None
+        self.notes = {}
+        self.updated = 0
+        self.removed = 0
+
+    def behind(self):
+        """True if Bear's database is newer than the graph file."""
+        return (not os.path.exists(self.path)
+                or get_file_date(bear_db) > get_file_date(self.path))
+
+    def begin(self):
+        """Load the stored references; an unreadable file, or one made
+        with other _index_settings(), starts empty."""
+        self.settings = _index_settings()
+        self.notes = {}
+        self.updated = self.removed = 0
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (isinstance(data, dict) and data.get('version') == self.VERSION
+                and data.get('settings') == self.settings
+                and isinstance(data.get('notes'), dict)):
+            self.notes = data['notes']
+
+    def is_current(self, uuid, modified):
+        """True if *uuid* is stored with Bear modification date *modified*."""
+        entry = self.notes.get(uuid)
+        return bool(entry) and entry.get('mod') == dt_conv(modified)
+
+    def update(self, note):
+        """Re-extract the links of *note* (an ExportedNote)."""
+        self.notes[note.uuid] = {'title': note.title, 'mod': note.modified,
+                                 'paths': note.paths,
+                                 'links': _note_links(note.text)}
+        self.updated += 1
+
+    def remove(self, uuid):
+        """Forget *uuid* and its outgoing links."""
+        if self.notes.pop(uuid, None) is not None:
+            self.removed += 1
+
+    def finish(self, live):
+        """Drop notes not in *live*, resolve every link and save the file."""
+        for uuid in [u for u in self.notes if u not in live]:
+            self.remove(uuid)
+        titles = {}
+        for uuid in sorted(self.notes):
+            titles.setdefault(_title_key(self.notes[uuid]['title']), uuid)
+
+        def resolve(kind, value):
+            if kind == 'id':
+                return value if value in self.notes else None
+            for name in (value, value.split('#', 1)[0], value.rsplit('/', 1)[0]):
+                uuid = titles.get(_title_key(name))
+                if uuid is not None:
+                    return uuid
+            return None
+
+        forward, backward, unresolved = {}, {}, {}
+        for uuid, entry in self.notes.items():
+            out = []
+            for kind, value in entry['links']:
+                dest = resolve(kind, value)
+                if dest is None:
+                    unresolved.setdefault(uuid, []).append(value)
+                elif dest != uuid and dest not in out:
+                    out.append(dest)
+                    backward.setdefault(dest, []).append(uuid)
+            if out:
+                forward[uuid] = out
+        for sources in backward.values():
+            sources.sort()
+
+        data = {'version': self.VERSION, 'settings': self.settings,
+                'notes': self.notes, 'forward': forward, 'backward': backward,
+                'unresolved': unresolved}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        write_log(f'LinkGraph {self.path}: {self.updated} notes updated, '
+                  f'{self.removed} removed, '
+                  f'{sum(map(len, forward.values()))} links')
+
+    def abort(self):
+        """Discard this run's changes; the file is left as it was."""
+        self.notes = {}
+
+
+# ===========================================================================
+# Export: main export loop
+# ===========================================================================
+
+_TEXT_BATCH_SIZE = 500   # stays below SQLite's 999 host-parameter limit
+
+
+def _iter_note_texts(conn, notes):
+    """Yield (metadata_row, ZTEXT) for *notes*, in order.
+
+    Text is fetched in batched ``Z_PK IN (...)`` queries so that only
+    the selected notes are read and at most one batch of note bodies
+    is held in memory at a time.
+    """
+    for i in range(0, len(notes), _TEXT_BATCH_SIZE):
+        batch = notes[i:i + _TEXT_BATCH_SIZE]
+        placeholders = ','.join('?' * len(batch))
+        with _phase('query'):
+            texts = {r[0]: r[1] for r in conn.execute(
+                f"SELECT Z_PK, ZTEXT FROM ZSFNOTE WHERE Z_PK IN ({placeholders})",
+                [n['Z_PK'] for n in batch])}
+        for meta in batch:
+            yield meta, texts.get(meta['Z_PK']) or ''
+
+
+def _load_attachment_index(conn, pks):
+    """Return {note Z_PK: {ZFILENAME: file UUID}} for the notes in *pks*.
+
+    One batched ZSFNOTEFILE query per _TEXT_BATCH_SIZE notes replaces
+    the per-note lookup that image rewriting used to run.
+    """
+    index = {}
+    for i in range(0, len(pks), _TEXT_BATCH_SIZE):
+        batch = pks[i:i + _TEXT_BATCH_SIZE]
+        placeholders = ','.join('?' * len(batch))
+        for note_pk, fname, file_uuid in conn.execute(
+                "SELECT ZNOTE, ZFILENAME, ZUNIQUEIDENTIFIER FROM ZSFNOTEFILE "
+                f"WHERE ZNOTE IN ({placeholders})", batch):
+            index.setdefault(note_pk, {})[fname] = file_uuid
+    return index
+
+
+def _tag_schema(conn):
+    """Return (join table, note column, tag column) linking ZSFNOTE to
+    ZSFNOTETAG, or None when the schema isn't recognized.
+
+    Core Data names the many-to-many table after entity numbers (Z_5TAGS
+    with Z_5NOTES / Z_13TAGS in Bear 2) that vary between versions, so
+    it is found by shape rather than by name.
+    """
+    names = {r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'ZSFNOTETAG' not in names:
+        return None
+    for table in sorted(n for n in names if re.fullmatch(r'Z_\d+TAGS', n)):
+        cols = [r[1] for r in conn.execute(f'PRAGMA table_info("{table}")')]
+        note_cols = [c for c in cols if re.fullmatch(r'Z_\d+NOTES', c)]
+        tag_cols = [c for c in cols if re.fullmatch(r'Z_\d+TAGS', c)]
+        if len(note_cols) == 1 and len(tag_cols) == 1:
+            return table, note_cols[0], tag_cols[0]
+    return None
+
+
+def _tag_prefix_sql(prefixes):
+    """SQL condition and params: tag title (alias t) starts with a prefix.
+
+    LIKE matches ASCII case-insensitively, as the text scan's lower()
+    comparison did for the common case.
+    """
+    patterns = [p.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                for p in prefixes]
+    cond = ' OR '.join("t.ZTITLE LIKE ? ESCAPE '\\'" for _ in patterns)
+    return f'({cond})', patterns
+
+
+def _excluded_tags_sql(schema):
+    """WHERE fragment and params dropping notes tagged with no_export_tags."""
+    if schema is None or not no_export_tags:
+        return '', []
+    table, note_col, tag_col = schema
+    cond, params = _tag_prefix_sql(no_export_tags)
+    return (f'AND NOT EXISTS (SELECT 1 FROM "{table}" j '
+            f'JOIN ZSFNOTETAG t ON t.Z_PK = j."{tag_col}" '
+            f'WHERE j."{note_col}" = ZSFNOTE.Z_PK AND {cond}) '), params
+
+
+def _load_note_tags(conn, schema, pks):
+    """Return {note Z_PK: [tag title, ...]} for the notes in *pks*.
+
+    One joined query per _TEXT_BATCH_SIZE notes; only_export_these_tags
+    is applied in SQL.  Bear links a note to every ancestor of a nested
+    tag, so a tag that is the parent of another of the note's tags is
+    dropped — #a/b gives a/b/ only, as the text scan did.
+    """
+    table, note_col, tag_col = schema
+    only_cond, only_params = ('', [])
+    if only_export_these_tags:
+        only_cond, only_params = _tag_prefix_sql(only_export_these_tags)
+        only_cond = 'AND ' + only_cond
+    index = {}
+    for i in range(0, len(pks), _TEXT_BATCH_SIZE):
+        batch = pks[i:i + _TEXT_BATCH_SIZE]
+        placeholders = ','.join('?' * len(batch))
+        for note_pk, title in conn.execute(
+                f'SELECT j."{note_col}", t.ZTITLE FROM "{table}" j '
+                f'JOIN ZSFNOTETAG t ON t.Z_PK = j."{tag_col}" '
+                f'WHERE j."{note_col}" IN ({placeholders}) {only_cond} '
+                'ORDER BY t.ZTITLE', batch + only_params):
+            if title:
+                index.setdefault(note_pk, []).append(title)
+    for note_pk, titles in index.items():
+        index[note_pk] = [t for t in titles
+                          if not any(o.startswith(t + '/') for o in titles)]
+    return index
+
 
+class _DirListingCache:
+    """Per-run cache of directory listings for image stores.
 
-def _is_under_dir(path, parent):
-    """True if *path* is inside *parent* (both resolved, normalized)."""
-    try:
-        real_path = os.path.realpath(path)
-        real_parent = os.path.realpath(parent)
-        return os.path.commonpath([real_path, real_parent]) == real_parent
-    except Exception:
-        return False
+    Existence checks become dict lookups against one os.scandir() per
+    directory, and each DirEntry caches its own stat result, so an
+    image referenced by many notes is stat-ed once per run.  Shared by
+    the write-stage workers; claim() keeps two notes that reference the
+    same image from copying it concurrently.
+    """
 
+    def __init__(self):
+        self._listings = {}
+        self._claimed = set()
+        self._claim_lock = threading.Lock()
 
-def _normalize_local_image_ref(raw_url):
-    """Normalize image URL/path from markdown or HTML src into a local path token."""
-    if raw_url is None:
-        return ""
-    url = urllib.parse.unquote(str(raw_url)).strip()
-    if not url:
-        return ""
+    def _listing(self, path):
+        listing = self._listings.get(path)
+        if listing is None:
+            try:
+                with os.scandir(path) as it:
+                    listing = {e.name: e for e in it}
+            except OSError:
+                listing = {}
+            self._listings[path] = listing
+        return listing
+
+    def entry(self, root, *parts):
+        """Return the DirEntry for root/parts..., or None if missing."""
+        path = root
+        for name in parts[:-1]:
+            if name not in self._listing(path):
+                return None
+            path = os.path.join(path, name)
+        return self._listing(path).get(parts[-1])
+
+    def stat(self, root, *parts):
+        """Cached stat of root/parts..., or None if missing."""
+        e = self.entry(root, *parts)
+        try:
+            return e.stat() if e is not None else None
+        except OSError:
+            return None
+
+    def mtime(self, root, *parts):
+        """Cached mtime of root/parts..., or None if missing."""
+        st = self.stat(root, *parts)
+        return st.st_mtime if st is not None else None
+
+    def claim(self, path):
+        """True the first time *path* is claimed during this run."""
+        with self._claim_lock:
+            if path in self._claimed:
+                return False
+            self._claimed.add(path)
+            return True
 
-    # Strip optional title from markdown image syntax: path "title"
-    # / path 'title' — keep only the path segment.
-    for quote in ('"', "'"):
-        if quote in url:
-            q = url.find(quote)
-            head = url[:q].rstrip()
-            if head:
-                url = head
-                break
+    def add(self, path):
+        """Register a file just written at *path* without rescanning."""
+        parent, name = os.path.split(path)
+        grand, dirname = os.path.split(parent)
+        if grand in self._listings:
+            self._listings[grand].setdefault(dirname, _WrittenEntry(parent))
+        self._listing(parent)[name] = _WrittenEntry(path)
 
-    if url.startswith("<") and url.endswith(">"):
-        url = url[1:-1].strip()
 
-    if url.lower().startswith("file://"):
-        parsed = urllib.parse.urlparse(url)
-        fp = urllib.parse.unquote(parsed.path or "")
-        if fp:
-            return fp
-    return url
+class _WrittenEntry:
+    """Stand-in for an os.DirEntry of a path written during this run."""
+    __slots__ = ("path",)
 
+    def __init__(self, path):
+        self.path = path
 
-def _convert_html_img_to_markdown(md_text):
-    """Convert HTML <img ... src=...> tags to markdown image syntax."""
-    def _replace(tag_match):
-        tag = tag_match.group(0)
-        src_m = RE_HTML_IMG_SRC.search(tag)
-        if not src_m:
-            return tag
-        src = (src_m.group(2) or '').strip()
-        if not src:
-            return tag
-        alt_m = RE_HTML_IMG_ALT.search(tag)
-        alt = (alt_m.group(2) if alt_m else "image").strip() or "image"
-        alt = alt.replace(']', r'\]')
-        return f"![{alt}]({src})"
-
-    return RE_HTML_IMG_TAG.sub(_replace, md_text)
+    def stat(self):
+        return os.stat(self.path)
 
 
 # ===========================================================================
-# Export phase helpers
+# Content-addressed image store
 # ===========================================================================
 
-# ---------------------------------------------------------------------------
-# Stale-file cleanup (replaces rsync --delete)
-# ---------------------------------------------------------------------------
+_FICLONE = 0x40049409   # Linux ioctl: share the source file's extents
 
-_CLEANUP_SKIP_DIRS = frozenset({
-    'BearImages', '.obsidian',
-})
-_CLEANUP_SKIP_DIR_PREFIXES = ('.Ulysses',)
-_CLEANUP_SKIP_FILES = frozenset({
-    '.sync-time.log', '.export-time.log',
-})
 
+class ImageStore:
+    """Deduplicated image blobs, linked into the places notes point at.
 
-def _cleanup_stale_notes(expected_paths: set) -> int:
-    """Remove exported note files/bundles no longer in Bear.
+    Each image is stored once as root/<aa>/<digest><ext>, keyed by a
+    BLAKE2b digest of its bytes.  place() puts a blob at a note-visible
+    path (assets_path/UUID/name, a bundle's assets/) by hardlink,
+    reflink or plain copy; *mode* "auto" tries them in that order and
+    remembers, per filesystem, which ones fail.  Source digests are
+    cached by (size, mtime) in root/.hash-cache.json so an unchanged
+    image in Bear is never re-read.
 
-    Walks export_path once, skipping excluded directories (BearImages,
-    .obsidian, .Ulysses*) and sentinel files.  Anything that looks like
-    a note file or textbundle that is NOT in *expected_paths* is deleted.
+    With hardlinks every vault shares the blob's inode, so an image
+    edited in place in one vault changes in all of them — use reflink
+    or copy for vaults whose images are edited externally.
     """
-    if not os.path.isdir(export_path):
-        return 0
-    removed = 0
-    empty_dirs = []
 
-    for root, dirs, files in os.walk(export_path, topdown=True):
-        keep = []
-        for d in dirs:
-            if d in _CLEANUP_SKIP_DIRS:
-                continue
-            if any(d.startswith(pfx) for pfx in _CLEANUP_SKIP_DIR_PREFIXES):
+    _METHODS = {
+        'auto': ('hardlink', 'reflink', 'copy'),
+        'hardlink': ('hardlink', 'copy'),
+        'reflink': ('reflink', 'copy'),
+        'copy': ('copy',),
+    }
+
+    def __init__(self, root, mode='auto'):
+        self.root = root
+        self.methods = self._METHODS[mode]
+        self.cache_file = os.path.join(root, '.hash-cache.json')
+        self._hashes = None
+        self._dirty = False
+        self._failed = {}        # st_dev -> methods that failed there
+        self._lock = threading.Lock()
+        self.placed = dict.fromkeys(('hardlink', 'reflink', 'copy'), 0)
+        self.current = 0
+
+    def digest(self, src, st):
+        """Content digest of *src*, from the cache when size and mtime match."""
+        key = [st.st_size, st.st_mtime_ns]
+        with self._lock:
+            cached = self._load_hashes().get(src)
+        if cached and cached[:2] == key:
+            return cached[2]
+        h = hashlib.blake2b(digest_size=16)
+        with open(src, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._hashes[src] = key + [digest]
+            self._dirty = True
+        return digest
+
+    def _load_hashes(self):
+        """The digest cache, read on first use; call with _lock held."""
+        if self._hashes is None:
+            try:
+                with open(self.cache_file, encoding='utf-8') as f:
+                    self._hashes = json.load(f)
+            except (OSError, ValueError):
+                self._hashes = {}
+        return self._hashes
+
+    def place(self, src, dest):
+        """Make *dest* hold the bytes of *src*; False if it already did."""
+        digest = self.digest(src, os.stat(src))
+        blob = os.path.join(self.root, digest[:2],
+                            digest + os.path.splitext(src)[1].lower())
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp = _tmp_path(blob)
+            shutil.copy2(src, tmp)
+            os.replace(tmp, blob)
+
+        blob_st = os.stat(blob)
+        try:
+            st = os.stat(dest)
+            if (os.path.samestat(st, blob_st)
+                    or (st.st_size == blob_st.st_size
+                        and st.st_mtime_ns == blob_st.st_mtime_ns)):
+                with self._lock:
+                    self.current += 1
+                return False
+        except OSError:
+            pass
+
+        dev = os.stat(os.path.dirname(dest)).st_dev
+        tmp = _tmp_path(dest)
+        for method in self.methods:
+            if method in self._failed.get(dev, ()):
                 continue
-            if d.endswith('.Ulysses_Public_Filter'):
+            try:
+                getattr(self, '_' + method)(blob, tmp)
+            except OSError:
+                _remove_quietly(tmp)
+                if method == 'copy':
+                    raise
+                with self._lock:
+                    self._failed.setdefault(dev, set()).add(method)
                 continue
-            if d.endswith('.textbundle'):
-                bundle_path = os.path.join(root, d)
-                if bundle_path not in expected_paths:
-                    try:
-                        shutil.rmtree(bundle_path)
-                        removed += 1
-                    except OSError:
-                        pass
-                continue  # don't descend into textbundles either way
-            keep.append(d)
-        dirs[:] = keep
+            os.replace(tmp, dest)
+            with self._lock:
+                self.placed[method] += 1
+            return True
 
-        for fname in files:
-            if fname in _CLEANUP_SKIP_FILES:
+    @staticmethod
+    def _hardlink(blob, dest):
+        os.link(blob, dest)
+
+    @staticmethod
+    def _reflink(blob, dest):
+        if sys.platform == 'darwin':
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.clonefile(os.fsencode(blob), os.fsencode(dest), 0) != 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err), dest)
+        else:
+            import fcntl
+            with open(blob, 'rb') as src, open(dest, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        shutil.copystat(blob, dest)
+
+    @staticmethod
+    def _copy(blob, dest):
+        shutil.copy2(blob, dest)
+
+    def summary(self):
+        """One-line description of this run's placements, '' if none."""
+        parts = [f'{n} {m}' for m, n in self.placed.items() if n]
+        if self.current:
+            parts.append(f'{self.current} already current')
+        return ', '.join(parts)
+
+    def collect_garbage(self, referenced, grace, dry_run=False):
+        """Drop blobs and cache entries nothing uses any more.
+
+        A blob is in use while it has another hardlink, its digest is
+        cached for a Bear image that still exists, or it has the size
+        and mtime of an image in *referenced* (a reflinked or copied
+        placement).  Unused blobs and cache entries for vanished sources
+        are stamped in root/.gc-pending.json and removed once they have
+        been unused for *grace* seconds.  Removing a blob never breaks
+        a note: placements are links or copies of it, not references.
+        Returns (blobs removed, cache entries dropped).
+        """
+        pending_file = os.path.join(self.root, '.gc-pending.json')
+        try:
+            with open(pending_file, encoding='utf-8') as f:
+                pending = json.load(f)
+        except (OSError, ValueError):
+            pending = {}
+        blobs_since = pending.get('blobs', {})
+        sources_since = pending.get('sources', {})
+        now = time.time()
+        cutoff = now - grace
+        with self._lock:
+            hashes = dict(self._load_hashes())
+
+        live = set()
+        gone_sources = {}
+        for src, entry in hashes.items():
+            if os.path.exists(src):
+                live.add(entry[2])
+            else:
+                gone_sources[src] = sources_since.get(src, now)
+        dropped = [src for src, since in gone_sources.items() if since <= cutoff]
+        if dry_run:
+            if dropped:
+                print(f'Would drop {len(dropped)} image store cache entries')
+        elif dropped:
+            with self._lock:
+                for src in dropped:
+                    self._hashes.pop(src, None)
+                    del gone_sources[src]
+                self._dirty = True
+
+        placed = set()
+        for path in referenced:
+            try:
+                st = os.stat(path)
+            except OSError:
                 continue
-            fpath = os.path.join(root, fname)
-            if fpath in expected_paths:
+            placed.add((st.st_size, st.st_mtime_ns))
+
+        unused = {}
+        removed = 0
+        try:
+            folders = os.listdir(self.root)
+        except OSError:
+            folders = []
+        for name in folders:
+            folder = os.path.join(self.root, name)
+            if len(name) != 2 or not os.path.isdir(folder):
                 continue
-            if any(fname.endswith(ext) for ext in ('.md', '.txt', '.markdown')):
+            for blob in os.listdir(folder):
+                if blob.endswith('.tmp'):
+                    continue        # in-flight _tmp_path() copy
+                path = os.path.join(folder, blob)
                 try:
-                    os.remove(fpath)
-                    removed += 1
+                    st = os.stat(path)
                 except OSError:
-                    pass
+                    continue
+                if (st.st_nlink > 1 or os.path.splitext(blob)[0] in live
+                        or (st.st_size, st.st_mtime_ns) in placed):
+                    continue
+                rel = name + '/' + blob
+                since = blobs_since.get(rel, now)
+                if since > cutoff:
+                    unused[rel] = since
+                elif dry_run:
+                    print(f'Would remove unused image store blob: {rel}')
+                    unused[rel] = since
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        unused[rel] = since
+                        continue
+                    removed += 1
+                    write_log('Removed unused image store blob: ' + rel)
+            if not dry_run:
+                with contextlib.suppress(OSError):
+                    os.rmdir(folder)
+
+        state = {'blobs': unused, 'sources': gone_sources}
+        if state != {'blobs': blobs_since, 'sources': sources_since}:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = pending_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp, pending_file)
+        return removed, 0 if dry_run else len(dropped)
+
+    def save(self):
+        """Persist the digest cache (atomic replace) if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            tmp = self.cache_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._hashes, f, separators=(',', ':'))
+            os.replace(tmp, self.cache_file)
+            self._dirty = False
+
+
+def _place_image(src, dest):
+    """Copy a Bear image to *dest*, through the image store when enabled."""
+    with _phase('image_copy'):
+        if image_store is not None:
+            image_store.place(src, dest)
+        else:
+            shutil.copy2(src, dest)
 
-        if root != export_path:
-            empty_dirs.append(root)
 
-    # Clean up empty tag directories (deepest first)
-    for d in reversed(sorted(empty_dirs)):
-        try:
-            if os.path.isdir(d) and not os.listdir(d):
-                os.rmdir(d)
-        except OSError:
-            pass
+def _asset_current(dest, src_mtime, src_size=None):
+    """True if *dest* exists, is at least as new as its source and, when
+    *src_size* is given, the same size."""
+    try:
+        st = os.stat(dest)
+    except OSError:
+        return False
+    return st.st_mtime >= src_mtime and (src_size is None or st.st_size == src_size)
 
-    return removed
 
+def _has_image_syntax(md_text):
+    """Cheap pre-check: can *md_text* contain any image reference at all?"""
+    return '![' in md_text or '[image:' in md_text
 
-def _collect_referenced_local_images(root_path):
-    """Collect absolute local image paths referenced by notes in *root_path*."""
-    refs = set()
-    if not os.path.isdir(root_path):
-        return refs
 
-    for root, dirs, files in os.walk(root_path, topdown=True):
-        dirs[:] = [d for d in dirs
-                   if d not in _CLEANUP_SKIP_DIRS
-                   and d != '.git'
-                   and d != '__pycache__'
-                   and not any(d.startswith(pfx) for pfx in _CLEANUP_SKIP_DIR_PREFIXES)]
+class _WritePipeline:
+    """Bounded worker pool for the export write stage.
 
-        for fname in files:
-            if not (fname.endswith('.md') or fname.endswith('.txt') or fname.endswith('.markdown')):
-                continue
-            note_path = os.path.join(root, fname)
-            try:
-                note_text = read_file(note_path)
-            except Exception:
-                continue
+    The SQLite loop renders notes and submits one job per target path;
+    workers run the image copies and file writes, so a first export onto
+    a slow or cloud-synced disk is I/O-parallel instead of latency-bound.
 
-            note_text = _convert_html_img_to_markdown(note_text)
+    * Backpressure: at most ``workers * 4`` jobs are queued or running,
+      so only that many rendered notes are held in memory.
+    * Jobs for the same key (target path without extension) run in
+      submission order — a later note never races an earlier one.
+    * Failures are collected and returned by close() in submission
+      order, so error reports are deterministic.
 
-            for m in RE_MD_IMAGE.finditer(note_text):
-                raw = _normalize_local_image_ref(m.group(2))
-                if not raw or raw.startswith("http://") or raw.startswith("https://"):
-                    continue
-                abs_img = raw if os.path.isabs(raw) else os.path.normpath(os.path.join(root, raw))
-                refs.add(abs_img)
+    With one worker, jobs run inline on the calling thread.
+    """
 
-            for raw in RE_WIKI_IMAGE.findall(note_text):
-                img = _normalize_local_image_ref(raw)
-                if not img or img.startswith("http://") or img.startswith("https://"):
-                    continue
-                abs_img = img if os.path.isabs(img) else os.path.normpath(os.path.join(root, img))
-                refs.add(abs_img)
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._pool = None
+        if self.workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='bear-export')
+        self._slots = threading.BoundedSemaphore(self.workers * 4)
+        self._pending = {}     # key → Future of the latest job for that key
+        self._errors = []      # (seq, label, exception)
+        self._errors_lock = threading.Lock()
+        self._seq = 0
+
+    def wait(self, key):
+        """Block until every job submitted for *key* has finished."""
+        fut = self._pending.pop(key, None)
+        if fut is not None:
+            fut.result()
+
+    def submit(self, key, label, fn, *args):
+        seq = self._seq
+        self._seq += 1
+        if self._pool is None:
+            self._run(seq, label, fn, args)
+            return
+        self.wait(key)
+        self._slots.acquire()
+        try:
+            self._pending[key] = self._pool.submit(self._run, seq, label, fn, args)
+        except BaseException:
+            self._slots.release()
+            raise
 
-    return refs
+    def _run(self, seq, label, fn, args):
+        t0 = time.perf_counter()
+        try:
+            fn(*args)
+            if run_profile is not None:
+                run_profile.note(label, time.perf_counter() - t0)
+        except Exception as e:
+            with self._errors_lock:
+                self._errors.append((seq, label, e))
+        finally:
+            if self._pool is not None:
+                self._slots.release()
+
+    def close(self):
+        """Wait for all jobs; return [(label, exception)] in submission order."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        self._pending.clear()
+        return [(label, e) for _, label, e in sorted(self._errors, key=lambda x: x[0])]
+
+
+def _write_repository_note(target, md_text, filepath, mod_dt, creation,
+                           image_map, image_dirs):
+    """Write-stage job: rewrite image links into assets_path, then write."""
+    with _phase('transform'):
+        md_proc = process_image_links(md_text, filepath, image_map, image_dirs, target)
+    write_file(filepath + '.md', md_proc, mod_dt, creation)
+    target.images.set(filepath + '.md',
+                      _local_image_refs(md_proc, os.path.dirname(filepath)))
+
+
+def _move_retitled(target, old_paths, filepath, md_text):
+    """Move one of a note's previous files or bundles to *filepath*.
+
+    *old_paths* are the note's recorded paths that this run no longer
+    writes; the one moved is removed from the list.  A path another
+    note already claimed this run stays put, and a Markdown file is only
+    moved where it will stay Markdown (not promoted to a Textbundle).
+    Moving a bundle keeps its assets, so the rewrite that follows only
+    touches text.md.  Returns True if something was renamed.
+    """
+    for old in old_paths:
+        ext = os.path.splitext(old)[1]
+        new = filepath + ext
+        if old in target.expected_paths or not _exact_name_exists(old):
+            continue
+        if os.path.exists(new) and not os.path.samefile(old, new):
+            continue
+        if (ext == '.md' and target.as_textbundles
+                and check_image_hybrid(md_text, filepath, target)):
+            continue
+        try:
+            os.rename(old, new)
+        except OSError:
+            continue
+        target.images.forget(old)
+        old_paths.remove(old)
+        return True
+    return False
 
 
-def _cleanup_root_orphan_images():
-    """Remove root-level images that are no longer referenced and already mirrored in BearImages."""
-    if not os.path.isdir(export_path):
-        return 0
+def _place_tag_copy(src, dest, mode):
+    """Make *dest* a hardlink or symlink copy of the canonical note *src*.
 
-    referenced = _collect_referenced_local_images(export_path)
+    A Textbundle is symlinked whole, or mirrored as a directory whose
+    files are hardlinks.  Where a link is refused (another volume, no
+    symlink support) a real copy is made instead.
+    """
+    with _phase('tag_links'):
+        if os.path.isdir(src) and mode == 'hardlink':
+            if os.path.lexists(dest) and not _is_real_dir(dest):
+                os.remove(dest)
+            for root, dirs, files in os.walk(src):
+                droot = os.path.normpath(os.path.join(dest, os.path.relpath(root, src)))
+                os.makedirs(droot, exist_ok=True)
+                for name in files:
+                    _link_path(os.path.join(root, name), os.path.join(droot, name), mode)
+                for name in os.listdir(droot):
+                    if name not in files and name not in dirs:
+                        _remove_path(os.path.join(droot, name))
+            shutil.copystat(src, dest)
+        else:
+            _link_path(src, dest, mode)
 
-    asset_basenames = set()
-    if os.path.isdir(assets_path):
-        for _, _, files in os.walk(assets_path):
-            asset_basenames.update(files)
 
-    removed = 0
+def _link_path(src, dest, mode):
+    """Replace *dest* with a *mode* link to *src* unless it already is one."""
+    if _is_linked(src, dest, mode):
+        return
+    link = os.path.relpath(src, os.path.dirname(dest))
+    if _is_real_dir(dest):
+        shutil.rmtree(dest)
+    tmp = _tmp_path(dest)
     try:
-        root_files = os.listdir(export_path)
+        if mode == 'symlink':
+            os.symlink(link, tmp)
+        else:
+            os.link(src, tmp)
     except OSError:
-        return 0
-
-    for fname in root_files:
-        fpath = os.path.join(export_path, fname)
-        if not os.path.isfile(fpath):
-            continue
-        if not fname.lower().endswith(_IMAGE_FILE_EXTS):
-            continue
-        if fpath in referenced:
-            continue
-        if fname not in asset_basenames:
-            # Conservative: only remove when a canonical copy exists in BearImages.
-            continue
-        try:
-            os.remove(fpath)
-            removed += 1
-            write_log('Removed orphan root image: ' + fname)
-        except OSError:
-            pass
-    return removed
+        _remove_quietly(tmp)
+        if os.path.isdir(src):
+            _remove_path(dest)
+            shutil.copytree(src, dest)
+            return
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
 
 
-def write_time_stamp():
-    msg = "Markdown from Bear written at: " + datetime.datetime.now().strftime("%Y-%m-%d at %H:%M:%S")
-    write_file(export_ts_file_exp, msg, 0, 0)
-    write_file(sync_ts_file, msg, 0, 0)
+def _is_linked(src, dest, mode):
+    """True if *dest* is already a *mode* link to *src*.
 
+    A hardlinked Textbundle counts when its text.md is linked.
+    """
+    if mode == 'symlink':
+        return (os.path.islink(dest)
+                and os.readlink(dest) == os.path.relpath(src, os.path.dirname(dest)))
+    if os.path.islink(dest) or not os.path.exists(dest):
+        return False
+    if os.path.isdir(src):
+        src, dest = os.path.join(src, 'text.md'), os.path.join(dest, 'text.md')
+    try:
+        return os.path.samefile(src, dest)
+    except OSError:
+        return False
 
-def hide_tags(md_text):
-    if hide_tags_in_comment_block:
-        md_text = RE_HIDE_TAGS.sub(r'\1', md_text)
-    return md_text
 
+def _is_real_dir(path):
+    return os.path.isdir(path) and not os.path.islink(path)
 
-def restore_tags(md_text):
-    # hide_tags_in_comment_block strips the tag lines on export;
-    # restoring them on import is not straightforward without storing them —
-    # this function is intentionally a no-op (tags are not recoverable from
-    # the stripped file).
-    return md_text
 
+def _remove_path(path):
+    """Remove a file, symlink or directory tree at *path*."""
+    if _is_real_dir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
 
-# ===========================================================================
-# Export: main export loop
-# ===========================================================================
 
-def export_markdown():
-    """Export notes from Bear directly into export_path (in-place).
+def note_sub_paths(filename, md_text, tags=None):
+    """Export-relative stems (no extension) for a note; [] if excluded.
 
-    Unchanged notes are skipped entirely (zero I/O).  Returns
-    (note_count, expected_paths) where expected_paths is a set of
-    absolute paths that should exist after this export — used by
-    _cleanup_stale_notes() to remove files no longer in Bear.
+    *tags* are the note's tags from Bear's tag tables, with exclusions
+    already applied in SQL.  None means the schema wasn't recognized and
+    the note text is scanned for tags instead.
     """
-    temp_fd, temp_db_path = tempfile.mkstemp(suffix='.sqlite',
-                                              prefix='bear_export_')
-    os.close(temp_fd)
-    try:
-        shutil.copy2(bear_db, temp_db_path)
-    except Exception as e:
-        print(f"Warning: could not copy database, reading live DB. Error: {e}")
-        os.remove(temp_db_path)
-        temp_db_path = bear_db
+    if tags is not None:
+        if not make_tag_folders:
+            return [filename]
+        if not multi_tag_folders and tags:
+            tags = [_first_tag(tags, md_text)]
+        # dict.fromkeys: tags differing only in normalization share a folder.
+        return list(dict.fromkeys(
+            [filename] + [os.path.join(_tag_folder(t), filename)
+                          for t in tags if t != '/']))
+    if make_tag_folders:
+        return sub_path_from_tag('', filename, md_text)
+    if no_export_tags and any(
+            tag.lower().startswith(nt.lower())
+            for _, _, tag in _scan_tags(md_text) for nt in no_export_tags):
+        return []
+    return [filename]
 
-    note_count = 0
-    expected_paths = set()
 
-    try:
-        with sqlite3.connect(temp_db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            query = (
-                "SELECT ZTITLE, ZTEXT, ZCREATIONDATE, ZMODIFICATIONDATE, "
-                "       ZUNIQUEIDENTIFIER, Z_PK "
-                "FROM ZSFNOTE "
-                "WHERE ZTRASHED = 0 AND ZARCHIVED = 0"
-            )
-            # Use a dedicated cursor so that sub-queries inside the
-            # loop (image lookups in make_text_bundle /
-            # process_image_links) don't disturb the main iteration.
-            # This also avoids loading the entire result set — and
-            # every note's ZTEXT — into memory at once.
-            main_cursor = conn.cursor()
-            main_cursor.execute(query)
-
-            for row in main_cursor:
-                title    = row['ZTITLE']
-                md_text  = row['ZTEXT'].rstrip()
-                creation = row['ZCREATIONDATE']
-                modified = row['ZMODIFICATIONDATE']
-                uuid     = row['ZUNIQUEIDENTIFIER']
-                pk       = row['Z_PK']
-                filename = clean_title(title)
+def _first_tag(tags, md_text):
+    """The tag of *tags* that appears first in *md_text*."""
+    def position(tag):
+        i = md_text.find('#' + tag)
+        return i if i >= 0 else len(md_text)
+    return min(tags, key=position)
 
-                if make_tag_folders:
-                    file_list = sub_path_from_tag(export_path, filename, md_text)
-                else:
-                    is_excluded = any(("#" + tag) in md_text for tag in no_export_tags)
-                    file_list = [] if is_excluded else [os.path.join(export_path, filename)]
 
-                if not file_list:
-                    continue
+def _tag_folder(tag):
+    """Export-relative NFC folder for *tag*; hidden dot-tags become _tag."""
+    tag = _nfc(tag)
+    return ('_' + tag[1:]) if tag.startswith('.') else tag
 
-                mod_dt  = dt_conv(modified)
-                md_text = hide_tags(md_text)
 
-                # Inject hidden BearID on the second line
-                lines = md_text.split('\n', 1)
-                if len(lines) > 1:
-                    md_text = f"{lines[0]}\n[//]: # ({{BearID:{uuid}}})\n{lines[1]}"
-                else:
-                    md_text = f"{md_text}\n[//]: # ({{BearID:{uuid}}})"
+def export_markdown(targets):
+    """Export notes from Bear directly into every target folder (in-place).
 
-                for filepath in file_list:
-                    note_count += 1
+    Unchanged notes are skipped with one lstat per exported path and
+    no other I/O.  The note list is read in two phases: metadata first,
+    then ZTEXT is selected only for notes whose modification date
+    differs from at least one target's manifest or whose exported files
+    have gone.
+    Each such note is read and transformed (hide_tags, BearID injection)
+    once and then handed to every target that needs it.  A changed note
+    whose rendered text hash and paths still match a target's record is
+    not rewritten there.  Without a compatible manifest the target file's
+    mtime is compared with the Bear modification date instead.
 
-                    # ── Incremental skip (in-place) ──────────────────────
-                    # File exists with mtime >= Bear mod time → up to date.
-                    # Record in manifest and skip — zero I/O.
-                    if not export_as_textbundles:
+    Results are collected on each target: note_count, written, and
+    expected_paths — the absolute paths that should exist after this
+    export, used to remove files no longer in Bear.
+    """
+    with _bear_db_snapshot() as conn:
+        # Phase 1: metadata only.  Notes whose modification date
+        # matches the manifest are settled without selecting ZTEXT, so
+        # a no-change run materializes no note text in Python.  SQLite
+        # still reads ZTEXT's overflow pages to reach ZUNIQUEIDENTIFIER,
+        # which Core Data stores after it, so disk reads barely drop
+        # (see benchmarks/bench_note_query.py).
+        # --excludeTag is applied here when Bear's tag tables are known.
+        with _phase('query'):
+            tag_schema = _tag_schema(conn)
+            excluded, params = _excluded_tags_sql(tag_schema)
+            metadata = conn.execute(
+                "SELECT Z_PK, ZUNIQUEIDENTIFIER, ZTITLE, "
+                "       ZCREATIONDATE, ZMODIFICATIONDATE "
+                "FROM ZSFNOTE "
+                "WHERE ZTRASHED = 0 AND ZARCHIVED = 0 "
+                f"{excluded}"
+                "ORDER BY Z_PK", params
+            ).fetchall()
+
+        live = {meta['ZUNIQUEIDENTIFIER']: meta['ZTITLE'] for meta in metadata}
+        for target in targets:
+            target.allocator = PathAllocator(target.manifest, live)
+
+        changed = []
+        targets_by_pk = {}
+        indexes_by_pk = {}
+        for meta in metadata:
+            uuid = meta['ZUNIQUEIDENTIFIER']
+            stale = []
+            for target in targets:
+                if (target.manifest.unchanged_since(uuid, meta['ZMODIFICATIONDATE'])
+                        and (target.is_archive or target.manifest.on_disk(uuid))):
+                    recorded = target.manifest.keep(uuid)
+                    target.allocator.claim(uuid, recorded)
+                    target.expected_paths.update(recorded)
+                    target.note_count += len(recorded)
+                else:
+                    stale.append(target)
+            behind = [ix for ix in note_indexes
+                      if not ix.is_current(uuid, meta['ZMODIFICATIONDATE'])]
+            if stale or behind:
+                changed.append(meta)
+                targets_by_pk[meta['Z_PK']] = stale
+                indexes_by_pk[meta['Z_PK']] = behind
+
+        # Attachments for every changed note in one batched query, and
+        # one listing cache for the Bear image store and assets folders.
+        with _phase('query'):
+            attachments = _load_attachment_index(conn, [m['Z_PK'] for m in changed])
+            note_tags = None
+            if tag_schema is not None:
+                note_tags = (_load_note_tags(conn, tag_schema,
+                                             [m['Z_PK'] for m in changed])
+                             if make_tag_folders or note_indexes else {})
+        primary = _primary_manifest() if note_indexes else None
+        image_dirs = _DirListingCache()
+        writes = _WritePipeline(write_workers)
+        made_dirs = set()      # note folders known to exist this run
+
+        def export_to_target(target, uuid, md_text, digest, stems,
+                             modified, creation, image_map):
+            manifest = target.manifest
+            file_list = [target.allocator.allocate(
+                             uuid, os.path.join(target.export_path, s))
+                         for s in stems]
+
+            # ── Manifest skip ────────────────────────────────────────
+            # Same rendered text at the same paths as last run → up to
+            # date, whatever the modification date says.  Catches
+            # CloudKit edits carrying older timestamps, which the
+            # mtime check below would wrongly treat as current.
+            if (manifest.is_current(uuid, digest, file_list)
+                    and (target.archive is not None or manifest.on_disk(uuid))):
+                recorded = manifest.paths(uuid)
+                manifest.record(uuid, modified, digest, recorded)
+                target.expected_paths.update(recorded)
+                target.note_count += len(recorded)
+                return
+
+            mod_dt = dt_conv(modified)
+            if target.archive is not None:
+                note_paths = _archive_note(target, uuid, md_text, file_list,
+                                           mod_dt, image_map, image_dirs)
+                target.note_count += len(note_paths)
+                target.written += len(note_paths)
+                target.expected_paths.update(note_paths)
+                manifest.record(uuid, modified, digest, note_paths)
+                return
+
+            note_paths = []
+            # Recorded paths this run no longer writes: a retitle or tag
+            # change.  They are moved into place instead of rewritten.
+            movable = [p for p in manifest.paths(uuid)
+                       if os.path.splitext(p)[0] not in file_list]
+            for filepath in file_list:
+                target.note_count += 1
+                # file_list[0] is the canonical copy; the rest are tag folders.
+                canonical = note_paths[0] if note_paths else None
+
+                # ── Incremental skip (in-place) ──────────────────────
+                # Without a manifest: file exists with mtime >= Bear
+                # mod time → up to date.  Skip — zero writes.  A linked
+                # tag-folder copy must also still be the right link.
+                linked_copy = canonical is not None and tag_folder_links != 'copy'
+                if canonical is not None and not linked_copy:
+                    # Left over from a link mode: writing through it would
+                    # change the canonical note, so a real copy replaces it.
+                    for ext in ('.md', '.textbundle'):
+                        if os.path.islink(filepath + ext):
+                            os.remove(filepath + ext)
+                if linked_copy:
+                    out = filepath + os.path.splitext(canonical)[1]
+                    if (not manifest.loaded
+                            and _is_linked(canonical, out, tag_folder_links)):
+                        note_paths.append(out)
+                        continue
+                elif not manifest.loaded:
+                    if not target.as_textbundles:
                         target_md = filepath + '.md'
                         if (os.path.exists(target_md)
                                 and os.path.getmtime(target_md) >= mod_dt):
-                            expected_paths.add(target_md)
+                            note_paths.append(target_md)
                             continue
                     else:
                         target_tb = filepath + '.textbundle'
                         target_md = filepath + '.md'
                         if (os.path.isdir(target_tb)
                                 and os.path.getmtime(target_tb) >= mod_dt):
-                            expected_paths.add(target_tb)
+                            note_paths.append(target_tb)
                             continue
                         elif (os.path.exists(target_md)
                                 and os.path.getmtime(target_md) >= mod_dt):
-                            expected_paths.add(target_md)
+                            note_paths.append(target_md)
                             continue
 
-                    # ── Full export (note is new or modified) ────────────
-                    if export_as_textbundles:
-                        if check_image_hybrid(md_text, filepath):
-                            make_text_bundle(md_text, filepath, mod_dt, conn, pk)
-                            expected_paths.add(filepath + '.textbundle')
-                        else:
-                            write_file(filepath + '.md', md_text, mod_dt, creation)
-                            expected_paths.add(filepath + '.md')
-                    elif export_image_repository:
-                        md_proc = process_image_links(md_text, filepath, conn, pk)
-                        write_file(filepath + '.md', md_proc, mod_dt, creation)
-                        expected_paths.add(filepath + '.md')
+                # ── Full export (note is new or modified) ────────────
+                # The output path is decided here so expected_paths
+                # stays exact; the writes themselves run on the pool.
+                parent = os.path.dirname(filepath)
+                if parent not in made_dirs:
+                    _adopt_dir_spelling(parent, target.export_path)
+                    os.makedirs(parent, exist_ok=True)
+                    made_dirs.add(parent)
+                writes.wait(filepath)
+                if movable and _move_retitled(target, movable, filepath, md_text):
+                    target.renamed += 1
+                _adopt_spelling(filepath + '.md')
+                if target.as_textbundles:
+                    _adopt_spelling(filepath + '.textbundle')
+                if linked_copy:
+                    # Tag-folder copy: link it to the canonical file once
+                    # that job (same key, so it runs first) has written it.
+                    writes.submit(file_list[0], out, _place_tag_copy,
+                                  canonical, out, tag_folder_links)
+                elif target.as_textbundles:
+                    if check_image_hybrid(md_text, filepath, target):
+                        out = filepath + '.textbundle'
+                        writes.submit(filepath, out, make_text_bundle,
+                                      md_text, filepath, mod_dt,
+                                      image_map, image_dirs)
                     else:
-                        write_file(filepath + '.md', md_text, mod_dt, creation)
-                        expected_paths.add(filepath + '.md')
-    finally:
-        if os.path.exists(temp_db_path) and temp_db_path != bear_db:
-            os.remove(temp_db_path)
+                        out = filepath + '.md'
+                        writes.submit(filepath, out, write_file,
+                                      out, md_text, mod_dt, creation)
+                elif target.image_repository:
+                    out = filepath + '.md'
+                    writes.submit(filepath, out, _write_repository_note,
+                                  target, md_text, filepath, mod_dt, creation,
+                                  image_map, image_dirs)
+                else:
+                    out = filepath + '.md'
+                    writes.submit(filepath, out, write_file,
+                                  out, md_text, mod_dt, creation)
+                note_paths.append(out)
+                target.written += 1
+
+            target.expected_paths.update(note_paths)
+            manifest.record(uuid, modified, digest, note_paths)
+
+        try:
+            # Phase 2: text for changed notes only, in batched IN queries.
+            for row, text in _iter_note_texts(conn, changed):
+                title    = row['ZTITLE'] or ''
+                md_text  = text.rstrip()
+                creation = row['ZCREATIONDATE']
+                modified = row['ZMODIFICATIONDATE']
+                uuid     = row['ZUNIQUEIDENTIFIER']
+                pk       = row['Z_PK']
+                note_targets = targets_by_pk[pk]
+
+                tags = note_tags.get(pk, []) if note_tags is not None else None
+                stems = note_sub_paths(clean_title(title), md_text, tags)
+                if not stems:
+                    digest = _content_hash(md_text)
+                    for target in note_targets:
+                        target.manifest.record(uuid, modified, digest, [])
+                    # Excluded by a text tag: never stored, so re-read
+                    # each run like an unknown note.
+                    for ix in indexes_by_pk[pk]:
+                        ix.remove(uuid)
+                    continue
+                if indexes_by_pk[pk] and tags is None:
+                    tags = list(dict.fromkeys(t for _, _, t in _scan_tags(md_text)))
 
-    return note_count, expected_paths
+                with _phase('transform'):
+                    md_text = hide_tags(md_text)
 
+                    # Inject hidden BearID on the second line
+                    lines = md_text.split('\n', 1)
+                    if len(lines) > 1:
+                        md_text = f"{lines[0]}\n[//]: # ({{BearID:{uuid}}})\n{lines[1]}"
+                    else:
+                        md_text = f"{md_text}\n[//]: # ({{BearID:{uuid}}})"
 
-def check_image_hybrid(md_text, filepath):
-    if not export_as_hybrids:
+                    digest = _content_hash(md_text)
+                image_map = attachments.get(pk, {})
+                for target in note_targets:
+                    if target.error is not None:
+                        continue
+                    try:
+                        export_to_target(target, uuid, md_text, digest, stems,
+                                         modified, creation, image_map)
+                    except Exception as e:
+                        _target_failed(target, title or uuid, e)
+                if indexes_by_pk[pk]:
+                    entry = primary.notes.get(uuid)
+                    note = ExportedNote(uuid, title, dt_conv(creation),
+                                        dt_conv(modified), tags or [], image_map,
+                                        md_text, entry['paths'] if entry else [])
+                    with _phase('index'):
+                        for ix in indexes_by_pk[pk]:
+                            ix.update(note)
+        finally:
+            errors = writes.close()
+
+    for label, e in errors:
+        owners = [t for t in targets
+                  if label.startswith(os.path.join(t.export_path, ''))]
+        for target in owners[-1:] or targets:
+            _target_failed(target, label, e)
+    if note_indexes:
+        with _phase('index'):
+            for ix in note_indexes:
+                ix.finish(live)
+
+
+def _target_failed(target, label, e):
+    """Report a failure for *target*; the first one marks it failed."""
+    print(f"Export failed for {label}: {e}")
+    write_log(f'Export failed: {label}: {e}')
+    if target.error is None:
+        target.error = f'{label}: {e}'
+
+
+def check_image_hybrid(md_text, filepath, target):
+    if not target.as_hybrids:
         return True
     if os.path.exists(filepath + '.textbundle'):
         return True
-    return bool(RE_BEAR_IMAGE.search(md_text) or RE_MD_IMAGE.search(md_text))
+    return _has_image_syntax(md_text) and any(
+        kind == 'bear_image' or kind == 'image'
+        for kind, *_ in _scan_markdown(md_text))
 
 
-def make_text_bundle(md_text, filepath, mod_dt, conn, pk):
+def make_text_bundle(md_text, filepath, mod_dt, image_map, image_dirs=None):
+    """Write *md_text* as a Textbundle, copying the note's images into it.
+
+    *image_map* is the note's {ZFILENAME: file UUID} attachment map and
+    *image_dirs* an optional shared _DirListingCache for the Bear image
+    store.
+
+    Rewriting an existing bundle is incremental: an asset is copied only
+    when its source differs in size or is newer, .bearid and info.json
+    are left untouched when their content is unchanged, and exported
+    assets (UUID_name) the text no longer links are removed.  Editing a
+    note's text rewrites text.md alone.
+    """
+    if image_dirs is None:
+        image_dirs = _DirListingCache()
     bundle_path  = filepath + '.textbundle'
     bundle_assets = os.path.join(bundle_path, 'assets')
-    os.makedirs(bundle_assets, exist_ok=True)
+    if not os.path.isdir(bundle_assets):
+        os.makedirs(bundle_assets)
+    wanted = set()         # asset names the text links
 
     uuid_match = RE_BEAR_ID_FIND_NEW.search(md_text)
     uuid_str   = uuid_match.group(1) if uuid_match else ""
@@ -621,31 +3687,32 @@ def make_text_bundle(md_text, filepath, mod_dt, conn, pk):
     info = f'''{{"transient":true,"type":"net.daringfireball.markdown","version":2,"creatorIdentifier":"net.shinyfrog.bear","bear_uuid":"{uuid_str}"}}'''
 
     if uuid_str:
-        write_file(os.path.join(bundle_path, '.bearid'), uuid_str, mod_dt, 0)
+        write_file(os.path.join(bundle_path, '.bearid'), uuid_str, mod_dt, 0,
+                   touch=False)
 
-    # Copy Bear-native [image:...] images
-    for match in RE_BEAR_IMAGE.findall(md_text):
-        image_name = match
+    def copy_bear1_image(image_name):
+        """Copy a Bear-native [image:UUID/name] image into the bundle."""
         new_name   = image_name.replace('/', '_')
         source     = os.path.join(bear_image_path, image_name)
         target     = os.path.join(bundle_assets, new_name)
-        if os.path.exists(source):
-            shutil.copy2(source, target)
-    md_text = RE_BEAR_IMG_SUB.sub(r'![](assets/\1_\2)', md_text)
-
-    # Build UUID→filename map for this note's attached files
-    image_map = {}
-    for row in conn.execute("SELECT ZFILENAME, ZUNIQUEIDENTIFIER FROM ZSFNOTEFILE WHERE ZNOTE = ?", (pk,)):
-        image_map[row["ZFILENAME"]] = row["ZUNIQUEIDENTIFIER"]
-
-    def replace_markdown_image(m):
-        alt_text  = m.group(1)
-        image_url = m.group(2)
+        src_st     = image_dirs.stat(bear_image_path, *image_name.split('/'))
+        wanted.add(new_name)
+        if src_st is not None and not _asset_current(target, src_st.st_mtime,
+                                                     src_st.st_size):
+            _place_image(source, target)
+        if '/' not in image_name:
+            return None
+        return "![](assets/%s_%s)" % tuple(image_name.split('/', 1))
+
+    def replace_image(kind, alt_text, image_url):
+        if kind == 'bear_image':
+            return copy_bear1_image(alt_text)
         if image_url.startswith("http"):
-            return m.group(0)
-        # Skip images already rewritten by the Bear 1.x [image:] loop above
+            return None
+        # Already exported into this bundle
         if image_url.startswith("assets/"):
-            return m.group(0)
+            wanted.add(urllib.parse.unquote(image_url[len("assets/"):]))
+            return None
         image_filename = urllib.parse.unquote(image_url)
 
         # Use basename for the lookup — the image_map keys are bare
@@ -658,37 +3725,36 @@ def make_text_bundle(md_text, filepath, mod_dt, conn, pk):
             source   = os.path.join(bear_image_path, file_uuid, basename)
             new_name = f"{file_uuid}_{basename}"
             target   = os.path.join(bundle_assets, new_name)
-            if os.path.exists(source):
-                shutil.copy2(source, target)
+            src_st   = image_dirs.stat(bear_image_path, file_uuid, basename)
+            wanted.add(new_name)
+            if src_st is not None and not _asset_current(target, src_st.st_mtime,
+                                                         src_st.st_size):
+                _place_image(source, target)
             return f"![{alt_text}]({urllib.parse.quote(f'assets/{new_name}')})"
-        return m.group(0)
+        return None
 
-    md_text = RE_MD_IMAGE.sub(replace_markdown_image, md_text)
+    if _has_image_syntax(md_text):
+        md_text = _rewrite_spans(md_text, ('bear_image', 'image'), replace_image)
 
     write_file(bundle_path + '/text.md',  md_text, mod_dt, 0)
-    write_file(bundle_path + '/info.json', info,   mod_dt, 0)
+    write_file(bundle_path + '/info.json', info,   mod_dt, 0, touch=False)
+
+    # Only names the exporter itself gives (UUID_name) are pruned, so
+    # files an editor dropped into assets/ are left alone.
+    for name in os.listdir(bundle_assets):
+        if name not in wanted and RE_UUID_FILENAME.match(name):
+            _remove_quietly(os.path.join(bundle_assets, name))
     os.utime(bundle_path, (-1, mod_dt))
 
 
 def sub_path_from_tag(base_path, filename, md_text):
-    tags = []
     if multi_tag_folders:
-        tags.extend(m[0] for m in RE_TAG_PATTERN1.findall(md_text))
-        tags.extend(m[0] for m in RE_TAG_PATTERN2.findall(md_text))
-        if not tags:
-            return [os.path.join(base_path, filename)]
+        tags = list(dict.fromkeys(tag for _, _, tag in _scan_tags(md_text)))
     else:
-        m1 = RE_TAG_PATTERN1.search(md_text)
-        m2 = RE_TAG_PATTERN2.search(md_text)
-        if m1 and m2:
-            tag = m1.group(1) if m1.start(1) < m2.start(1) else m2.group(1)
-        elif m1:
-            tag = m1.group(1)
-        elif m2:
-            tag = m2.group(1)
-        else:
-            return [os.path.join(base_path, filename)]
-        tags = [tag]
+        first = next(_scan_tags(md_text), None)
+        tags = [first[2]] if first else []
+    if not tags:
+        return [os.path.join(base_path, filename)]
 
     paths = [os.path.join(base_path, filename)]
     for tag in tags:
@@ -699,14 +3765,12 @@ def sub_path_from_tag(base_path, filename, md_text):
                 continue
         if any(tag.lower().startswith(nt.lower()) for nt in no_export_tags):
             return []
-        sub_path = ('_' + tag[1:]) if tag.startswith('.') else tag
-        tag_path = os.path.join(base_path, sub_path)
-        os.makedirs(tag_path, exist_ok=True)
+        tag_path = os.path.join(base_path, _tag_folder(tag))
         paths.append(os.path.join(tag_path, filename))
     return paths
 
 
-def process_image_links(md_text, filepath, conn, pk):
+def process_image_links(md_text, filepath, image_file_map, image_dirs, target):
     """
     Rewrite image links in the exported markdown to point at assets_path,
     AND directly copy the image files there (incrementally).
@@ -720,77 +3784,99 @@ def process_image_links(md_text, filepath, conn, pk):
     images.  This replaces the old copy_bear_images() rsync approach, which
     was unreliable because its find-newer gate used a timestamp that had
     already been updated to "now" before the check ran.
+
+    *image_file_map* is the note's {ZFILENAME: file UUID} attachment map
+    (see _load_attachment_index).  Existence and mtime checks go through
+    *image_dirs*, a _DirListingCache shared across the export run.
+    Images land in *target*'s assets_path, or in its archive.
     """
-    # Build filename → UUID map once (outside any closure) for Bear 2.x images
-    image_file_map: dict = {}
-    for row in conn.execute(
-        "SELECT ZFILENAME, ZUNIQUEIDENTIFIER FROM ZSFNOTEFILE WHERE ZNOTE = ?", (pk,)
-    ):
-        image_file_map[row["ZFILENAME"]] = row["ZUNIQUEIDENTIFIER"]
-
-    rel_assets = os.path.relpath(assets_path, export_path)
-
-    def _copy_incremental(source: str, dest: str) -> None:
-        """Copy source → dest only when source is newer; create dirs as needed."""
-        if not os.path.exists(source):
+    if not _has_image_syntax(md_text):
+        return md_text
+
+    assets_path = target.assets_path
+    rel_assets = os.path.relpath(assets_path, target.export_path)
+
+    def _copy_incremental(img_uuid: str, img_filename: str) -> None:
+        """Copy a Bear image into assets_path only when the source is newer."""
+        src_mtime = image_dirs.mtime(bear_image_path, img_uuid, img_filename)
+        if src_mtime is None:
+            return
+        if target.archive is not None:
+            target.archive.add_image(
+                os.path.join(bear_image_path, img_uuid, img_filename),
+                f"{rel_assets}/{img_uuid}/{img_filename}")
+            return
+        dst_mtime = image_dirs.mtime(assets_path, img_uuid, img_filename)
+        if dst_mtime is not None and dst_mtime >= src_mtime:
             return
-        if os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(source):
+        dest = os.path.join(assets_path, img_uuid, img_filename)
+        if not image_dirs.claim(dest):
             return
         os.makedirs(os.path.dirname(dest), exist_ok=True)
-        shutil.copy2(source, dest)
-
-    # ── Bear 1.x: [image:UUID/filename] ─────────────────────────────────────
-    def rewrite_bear1_image(m):
-        ref = m.group(1)              # "UUID/filename"
-        parts = ref.split('/', 1)
-        if len(parts) != 2:
-            return m.group(0)
-        img_uuid, img_filename = parts
-        source = os.path.join(bear_image_path, img_uuid, img_filename)
-        dest   = os.path.join(assets_path, img_uuid, img_filename)
-        _copy_incremental(source, dest)
-        rel = f"{rel_assets}/{img_uuid}/{img_filename}"
-        return f"![]({urllib.parse.quote(rel)})"
-
-    md_text = RE_BEAR_IMAGE.sub(rewrite_bear1_image, md_text)
-
-    # ── Bear 2.x: ![alt](filename) ──────────────────────────────────────────
-    def rewrite_md_image(m):
-        img_url = m.group(2)
+        _place_image(os.path.join(bear_image_path, img_uuid, img_filename), dest)
+        image_dirs.add(dest)
+
+    def rewrite_image(kind, alt, img_url):
+        # ── Bear 1.x: [image:UUID/filename] ─────────────────────────────────
+        if kind == 'bear_image':
+            parts = alt.split('/', 1)     # "UUID/filename"
+            if len(parts) != 2:
+                return None
+            img_uuid, img_filename = parts
+            _copy_incremental(img_uuid, img_filename)
+            rel = f"{rel_assets}/{img_uuid}/{img_filename}"
+            return f"![]({urllib.parse.quote(rel)})"
+
+        # ── Bear 2.x: ![alt](filename) ──────────────────────────────────────
         if img_url.startswith("http"):
-            return m.group(0)
+            return None
 
         img_filename = urllib.parse.unquote(img_url)
 
         # Skip if the link already points inside assets_path (already exported)
         if img_filename.startswith(rel_assets + '/'):
-            return m.group(0)
+            return None
 
         file_uuid = image_file_map.get(os.path.basename(img_filename))
         if file_uuid is None:
             # Not in DB — leave link unchanged
-            return m.group(0)
+            return None
 
         basename = os.path.basename(img_filename)
-        source   = os.path.join(bear_image_path, file_uuid, basename)
-        dest     = os.path.join(assets_path, file_uuid, basename)
-        _copy_incremental(source, dest)
+        _copy_incremental(file_uuid, basename)
         rel = f"{rel_assets}/{file_uuid}/{basename}"
-        return f"![{m.group(1)}]({urllib.parse.quote(rel)})"
+        return f"![{alt}]({urllib.parse.quote(rel)})"
 
-    return RE_MD_IMAGE.sub(rewrite_md_image, md_text)
+    return _rewrite_spans(md_text, ('bear_image', 'image'), rewrite_image)
 
 
-def restore_image_links(md_text):
-    if export_as_textbundles:
-        return RE_TB_ASSET_IMG.sub(r'![\1](\2)', md_text)
-    elif export_image_repository:
-        relative_asset_path = os.path.relpath(assets_path, export_path)
-        pat = re.compile(
-            r'!\[(.*?)\]\(' + re.escape(relative_asset_path) + r'/(.+?)/(.+?)\)'
-        )
-        return pat.sub(r'![\1](\3)', md_text)
-    return md_text
+def restore_image_links(md_text, target):
+    """Point exported image links back at the bare attachment names Bear uses."""
+    if target.as_textbundles:
+        prefix = 'assets/'
+    elif target.image_repository:
+        prefix = os.path.relpath(target.assets_path, target.export_path) + '/'
+    else:
+        return md_text
+
+    def restore(kind, alt, url):
+        if not url.startswith(prefix):
+            return None
+        rest = url[len(prefix):]
+        if target.as_textbundles:
+            # assets/UUID_name "title" -> name
+            title = rest.find(' "')
+            if title > 0 and rest.endswith('"'):
+                rest = rest[:title]
+            sep = rest.find('_', 1)
+        else:
+            # BearImages/UUID/name -> name
+            sep = rest.find('/', 1)
+        if sep < 0 or sep == len(rest) - 1:
+            return None
+        return f"![{alt}]({rest[sep + 1:]})"
+
+    return _rewrite_spans(md_text, ('image',), restore)
 
 
 # ===========================================================================
@@ -804,7 +3890,13 @@ _IMPORT_SKIP_DIRS = frozenset({
 
 
 def _iter_changed_note_files(root_path, ts_last_sync):
-    """Yield (abs_path, mtime) for note files changed since *ts_last_sync*."""
+    """Yield (abs_path, mtime) for note files changed since *ts_last_sync*.
+
+    Two spellings of one name (NFC and NFD copies on a byte-preserving
+    volume) are the same note, as are tag-folder hardlinks and symlinks
+    to one file; only the first is yielded.
+    """
+    seen = set()
     for (root, dirnames, filenames) in os.walk(root_path):
         dirnames[:] = [d for d in dirnames
                        if d not in _IMPORT_SKIP_DIRS
@@ -814,33 +3906,45 @@ def _iter_changed_note_files(root_path, ts_last_sync):
                 continue
             md_file = os.path.join(root, filename)
             try:
-                ts = os.path.getmtime(md_file)
+                st = os.stat(md_file)
             except OSError:
                 continue
-            if ts > ts_last_sync:
-                yield md_file, ts
+            ident = (st.st_dev, st.st_ino)
+            if (st.st_mtime > ts_last_sync
+                    and ident not in seen and _nfc(md_file) not in seen):
+                seen.update((ident, _nfc(md_file)))
+                yield md_file, st.st_mtime
 
 
 def _open_bear_db_readonly():
     """Open Bear DB in read-only mode for repeated import lookups."""
-    conn = sqlite3.connect(f"file:{bear_db}?mode=ro", uri=True)
+    conn = sqlite3.connect(_bear_db_uri(), uri=True)
     conn.row_factory = sqlite3.Row
     return conn
 
-def sync_md_updates():
-    if not os.path.exists(sync_ts_file) or not os.path.exists(export_ts_file_exp):
+def sync_md_updates(target):
+    """Import notes changed in *target*'s folder since its last sync."""
+    if (not os.path.exists(target.sync_ts_file)
+            or not os.path.exists(target.export_ts_file)):
         return False
 
-    ts_last_sync   = os.path.getmtime(sync_ts_file)
-    ts_last_export = os.path.getmtime(export_ts_file_exp)
+    ts_last_sync   = os.path.getmtime(target.sync_ts_file)
+    ts_last_export = os.path.getmtime(target.export_ts_file)
 
     current_sync_ts = time.time()
-    update_sync_time_file(current_sync_ts)
+    update_sync_time_file(current_sync_ts, target)
 
-    changed_files = list(_iter_changed_note_files(export_path, ts_last_sync))
+    export_path = target.export_path
+    with _phase('import_walk'):
+        changed_files = list(_iter_changed_note_files(export_path, ts_last_sync))
     if not changed_files:
         return False
 
+    # Imported notes update the image index; without one the next
+    # export builds it from a full scan instead.
+    images = target.images
+    images.load()
+
     # Lazily build the vault-wide filename index only if image resolution needs it.
     vault_index = None
 
@@ -864,24 +3968,30 @@ def sync_md_updates():
         md_text = read_file(md_file)
         md_text = _convert_html_img_to_markdown(md_text)
         md_text = convert_ref_links_to_inline(md_text)
-        backup_ext_note(md_file)
+        backup_ext_note(md_file, target)
         if '.textbundle' in md_file:
-            textbundle_to_bear(md_text, md_file, ts, db_conn=db_conn)
+            textbundle_to_bear(md_text, md_file, ts, target, db_conn=db_conn)
             write_log('Imported to Bear: ' + md_file)
         else:
-            update_bear_note(md_text, md_file, ts, ts_last_export,
+            update_bear_note(md_text, md_file, ts, ts_last_export, target,
                              vault_index=get_vault_index, db_conn=db_conn)
             write_log('Bear Note Updated: ' + md_file)
+            if images.loaded:
+                images.set(md_file, _local_image_refs(md_text, os.path.dirname(md_file)))
 
     try:
         for md_file, ts in changed_files:
             if not updates_found:
                 time.sleep(1)
             updates_found = True
+            t0 = time.perf_counter()
             _process_one(md_file, ts)
+            if run_profile is not None:
+                run_profile.note(md_file, time.perf_counter() - t0)
     finally:
         if db_conn is not None:
             db_conn.close()
+        images.save()
 
     return updates_found
 
@@ -890,6 +4000,7 @@ def _build_vault_index(root_path):
     """
     Walk the vault once and return a dict mapping filename → absolute path.
     When multiple files share the same name, the first one wins (shallowest).
+    Keys are NFC, so look names up with _nfc().
     """
     index = {}
     for dirpath, dirnames, filenames in os.walk(root_path):
@@ -898,32 +4009,36 @@ def _build_vault_index(root_path):
                        and d != '.git'
                        and d != '__pycache__']
         for fname in filenames:
-            if fname not in index:
-                index[fname] = os.path.join(dirpath, fname)
+            index.setdefault(_nfc(fname), os.path.join(dirpath, fname))
     return index
 
 
 def convert_ref_links_to_inline(md_text):
-    refs = dict(RE_REF_DEF.findall(md_text))
+    spans = list(_scan_markdown(md_text))
+    refs = {text: target for kind, _, _, text, target in spans if kind == 'ref_def'}
     if not refs:
         return md_text
-    # Convert reference-style image links: ![alt][ref] and ![alt]
-    md_text = RE_REF_IMG.sub(lambda m: f"![{m.group(1)}]({refs.get(m.group(2), m.group(2))})", md_text)
-    md_text = RE_REF_IMP.sub(lambda m: f"![{m.group(1)}]({refs.get(m.group(1), m.group(1))})", md_text)
-    # Convert reference-style web links: [text][ref] and [text]
-    md_text = RE_REF_LINK.sub(lambda m: f"[{m.group(1)}]({refs.get(m.group(2), m.group(2))})", md_text)
-    md_text = RE_REF_LINK_IMP.sub(
-        lambda m: f"[{m.group(1)}]({refs[m.group(1)]})" if m.group(1) in refs else m.group(0),
-        md_text,
-    )
-    md_text = RE_REF_CLEAN.sub('', md_text)
-    return md_text
 
+    def inline(kind, text, label):
+        if kind == 'ref_def':
+            return ''
+        if kind == 'ref_image':
+            # ![alt][ref] and ![alt]
+            label = label or text
+            return f"![{text}]({refs.get(label, label)})"
+        # [text][ref] and [text]; a bare [text] only when it is defined
+        if label:
+            return f"[{text}]({refs.get(label, label)})"
+        return f"[{text}]({refs[text]})" if text in refs else None
 
-def update_bear_note(md_text, md_file, ts, ts_last_export,
+    return _rewrite_spans(md_text, ('ref_def', 'ref_image', 'ref_link'), inline, spans)
+
+
+def update_bear_note(md_text, md_file, ts, ts_last_export, target,
                      vault_index=None, db_conn=None):
     md_text = restore_tags(md_text)
-    md_text = restore_image_links(md_text)
+    md_text = restore_image_links(md_text, target)
+    export_path = target.export_path
 
     match_new = RE_BEAR_ID_FIND_NEW.search(md_text)
     match_old = RE_BEAR_ID_FIND_OLD.search(md_text)
@@ -940,7 +4055,8 @@ def update_bear_note(md_text, md_file, ts, ts_last_export,
 
         # FIX: check conflict BEFORE uploading images (images update Bear's mod time)
         sync_conflict = check_sync_conflict(uuid, ts_last_export, db_conn=db_conn)
-        md_text       = process_md_images(md_text, md_file, uuid=uuid, vault_index=vault_index)
+        md_text       = process_md_images(md_text, md_file, export_path,
+                                          uuid=uuid, vault_index=vault_index)
 
         if sync_conflict:
             link_original = 'bear://x-callback-url/open-note?id=' + uuid
@@ -949,7 +4065,7 @@ def update_bear_note(md_text, md_file, ts, ts_last_export,
             x_create = 'bear://x-callback-url/create?show_window=no&open_note=no'
             bear_x_callback(x_create, md_text, message, '')
         else:
-            orig_title = backup_bear_note(uuid, db_conn=db_conn)
+            orig_title = backup_bear_note(uuid, target, db_conn=db_conn)
             x_replace  = ('bear://x-callback-url/add-text?show_window=no&open_note=no'
                           '&mode=replace_all&id=' + uuid)
             bear_x_callback(x_replace, md_text, '', orig_title)
@@ -959,8 +4075,9 @@ def update_bear_note(md_text, md_file, ts, ts_last_export,
         recovered_uuid = lookup_uuid_by_title(note_title, db_conn=db_conn)
 
         if recovered_uuid:
-            md_text    = process_md_images(md_text, md_file, uuid=recovered_uuid, vault_index=vault_index)
-            orig_title = backup_bear_note(recovered_uuid, db_conn=db_conn)
+            md_text    = process_md_images(md_text, md_file, export_path,
+                                           uuid=recovered_uuid, vault_index=vault_index)
+            orig_title = backup_bear_note(recovered_uuid, target, db_conn=db_conn)
             x_replace  = ('bear://x-callback-url/add-text?show_window=no&open_note=no'
                           '&mode=replace_all&id=' + recovered_uuid)
             bear_x_callback(x_replace, md_text, '', orig_title)
@@ -972,7 +4089,8 @@ def update_bear_note(md_text, md_file, ts, ts_last_export,
             time.sleep(1.0)
 
             new_uuid       = lookup_uuid_by_title(note_title, db_conn=db_conn)
-            final_md_text  = process_md_images(md_text_tags, md_file, uuid=new_uuid,
+            final_md_text  = process_md_images(md_text_tags, md_file, export_path,
+                                               uuid=new_uuid,
                                                note_title=note_title, vault_index=vault_index)
 
             if final_md_text != md_text_tags:
@@ -986,15 +4104,17 @@ def update_bear_note(md_text, md_file, ts, ts_last_export,
                 bear_x_callback(x_replace, final_md_text, '', '')
 
 
-def process_md_images(md_text, md_file, uuid=None, note_title=None, vault_index=None):
+def process_md_images(md_text, md_file, export_path, uuid=None, note_title=None,
+                      vault_index=None):
     """
     For each image reference in md_text:
       - Skip remote URLs unchanged
       - Identify whether it is already a Bear-exported image (no re-upload needed)
       - Otherwise upload the image to Bear via x-callback-url and rewrite the link
+    export_path: root of the export folder md_file belongs to.
     vault_index: pre-built {filename: abs_path} map to avoid repeated os.walk calls.
+    HTML <img> tags come back as markdown images.
     """
-    md_text = _convert_html_img_to_markdown(md_text)
     md_dir = os.path.dirname(md_file)
     resolved_index = None
     index_loaded = False
@@ -1015,8 +4135,8 @@ def process_md_images(md_text, md_file, uuid=None, note_title=None, vault_index=
             resolved_index = vault_index() if callable(vault_index) else vault_index
             index_loaded = True
         target_name = os.path.basename(img_path_unquoted)
-        if resolved_index and target_name in resolved_index:
-            return resolved_index[target_name]
+        if resolved_index and _nfc(target_name) in resolved_index:
+            return resolved_index[_nfc(target_name)]
         # 4. Fallback: fresh os.walk
         if not resolved_index:
             for root, dirs, files in os.walk(export_path):
@@ -1061,21 +4181,28 @@ def process_md_images(md_text, md_file, uuid=None, note_title=None, vault_index=
                     x_add_file = (f"bear://x-callback-url/add-file?show_window=no&open_note=no"
                                   f"&title={safe_title}&filename={safe_filename}&mode=append&file={safe_file}")
 
-                url = NSURL.URLWithString_(x_add_file)
-                if url is not None:
-                    NSWorkspace.sharedWorkspace().openURL_configuration_completionHandler_(url, open_config, None)
-                    time.sleep(0.5)
+                with _phase('xcallback'):
+                    if platform_backend().open_url(x_add_file):
+                        time.sleep(0.5)
             except Exception as e:
                 print(f"Image upload failed for {img_filename}: {e}")
 
         return f"![{alt_text}]({urllib.parse.quote(img_filename)})"
 
-    new_md = RE_MD_IMAGE.sub(lambda m: upload_and_format(m.group(1), m.group(2)), md_text)
-    new_md = RE_WIKI_IMAGE.sub(lambda m: upload_and_format("image", m.group(1)), new_md)
-    return new_md
+    def rewrite(kind, text, target):
+        if kind == 'wiki_image':
+            return upload_and_format("image", text)
+        if kind == 'html_img':
+            if not (target or '').strip():
+                return None
+            return upload_and_format(_html_img_alt(text), target.strip())
+        return upload_and_format(text, target)
+
+    return _rewrite_spans(md_text, ('image', 'wiki_image', 'html_img'), rewrite)
 
 
-def textbundle_to_bear(md_text, md_file, mod_dt, db_conn=None):
+def textbundle_to_bear(md_text, md_file, mod_dt, target, db_conn=None):
+    export_path = target.export_path
     md_text = restore_tags(md_text)
     md_text = _convert_html_img_to_markdown(md_text)
     bundle  = os.path.split(md_file)[0]
@@ -1112,15 +4239,17 @@ def textbundle_to_bear(md_text, md_file, mod_dt, db_conn=None):
         clean_md = RE_BEAR_ID_OLD.sub('', clean_md)
         clean_md = clean_md.rstrip() + '\n'
 
+        # One scan of the note serves the three image passes below.
+        spans = [s for s in _scan_markdown(clean_md) if s[0] == 'image']
+
         # Normalise image paths to assets/ prefix for file writes
-        def fix_image_path(m):
-            image_url = m.group(2)
+        def fix_image_path(kind, alt, image_url):
             if image_url.startswith("http"):
-                return m.group(0)  # Preserve web URLs as-is
+                return None  # Preserve web URLs as-is
             filename = urllib.parse.unquote(image_url).split('/')[-1]
-            return f"![{m.group(1)}](assets/{urllib.parse.quote(filename)})"
+            return f"![{alt}](assets/{urllib.parse.quote(filename)})"
 
-        fixed_md = RE_MD_IMAGE.sub(fix_image_path, clean_md)
+        fixed_md = _rewrite_spans(clean_md, ('image',), fix_image_path, spans)
 
         write_file(md_file, fixed_md.rstrip() + id_tag, mod_dt, 0)
         write_file(os.path.join(bundle, '.bearid'), uuid, mod_dt, 0)
@@ -1189,8 +4318,7 @@ def textbundle_to_bear(md_text, md_file, mod_dt, db_conn=None):
         # Move any loose image files into assets/ and collect new ones to upload.
         # Deduplicate by filename so repeated references upload once.
         new_images_to_upload = {}
-        for m in RE_MD_IMAGE.finditer(clean_md):
-            img_url = m.group(2)
+        for _, _, _, _, img_url in spans:
             if img_url.startswith("http://") or img_url.startswith("https://"):
                 continue  # Skip web URLs — not local assets
             source_path, img_filename = resolve_tb_image_source(img_url)
@@ -1216,19 +4344,17 @@ def textbundle_to_bear(md_text, md_file, mod_dt, db_conn=None):
                 safe_file     = urllib.parse.quote(encoded, safe='')
                 x_add_file = (f"bear://x-callback-url/add-file?show_window=no&open_note=no"
                               f"&id={uuid}&filename={safe_filename}&mode=append&file={safe_file}")
-                url = NSURL.URLWithString_(x_add_file)
-                if url is not None:
-                    NSWorkspace.sharedWorkspace().openURL_configuration_completionHandler_(url, open_config, None)
-                    time.sleep(0.3)
-                    existing_bear_filenames.add(filename)
+                with _phase('xcallback'):
+                    if platform_backend().open_url(x_add_file):
+                        time.sleep(0.3)
+                        existing_bear_filenames.add(filename)
             except Exception as e:
                 print(f"Image upload failed for {filename}: {e}")
 
         # Build the Bear-formatted text (strip UUID prefix from filenames)
-        def restore_img_format(m):
-            image_url = m.group(2)
+        def restore_img_format(kind, alt, image_url):
             if image_url.startswith("http"):
-                return m.group(0)  # Preserve web URLs as-is
+                return None  # Preserve web URLs as-is
             filename   = urllib.parse.unquote(image_url).split('/')[-1]
             # Only strip UUID prefix for known Bear-exported attachment names.
             # New TB inserts might also start with UUID-like text and must keep
@@ -1237,44 +4363,43 @@ def textbundle_to_bear(md_text, md_file, mod_dt, db_conn=None):
                 clean_name = filename.split('_', 1)[1]
             else:
                 clean_name = filename
-            return f"![{m.group(1)}]({urllib.parse.quote(clean_name)})"
+            return f"![{alt}]({urllib.parse.quote(clean_name)})"
 
-        bear_md = RE_MD_IMAGE.sub(restore_img_format, clean_md)
+        bear_md = _rewrite_spans(clean_md, ('image',), restore_img_format, spans)
         x_replace = (f"bear://x-callback-url/add-text?show_window=no&open_note=no"
                      f"&mode=replace_all&id={uuid}"
                      f"&text={urllib.parse.quote(bear_md, safe='')}")
-        url = NSURL.URLWithString_(x_replace)
-        if url is not None:
-            NSWorkspace.sharedWorkspace().openURL_configuration_completionHandler_(url, open_config, None)
-            time.sleep(0.5)
+        with _phase('xcallback'):
+            if platform_backend().open_url(x_replace):
+                time.sleep(0.5)
     else:
         md_text = get_tag_from_path(md_text, bundle, export_path)
         write_file(md_file, md_text, mod_dt, 0)
         os.utime(bundle, (-1, mod_dt))
-        subprocess.call(['open', '-a', 'Bear', bundle])
+        platform_backend().open_in_bear(bundle)
         time.sleep(0.5)
 
 
-def backup_ext_note(md_file):
+def backup_ext_note(md_file, target):
     if '.textbundle' in md_file:
         bundle_path = os.path.split(md_file)[0]
         bundle_name = os.path.split(bundle_path)[1]
-        target      = os.path.join(sync_backup, bundle_name)
-        bundle_raw  = os.path.splitext(target)[0]
+        dest        = os.path.join(target.sync_backup, bundle_name)
+        bundle_raw  = os.path.splitext(dest)[0]
         count = 2
-        while os.path.exists(target):
-            target = bundle_raw + " - " + str(count).zfill(2) + ".textbundle"
+        while os.path.exists(dest):
+            dest = bundle_raw + " - " + str(count).zfill(2) + ".textbundle"
             count += 1
-        shutil.copytree(bundle_path, target)
+        shutil.copytree(bundle_path, dest)
     else:
-        shutil.copy2(md_file, sync_backup + '/')
+        shutil.copy2(md_file, target.sync_backup + '/')
 
 
-def update_sync_time_file(ts):
-    write_file(sync_ts_file,
+def update_sync_time_file(ts, target):
+    write_file(target.sync_ts_file,
                "Checked for Markdown updates to sync at: " +
                datetime.datetime.now().strftime("%Y-%m-%d at %H:%M:%S"),
-               ts, 0)
+               ts, 0, counted=False)
 
 
 # ===========================================================================
@@ -1304,8 +4429,9 @@ def check_sync_conflict(uuid, ts_last_export, db_conn=None):
     return False
 
 
-def backup_bear_note(uuid, db_conn=None):
-    """Back up the current Bear note to the sync_backup folder. Returns the note title."""
+def backup_bear_note(uuid, target, db_conn=None):
+    """Back up the current Bear note to the target's sync_backup folder. Returns the note title."""
+    sync_backup = target.sync_backup
     title = ''
     try:
         row = _fetchone_bear(
@@ -1411,17 +4537,15 @@ def get_file_tags(md_file):
 # ===========================================================================
 
 def bear_x_callback(x_command, md_text, message, orig_title):
-    if message:
-        lines = md_text.splitlines()
-        lines.insert(1, message)
-        md_text = '\n'.join(lines)
-    x_command_text = x_command + '&text=' + urllib.parse.quote(md_text, safe='')
-    url = NSURL.URLWithString_(x_command_text)
-    if url is not None:
-        NSWorkspace.sharedWorkspace().openURL_configuration_completionHandler_(url, open_config, None)
-    else:
-        print("Warning: could not build NSURL for sync (unusual characters in text?).")
-    time.sleep(.2)
+    with _phase('xcallback'):
+        if message:
+            lines = md_text.splitlines()
+            lines.insert(1, message)
+            md_text = '\n'.join(lines)
+        x_command_text = x_command + '&text=' + urllib.parse.quote(md_text, safe='')
+        if not platform_backend().open_url(x_command_text):
+            print("Warning: could not build NSURL for sync (unusual characters in text?).")
+        time.sleep(.2)
 
 
 # ===========================================================================
@@ -1459,8 +4583,7 @@ def check_if_image_added(md_text, md_file):
 def notify(message):
     title = "ul_sync_md.py"
     try:
-        subprocess.call(['/Applications/terminal-notifier.app/Contents/MacOS/terminal-notifier',
-                         '-message', message, "-title", title, '-sound', 'default'])
+        platform_backend().notify(title, message)
     except:
         write_log('"terminal-notifier.app" is missing!')
 
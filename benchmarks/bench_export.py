@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+bench_export.py — End-to-end export cost against a synthetic Bear library
+
+Builds a synthetic Bear database and "Note Images" folder in a throwaway
+HOME, then drives bear_export_sync's export() in-process with the
+platform backend stubbed out, for each format (md, tb):
+
+  cold          empty export folder — every note and image written
+  warm          database touched, nothing changed — manifest fast path
+  changed_1pct  1% of notes edited (text and ZMODIFICATIONDATE)
+
+Reported per format and scenario: best wall and CPU time over --repeat
+rounds, plus the engine's own counts (notes, written, removed) and
+write_file() tally.  --json writes the results with the commit they
+were measured at, so runs can be compared across commits.
+
+Usage:
+  python3 benchmarks/bench_export.py --notes 10000 --image-density 0.2 \
+      --tags-per-note 3 --tag-folders --json export.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic_bear_db import create_database
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_BEAR_DIR = ("Library/Group Containers/9K33E3U3T4.net.shinyfrog.bear/"
+             "Application Data")
+_SCENARIOS = ("cold", "warm", "changed_1pct")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=_ROOT,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _touch_db(db_path):
+    # Database newer than the export stamp → check_db_modified() true.
+    os.utime(db_path, (time.time(), time.time() + 5))
+
+
+def _edit_notes(db_path, fraction, rng):
+    """Append a line to *fraction* of the visible notes and bump their dates."""
+    with sqlite3.connect(db_path) as conn:
+        pks = [r[0] for r in conn.execute(
+            "SELECT Z_PK FROM ZSFNOTE WHERE ZTRASHED = 0 AND ZARCHIVED = 0")]
+        picked = rng.sample(pks, max(1, int(len(pks) * fraction)))
+        conn.executemany(
+            "UPDATE ZSFNOTE SET ZTEXT = ZTEXT || ?, "
+            "ZMODIFICATIONDATE = ZMODIFICATIONDATE + 1 WHERE Z_PK = ?",
+            [(f"\nedit {rng.random():.6f}\n", pk) for pk in picked])
+    _touch_db(db_path)
+
+
+def _export(engine, config):
+    t0, c0 = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = engine.export(config)
+    wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+    target = result["targets"][0]
+    return {"wall_s": wall, "cpu_s": cpu, "notes": target["notes"],
+            "written": target["written"], "removed": target["removed"],
+            "writes": result["writes"]}
+
+
+def _best(runs):
+    return min(runs, key=lambda r: r["wall_s"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--notes", type=int, default=5000)
+    ap.add_argument("--mean-note-bytes", type=int, default=3000)
+    ap.add_argument("--size-distribution", default="exponential",
+                    choices=["exponential", "uniform", "fixed"])
+    ap.add_argument("--image-density", type=float, default=0.1)
+    ap.add_argument("--tags-per-note", type=int, default=2)
+    ap.add_argument("--tag-count", type=int, default=50)
+    ap.add_argument("--collision-rate", type=float, default=0.01)
+    ap.add_argument("--tag-folders", action="store_true",
+                    help="Export with --tagFolders (tag fan-out on disk)")
+    ap.add_argument("--formats", nargs="+", default=["md", "tb"],
+                    choices=["md", "tb"])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bear_bench_") as home:
+        bear_dir = os.path.join(home, _BEAR_DIR)
+        images_dir = os.path.join(bear_dir, "Local Files", "Note Images")
+        os.makedirs(images_dir)
+        db_path = os.path.join(bear_dir, "database.sqlite")
+
+        # The engine resolves Bear's paths from HOME at import time.
+        os.environ["HOME"] = home
+        sys.path.insert(0, _ROOT)
+        import bear_export_sync as engine
+        engine.set_platform_backend(engine.StubBackend())
+
+        results = {}
+        for fmt in args.formats:
+            runs = {name: [] for name in _SCENARIOS}
+            for rnd in range(args.repeat):
+                # Each round starts from the same database and an empty folder.
+                create_database(db_path, args.notes, args.mean_note_bytes,
+                                args.seed,
+                                size_distribution=args.size_distribution,
+                                image_density=args.image_density,
+                                images_dir=images_dir if rnd == 0 else None,
+                                tags_per_note=args.tags_per_note,
+                                tag_count=args.tag_count,
+                                collision_rate=args.collision_rate)
+                out = os.path.join(home, "out")
+                shutil.rmtree(out, ignore_errors=True)
+                config = engine.SyncConfig(
+                    out=out, backup=os.path.join(home, "backup"),
+                    format=fmt, tag_folders=args.tag_folders)
+                runs["cold"].append(_export(engine, config))
+                _touch_db(db_path)
+                runs["warm"].append(_export(engine, config))
+                _edit_notes(db_path, 0.01, random.Random(args.seed + rnd))
+                runs["changed_1pct"].append(_export(engine, config))
+            results[fmt] = {name: _best(r) for name, r in runs.items()}
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "params": {k: v for k, v in vars(args).items() if k != "json"},
+        "results": results,
+    }
+
+    print(f"Export, {args.notes} notes, best of {args.repeat}")
+    print(f"{'format':<8}{'scenario':<14}{'wall':>10}{'cpu':>10}"
+          f"{'written':>9}{'KB written':>12}")
+    for fmt, scenarios in results.items():
+        for name in _SCENARIOS:
+            r = scenarios[name]
+            print(f"{fmt:<8}{name:<14}{r['wall_s'] * 1000:>8.1f}ms"
+                  f"{r['cpu_s'] * 1000:>8.1f}ms{r['written']:>9}"
+                  f"{r['writes']['written_bytes'] // 1024:>12}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
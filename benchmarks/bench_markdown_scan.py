@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+bench_markdown_scan.py — Regex passes vs the single-pass Markdown scanner
+
+Compares, on one note at a time:
+
+  regex    the image and link regexes the exporter used to run, one
+           full pass each (Bear 1.x and inline images on export; HTML,
+           inline and wiki images on import; the six reference-link
+           passes of convert_ref_links_to_inline())
+  scanner  one bear_export_sync._scan_markdown() walk yielding every
+           span those passes looked for
+
+over a realistic note and several pathological single-line inputs
+(unclosed "![", runs of "[" or "(", unmatched backtick runs of every
+length, "<img" without ">"), each at growing sizes.  Reported per input
+and size: best time and nanoseconds per byte.  Flat ns/byte across
+sizes means linear time; for the regexes it grows with the size on the
+pathological inputs.  A regex size is skipped, with every larger one,
+when the previous size's time scaled quadratically to it exceeds
+--regex-limit seconds; a run over the limit is not repeated.
+
+Usage:
+  python3 benchmarks/bench_markdown_scan.py --sizes 4096 16384 65536 \
+      --json scan.json
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The patterns the scanner replaced, as they were in bear_export_sync.py.
+_RE_MD_IMAGE     = re.compile(r'!\[(.*?)\]\(([^)]+)\)')
+_RE_WIKI_IMAGE   = re.compile(r'!\[\[(.*?)\]\]')
+_RE_HTML_IMG_TAG = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+_RE_BEAR_IMAGE   = re.compile(r'\[image:(.+?)\]')
+_RE_REF_DEF      = re.compile(r'^\[(?!\/\/)([^\]]+)\]:\s*(\S+).*$', re.MULTILINE)
+_RE_REF_IMG      = re.compile(r'!\[([^\]]*)\]\[([^\]]+)\]')
+_RE_REF_IMP      = re.compile(r'!\[([^\[\]]+)\](?!\()')
+_RE_REF_LINK     = re.compile(r'(?<!!)\[([^\]]+)\]\[([^\]]+)\]')
+_RE_REF_LINK_IMP = re.compile(r'(?<!!)\[([^\[\]]+)\](?!\(|\[|:)')
+_RE_REF_CLEAN    = re.compile(r'^\[(?!\/\/)[^\]]+\]:\s*\S+.*$\n?', re.MULTILINE)
+
+_REGEX_PASSES = (
+    lambda t: _RE_BEAR_IMAGE.sub(r'\g<0>', t),
+    lambda t: _RE_MD_IMAGE.sub(r'\g<0>', t),
+    lambda t: _RE_HTML_IMG_TAG.sub(r'\g<0>', t),
+    lambda t: _RE_MD_IMAGE.sub(r'\g<0>', t),
+    lambda t: _RE_WIKI_IMAGE.sub(r'\g<0>', t),
+    lambda t: _RE_REF_DEF.findall(t),
+    lambda t: _RE_REF_IMG.sub(r'\g<0>', t),
+    lambda t: _RE_REF_IMP.sub(r'\g<0>', t),
+    lambda t: _RE_REF_LINK.sub(r'\g<0>', t),
+    lambda t: _RE_REF_LINK_IMP.sub(r'\g<0>', t),
+    lambda t: _RE_REF_CLEAN.sub('', t),
+)
+
+
+def _note(size, rng=None):
+    """A note mixing prose with every construct the scanner reports."""
+    rng = rng or random.Random(0)
+    blocks = (
+        "Some prose with a [link](https://example.com/a_(b)) and `code`.",
+        "![photo](image%20{n}.png)",
+        "[image:0AB0C0D0-1111-2222-3333-4444555566{n:02d}/old {n}.png]",
+        "<img src=\"pic{n}.png\" alt=\"pic\">",
+        "See [the docs][ref{n}] and ![[wiki {n}.png]] and [[Other note]].",
+        "```\n![not an image](x.png)\n```",
+        "[ref{n}]: https://example.com/{n}",
+    )
+    parts, total, n = [], 0, 0
+    while total < size:
+        block = rng.choice(blocks).format(n=n % 100)
+        parts.append(block)
+        total += len(block) + 2
+        n += 1
+    return "\n\n".join(parts)[:size]
+
+
+def _backtick_runs(size):
+    """Unmatched backtick runs of every length on one line."""
+    parts, total, n = [], 0, 1
+    while total < size:
+        parts.append("`" * n)
+        total += n + 1
+        n += 1
+    return " ".join(parts)[:size]
+
+
+_INPUTS = {
+    "note": _note,
+    "unclosed_image": lambda size: ("![a" * (size // 3 + 1))[:size],
+    "open_brackets": lambda size: "[" * size,
+    "open_parens": lambda size: ("![a](" + "(" * size)[:size],
+    "backtick_runs": _backtick_runs,
+    "img_no_close": lambda size: ("<img " * (size // 5 + 1))[:size],
+}
+
+
+def _time(fn, text, repeat, limit=None):
+    """Best of *repeat* runs; stops repeating once a run exceeds *limit*."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(text)
+        wall = time.perf_counter() - t0
+        best = wall if best is None else min(best, wall)
+        if limit is not None and wall > limit:
+            break
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[4096, 16384, 65536])
+    ap.add_argument("--inputs", nargs="+", default=list(_INPUTS),
+                    choices=list(_INPUTS))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--regex-limit", type=float, default=5.0, metavar="SECONDS",
+                    help="Skip regex sizes expected to take longer than this")
+    ap.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    args = ap.parse_args()
+
+    # bear_export_sync resolves Bear's paths from HOME at import time.
+    os.environ["HOME"] = tempfile.mkdtemp(prefix="bear_bench_")
+    sys.path.insert(0, _ROOT)
+    from bear_export_sync import _scan_markdown
+
+    def regex(text):
+        for run in _REGEX_PASSES:
+            run(text)
+
+    def scanner(text):
+        for _ in _scan_markdown(text):
+            pass
+
+    results = {"passes": {"regex": len(_REGEX_PASSES), "scanner": 1},
+               "inputs": {}}
+    for name in args.inputs:
+        rows = results["inputs"][name] = []
+        estimate = None     # regex seconds per byte², from the last size run
+        for size in sorted(args.sizes):
+            text = _INPUTS[name](size)
+            row = {"bytes": len(text),
+                   "scanner_s": _time(scanner, text, args.repeat),
+                   "regex_s": None}
+            # Checked before running: the pathological cases are
+            # quadratic, so one size too far can take minutes.
+            if estimate is None or estimate * len(text) ** 2 <= args.regex_limit:
+                row["regex_s"] = _time(regex, text, args.repeat, args.regex_limit)
+                estimate = (row["regex_s"] / len(text) ** 2
+                            if row["regex_s"] <= args.regex_limit else float("inf"))
+            else:
+                estimate = float("inf")
+            rows.append(row)
+
+    print(f"Full-text passes per note: regex {len(_REGEX_PASSES)}, scanner 1")
+    print(f"{'input':<16}{'bytes':>9}{'regex':>12}{'ns/B':>9}"
+          f"{'scanner':>12}{'ns/B':>9}")
+    for name, rows in results["inputs"].items():
+        for r in rows:
+            if r["regex_s"] is None:
+                regex_col = f"{'skipped':>12}{'':>9}"
+            else:
+                regex_col = (f"{r['regex_s'] * 1000:>10.2f}ms"
+                             f"{r['regex_s'] * 1e9 / r['bytes']:>9.0f}")
+            print(f"{name:<16}{r['bytes']:>9}{regex_col}"
+                  f"{r['scanner_s'] * 1000:>10.2f}ms"
+                  f"{r['scanner_s'] * 1e9 / r['bytes']:>9.0f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+bench_note_query.py — Single-pass vs metadata-first note query
+
+Measures a "nothing changed" export run against a synthetic ZSFNOTE
+table, comparing:
+
+  single-pass     SELECT every visible note *with* ZTEXT (the old loop)
+  metadata-first  SELECT (Z_PK, ZUNIQUEIDENTIFIER, ZTITLE, dates), diff
+                  against the previous run's manifest, then fetch ZTEXT
+                  only for changed primary keys in batched IN (...)
+
+Reported per strategy: best wall time, bytes read from the database
+file (``rchar`` from /proc/self/io, Linux only) and bytes of column
+data materialized in Python.
+
+Usage:
+  python3 benchmarks/bench_note_query.py --notes 20000 --mean-note-bytes 8000
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from synthetic_bear_db import create_database
+
+_BATCH = 500
+
+
+def _rchar():
+    try:
+        with open("/proc/self/io", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _payload(row):
+    return sum(len(v.encode("utf-8")) if isinstance(v, str) else 8 for v in row)
+
+
+def single_pass(db_path, manifest):
+    payload = 0
+    with sqlite3.connect(db_path) as conn:
+        for row in conn.execute(
+                "SELECT ZTITLE, ZTEXT, ZCREATIONDATE, ZMODIFICATIONDATE, "
+                "       ZUNIQUEIDENTIFIER, Z_PK "
+                "FROM ZSFNOTE WHERE ZTRASHED = 0 AND ZARCHIVED = 0"):
+            payload += _payload(row)
+    return payload
+
+
+def metadata_first(db_path, manifest):
+    payload = 0
+    with sqlite3.connect(db_path) as conn:
+        changed = []
+        for row in conn.execute(
+                "SELECT Z_PK, ZUNIQUEIDENTIFIER, ZTITLE, "
+                "       ZCREATIONDATE, ZMODIFICATIONDATE "
+                "FROM ZSFNOTE WHERE ZTRASHED = 0 AND ZARCHIVED = 0"):
+            payload += _payload(row)
+            if manifest.get(row[1]) != row[4]:
+                changed.append(row[0])
+        for i in range(0, len(changed), _BATCH):
+            batch = changed[i:i + _BATCH]
+            marks = ",".join("?" * len(batch))
+            for row in conn.execute(
+                    f"SELECT Z_PK, ZTEXT FROM ZSFNOTE WHERE Z_PK IN ({marks})",
+                    batch):
+                payload += _payload(row)
+    return payload
+
+
+def _measure(fn, db_path, manifest, repeat):
+    best = None
+    for _ in range(repeat):
+        r0 = _rchar()
+        t0 = time.perf_counter()
+        payload = fn(db_path, manifest)
+        wall = time.perf_counter() - t0
+        r1 = _rchar()
+        read = (r1 - r0) if r0 is not None and r1 is not None else None
+        if best is None or wall < best["wall_s"]:
+            best = {"wall_s": wall, "db_bytes_read": read,
+                    "payload_bytes": payload}
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--notes", type=int, default=20000)
+    ap.add_argument("--mean-note-bytes", type=int, default=8000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bear_bench_") as tmp:
+        db_path = create_database(os.path.join(tmp, "database.sqlite"),
+                                  args.notes, args.mean_note_bytes)
+        # The previous run's manifest: every visible note already exported.
+        with sqlite3.connect(db_path) as conn:
+            manifest = dict(conn.execute(
+                "SELECT ZUNIQUEIDENTIFIER, ZMODIFICATIONDATE FROM ZSFNOTE "
+                "WHERE ZTRASHED = 0 AND ZARCHIVED = 0"))
+
+        results = {
+            "notes": args.notes,
+            "db_file_bytes": os.path.getsize(db_path),
+            "single_pass": _measure(single_pass, db_path, manifest, args.repeat),
+            "metadata_first": _measure(metadata_first, db_path, manifest, args.repeat),
+        }
+
+    print(f"No-change run, {results['notes']} notes, "
+          f"DB {results['db_file_bytes'] / 1e6:.1f} MB")
+    print(f"{'strategy':<16}{'wall':>10}{'DB read':>14}{'payload':>14}")
+    for name in ("single_pass", "metadata_first"):
+        r = results[name]
+        read = (f"{r['db_bytes_read'] / 1e6:.1f} MB"
+                if r["db_bytes_read"] is not None else "n/a")
+        print(f"{name:<16}{r['wall_s'] * 1000:>8.1f}ms{read:>14}"
+              f"{r['payload_bytes'] / 1e6:>11.2f} MB")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+bench_startup.py — Cold-start cost of bear_export_sync.py
+
+Runs the exporter as a fresh interpreter (what launchd and the
+subprocess engine mode pay per phase) against a synthetic Bear
+database in a throwaway HOME, for three paths:
+
+  no-op        --skipImport with the database older than the last export
+               (check_db_modified() false — should never load pyobjc)
+  export-only  --skipImport after the database changed; every note is
+               already current, so this is startup + metadata query
+  import       --skipExport with no edited files (folder scan only)
+
+Reported per path: best and median wall time, and whether AppKit or
+Foundation ended up in sys.modules.
+
+Usage:
+  python3 benchmarks/bench_startup.py --notes 2000 --repeat 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic_bear_db import create_database
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SCRIPT = os.path.join(_ROOT, "bear_export_sync.py")
+_DB_REL = ("Library/Group Containers/9K33E3U3T4.net.shinyfrog.bear/"
+           "Application Data/database.sqlite")
+
+# Runs the script as __main__ and reports which platform modules loaded.
+_HARNESS = (
+    "import runpy, sys\n"
+    "sys.argv = [sys.argv[1]] + sys.argv[2:]\n"
+    "try:\n"
+    "    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "sys.stderr.write('PYOBJC=%d\\n' % any(m in sys.modules "
+    "for m in ('AppKit', 'Foundation')))\n"
+)
+
+
+def _run(home, args):
+    env = dict(os.environ, HOME=home)
+    t0 = time.perf_counter()
+    r = subprocess.run([sys.executable, "-c", _HARNESS, _SCRIPT] + args,
+                       env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, check=False)
+    wall = time.perf_counter() - t0
+    loaded = b"PYOBJC=1" in r.stderr
+    if b"PYOBJC=" not in r.stderr:
+        raise RuntimeError(r.stderr.decode(errors="replace")[-500:])
+    return wall, loaded
+
+
+def _measure(home, args, repeat, before=None):
+    walls = []
+    loaded = False
+    for _ in range(repeat):
+        if before:
+            before()
+        wall, pyobjc = _run(home, args)
+        walls.append(wall)
+        loaded = loaded or pyobjc
+    return {"best_s": min(walls), "median_s": statistics.median(walls),
+            "pyobjc_loaded": loaded}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--notes", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bear_bench_") as home:
+        db_path = os.path.join(home, _DB_REL)
+        os.makedirs(os.path.dirname(db_path))
+        create_database(db_path, args.notes, 2000)
+        out = os.path.join(home, "out")
+        common = ["--out", out, "--backup", os.path.join(home, "backup")]
+
+        # Initial full export so the measured runs start from a warm tree.
+        _run(home, common + ["--skipImport"])
+
+        def make_stale():
+            # Database newer than the export stamp → check_db_modified() true.
+            os.utime(db_path, (time.time(), time.time() + 5))
+
+        def make_current():
+            os.utime(db_path, (0, 0))
+
+        results = {
+            "notes": args.notes,
+            "no_op": _measure(home, common + ["--skipImport"], args.repeat,
+                              make_current),
+            "export_only": _measure(home, common + ["--skipImport"], args.repeat,
+                                    make_stale),
+            "import": _measure(home, common + ["--skipExport"], args.repeat),
+        }
+
+    print(f"Cold start, {results['notes']} notes, {args.repeat} runs each")
+    print(f"{'path':<14}{'best':>10}{'median':>10}{'pyobjc':>9}")
+    for name in ("no_op", "export_only", "import"):
+        r = results[name]
+        print(f"{name:<14}{r['best_s'] * 1000:>8.1f}ms{r['median_s'] * 1000:>8.1f}ms"
+              f"{'yes' if r['pyobjc_loaded'] else 'no':>9}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+bench_tag_scan.py — Tag regexes vs the single-pass tag scanner
+
+Compares, on one note at a time:
+
+  regex    what sub_path_from_tag() and hide_tags() used to run: findall
+           with both tag patterns, then the hide-tags substitution
+  scanner  bear_export_sync._scan_tags() plus hide_tags()
+
+over a realistic note and pathological inputs full of '#' (runs of
+'#', "# " pairs, many short tags, multi-word candidates that never
+close, and one long tag followed by a near-miss "word#x" that makes the
+old lookahead re-scan for every shorter tag body), each at growing
+sizes.  Reported per input and size: best time and nanoseconds per
+byte; flat ns/byte means bounded time per byte.  A regex size is
+skipped, with every larger one, when the previous size's time scaled
+quadratically to it exceeds --regex-limit seconds; a run over the limit
+is not repeated.
+
+Usage:
+  python3 benchmarks/bench_tag_scan.py --sizes 4096 16384 65536 \
+      --json tags.json
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The patterns the scanner replaced, as they were in bear_export_sync.py.
+_RE_TAG_PATTERN1 = re.compile(r'(?<!\S)\#([.\w\/\-]+)[ \n]?(?!([\/ \w]+\w[#]))')
+_RE_TAG_PATTERN2 = re.compile(r'(?<![\S])\#([^ \d][.\w\/ ]+?)\#([ \n]|$)')
+_RE_HIDE_TAGS    = re.compile(r'(\n)[ \t]*(\#[^\s#].*)')
+
+_WORDS = "bear note export markdown sync vault image tag folder link".split()
+
+
+def _note(size, rng=None):
+    """Prose lines with simple, nested and multi-word tags and a code block."""
+    rng = rng or random.Random(0)
+    lines, total = ["# Title"], 7
+    while total < size:
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(4, 12))]
+        roll = rng.random()
+        if roll < 0.2:
+            words.append(f"#{rng.choice(_WORDS)}/{rng.choice(_WORDS)}")
+        elif roll < 0.3:
+            words.insert(0, f"#{rng.choice(_WORDS)} {rng.choice(_WORDS)}#")
+        elif roll < 0.35:
+            words = ["```\n#include <stdio.h>\n```"]
+        line = " ".join(words)
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+_INPUTS = {
+    "note": _note,
+    "hash_run": lambda size: "#" * size,
+    "hash_space": lambda size: ("# " * (size // 2 + 1))[:size],
+    "short_tags": lambda size: ("#a " * (size // 3 + 1))[:size],
+    "multi_unclosed": lambda size: ("#word word " * (size // 11 + 1))[:size],
+    "long_tag_near_miss": lambda size: "#" + "a" * max(size - 6, 1) + " bc#x",
+}
+
+
+def _time(fn, text, repeat, limit=None):
+    """Best of *repeat* runs; stops repeating once a run exceeds *limit*."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(text)
+        wall = time.perf_counter() - t0
+        best = wall if best is None else min(best, wall)
+        if limit is not None and wall > limit:
+            break
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[4096, 16384, 65536])
+    ap.add_argument("--inputs", nargs="+", default=list(_INPUTS),
+                    choices=list(_INPUTS))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--regex-limit", type=float, default=5.0, metavar="SECONDS",
+                    help="Skip regex sizes expected to take longer than this")
+    ap.add_argument("--json", metavar="PATH", help="Also write results as JSON")
+    args = ap.parse_args()
+
+    # bear_export_sync resolves Bear's paths from HOME at import time.
+    os.environ["HOME"] = tempfile.mkdtemp(prefix="bear_bench_")
+    sys.path.insert(0, _ROOT)
+    import bear_export_sync as engine
+    engine.hide_tags_in_comment_block = True
+
+    def regex(text):
+        _RE_TAG_PATTERN1.findall(text)
+        _RE_TAG_PATTERN2.findall(text)
+        _RE_HIDE_TAGS.sub(r'\1', text)
+
+    def scanner(text):
+        for _ in engine._scan_tags(text):
+            pass
+        engine.hide_tags(text)
+
+    results = {}
+    for name in args.inputs:
+        rows = results[name] = []
+        estimate = None     # regex seconds per byte², from the last size run
+        for size in sorted(args.sizes):
+            text = _INPUTS[name](size)
+            row = {"bytes": len(text),
+                   "scanner_s": _time(scanner, text, args.repeat),
+                   "regex_s": None}
+            # Checked before running: the near-miss case is quadratic,
+            # so one size too far can take minutes.
+            if estimate is None or estimate * len(text) ** 2 <= args.regex_limit:
+                row["regex_s"] = _time(regex, text, args.repeat, args.regex_limit)
+                estimate = (row["regex_s"] / len(text) ** 2
+                            if row["regex_s"] <= args.regex_limit else float("inf"))
+            else:
+                estimate = float("inf")
+            rows.append(row)
+
+    print(f"{'input':<20}{'bytes':>9}{'regex':>12}{'ns/B':>9}"
+          f"{'scanner':>12}{'ns/B':>9}")
+    for name, rows in results.items():
+        for r in rows:
+            if r["regex_s"] is None:
+                regex_col = f"{'skipped':>12}{'':>9}"
+            else:
+                regex_col = (f"{r['regex_s'] * 1000:>10.2f}ms"
+                             f"{r['regex_s'] * 1e9 / r['bytes']:>9.0f}")
+            print(f"{name:<20}{r['bytes']:>9}{regex_col}"
+                  f"{r['scanner_s'] * 1000:>10.2f}ms"
+                  f"{r['scanner_s'] * 1e9 / r['bytes']:>9.0f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+synthetic_bear_db.py — Generate a schema-compatible Bear database
+
+Creates a SQLite file with the Bear 2.x tables the exporter reads
+(ZSFNOTE, ZSFNOTEFILE, ZSFNOTETAG and the Z_5TAGS join table) filled
+with deterministic pseudo-random notes, plus optionally the matching
+"Note Images" folder, so export hot paths can be measured without a
+Bear install.
+
+Usage:
+  python3 benchmarks/synthetic_bear_db.py OUT.sqlite --notes 20000 \
+      --images-dir "Note Images" --image-density 0.2 --tags-per-note 3
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import uuid as uuid_mod
+
+_WORDS = (
+    "bear note export markdown sync vault image tag folder link archive "
+    "draft idea meeting project review todo reference journal quote"
+).split()
+
+_SCHEMA = (
+    "CREATE TABLE ZSFNOTE ("
+    "  Z_PK INTEGER PRIMARY KEY, Z_ENT INTEGER, Z_OPT INTEGER,"
+    "  ZARCHIVED INTEGER, ZTRASHED INTEGER, ZPINNED INTEGER,"
+    "  ZCREATIONDATE TIMESTAMP, ZMODIFICATIONDATE TIMESTAMP,"
+    "  ZTITLE VARCHAR, ZSUBTITLE VARCHAR, ZTEXT VARCHAR,"
+    "  ZUNIQUEIDENTIFIER VARCHAR)",
+    "CREATE TABLE ZSFNOTEFILE ("
+    "  Z_PK INTEGER PRIMARY KEY, Z_ENT INTEGER, Z_OPT INTEGER,"
+    "  ZNOTE INTEGER, ZFILENAME VARCHAR, ZUNIQUEIDENTIFIER VARCHAR)",
+    "CREATE INDEX ZSFNOTEFILE_ZNOTE_INDEX ON ZSFNOTEFILE (ZNOTE)",
+    "CREATE TABLE ZSFNOTETAG ("
+    "  Z_PK INTEGER PRIMARY KEY, Z_ENT INTEGER, Z_OPT INTEGER,"
+    "  ZTITLE VARCHAR, ZUNIQUEIDENTIFIER VARCHAR)",
+    "CREATE TABLE Z_5TAGS ("
+    "  Z_5NOTES INTEGER, Z_13TAGS INTEGER, PRIMARY KEY (Z_5NOTES, Z_13TAGS))",
+    "CREATE INDEX Z_5TAGS_Z_13TAGS_INDEX ON Z_5TAGS (Z_13TAGS)",
+)
+
+# A tiny valid PNG; image bytes do not matter to the exporter.
+_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000"
+    "000049454e44ae426082")
+
+
+def _uuid(rng):
+    return str(uuid_mod.UUID(int=rng.getrandbits(128), version=4)).upper()
+
+
+def _paragraph(rng, size):
+    words = []
+    total = 0
+    while total < size:
+        w = rng.choice(_WORDS)
+        words.append(w)
+        total += len(w) + 1
+    return " ".join(words)
+
+
+def _note_size(rng, mean, distribution):
+    if distribution == "fixed":
+        return mean
+    if distribution == "uniform":
+        return rng.randint(0, 2 * mean)
+    return int(rng.expovariate(1.0 / mean))
+
+
+def _tag_names(count):
+    """*count* tag titles: flat words, with every third one nested."""
+    names = []
+    for i in range(count):
+        word = _WORDS[i % len(_WORDS)]
+        names.append(f"{word}{i}" if i % 3 else f"area{i % 7}/{word}{i}")
+    return names
+
+
+def create_database(path, notes=1000, mean_note_bytes=4000, seed=0,
+                    size_distribution="exponential", image_density=0.0,
+                    images_dir=None, tags_per_note=1, tag_count=50,
+                    collision_rate=0.0):
+    """Create a synthetic Bear database at *path* and return its path.
+
+    Note sizes follow *size_distribution* (exponential, uniform or
+    fixed) around *mean_note_bytes*; about 2% of rows are trashed or
+    archived so the exporter's WHERE clause has something to filter.
+    A fraction *image_density* of notes embed a Bear 2.x image, written
+    to *images_dir*/<file UUID>/ when given.  Each note carries
+    *tags_per_note* tags from a pool of *tag_count* (every third one
+    nested, with the parent linked too, as Bear does), and a fraction
+    *collision_rate* reuse an earlier note's title.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    tag_names = _tag_names(max(tag_count, 1))
+    tag_pk = {}
+    conn = sqlite3.connect(path)
+    try:
+        for stmt in _SCHEMA:
+            conn.execute(stmt)
+        rows, files, links, titles = [], [], set(), []
+        for pk in range(1, notes + 1):
+            if titles and rng.random() < collision_rate:
+                title = rng.choice(titles)
+            else:
+                title = f"{rng.choice(_WORDS).title()} {rng.choice(_WORDS)} {pk}"
+                titles.append(title)
+            size = max(40, _note_size(rng, mean_note_bytes, size_distribution))
+            tags = rng.sample(tag_names, min(tags_per_note, len(tag_names)))
+            body = _paragraph(rng, size)
+            if rng.random() < image_density:
+                file_uuid = _uuid(rng)
+                name = f"image {pk}.png"
+                body += f"\n\n![]({name.replace(' ', '%20')})\n"
+                files.append((pk, name, file_uuid))
+                if images_dir:
+                    folder = os.path.join(images_dir, file_uuid)
+                    os.makedirs(folder, exist_ok=True)
+                    with open(os.path.join(folder, name), "wb") as f:
+                        f.write(_PNG)
+            text = f"# {title}\n{body}\n{' '.join('#' + t for t in tags)}\n"
+            created = 600_000_000.0 + pk * 60
+            modified = created + rng.randint(0, 10_000_000)
+            trashed = 1 if rng.random() < 0.01 else 0
+            archived = 1 if rng.random() < 0.01 else 0
+            rows.append((pk, archived, trashed, created, modified,
+                         title, text, _uuid(rng)))
+            for tag in tags:
+                parts = tag.split("/")
+                for depth in range(1, len(parts) + 1):
+                    name = "/".join(parts[:depth])
+                    if name not in tag_pk:
+                        tag_pk[name] = len(tag_pk) + 1
+                    links.add((pk, tag_pk[name]))
+        conn.executemany(
+            "INSERT INTO ZSFNOTE (Z_PK, ZARCHIVED, ZTRASHED, ZCREATIONDATE,"
+            " ZMODIFICATIONDATE, ZTITLE, ZTEXT, ZUNIQUEIDENTIFIER)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany(
+            "INSERT INTO ZSFNOTEFILE (ZNOTE, ZFILENAME, ZUNIQUEIDENTIFIER)"
+            " VALUES (?, ?, ?)", files)
+        conn.executemany(
+            "INSERT INTO ZSFNOTETAG (Z_PK, ZTITLE, ZUNIQUEIDENTIFIER)"
+            " VALUES (?, ?, ?)",
+            [(pk, name, _uuid(rng)) for name, pk in tag_pk.items()])
+        conn.executemany(
+            "INSERT INTO Z_5TAGS (Z_5NOTES, Z_13TAGS) VALUES (?, ?)",
+            sorted(links))
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic Bear database")
+    ap.add_argument("out", help="Path of the SQLite file to create")
+    ap.add_argument("--notes", type=int, default=1000)
+    ap.add_argument("--mean-note-bytes", type=int, default=4000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--size-distribution", default="exponential",
+                    choices=["exponential", "uniform", "fixed"])
+    ap.add_argument("--image-density", type=float, default=0.0,
+                    help="Fraction of notes with an embedded image")
+    ap.add_argument("--images-dir", help="Also write the image files here")
+    ap.add_argument("--tags-per-note", type=int, default=1)
+    ap.add_argument("--tag-count", type=int, default=50)
+    ap.add_argument("--collision-rate", type=float, default=0.0,
+                    help="Fraction of notes reusing an earlier title")
+    args = ap.parse_args()
+    create_database(args.out, args.notes, args.mean_note_bytes, args.seed,
+                    size_distribution=args.size_distribution,
+                    image_density=args.image_density,
+                    images_dir=args.images_dir,
+                    tags_per_note=args.tags_per_note,
+                    tag_count=args.tag_count,
+                    collision_rate=args.collision_rate)
+    print(f"Wrote {args.notes} notes to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
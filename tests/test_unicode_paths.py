@@ -0,0 +1,156 @@
+"""NFC/NFD path identity: steady-state exports write nothing.
+
+Runs the exporter in-process against a small Bear database built in a
+temporary folder, with the platform backend stubbed out, so no Bear
+install is needed.  Linux file systems store NFC and NFD names as
+different bytes, which is the case the path identity layer exists for.
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unicodedata
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bear_export_sync as engine  # noqa: E402
+
+
+def nfc(s):
+    return unicodedata.normalize('NFC', s)
+
+
+def nfd(s):
+    return unicodedata.normalize('NFD', s)
+
+
+_SCHEMA = (
+    "CREATE TABLE ZSFNOTE (Z_PK INTEGER PRIMARY KEY, ZARCHIVED INTEGER,"
+    " ZTRASHED INTEGER, ZCREATIONDATE TIMESTAMP, ZMODIFICATIONDATE TIMESTAMP,"
+    " ZTITLE VARCHAR, ZTEXT VARCHAR, ZUNIQUEIDENTIFIER VARCHAR)",
+    "CREATE TABLE ZSFNOTEFILE (Z_PK INTEGER PRIMARY KEY, ZNOTE INTEGER,"
+    " ZFILENAME VARCHAR, ZUNIQUEIDENTIFIER VARCHAR)",
+    "CREATE TABLE ZSFNOTETAG (Z_PK INTEGER PRIMARY KEY, ZTITLE VARCHAR,"
+    " ZUNIQUEIDENTIFIER VARCHAR)",
+    "CREATE TABLE Z_5TAGS (Z_5NOTES INTEGER, Z_13TAGS INTEGER,"
+    " PRIMARY KEY (Z_5NOTES, Z_13TAGS))",
+)
+
+# (title, tag) — titles and tags arrive from Bear in either normalization.
+_NOTES = (
+    (nfc('Café'), nfc('résumé')),
+    (nfd('Crème brûlée'), nfd('résumé')),
+    (nfd('Ångström'), nfc('physik/größe')),
+    ('Plain ASCII', None),
+)
+
+
+class UnicodePathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='bear_unicode_')
+        self.addCleanup(shutil.rmtree, self.root)
+        self.db = os.path.join(self.root, 'database.sqlite')
+        self.out = os.path.join(self.root, 'out')
+        self._saved = (engine.bear_db, engine.bear_image_path)
+        self.addCleanup(self._restore)
+        engine.bear_db = self.db
+        engine.bear_image_path = os.path.join(self.root, 'Note Images')
+        engine.set_platform_backend(engine.StubBackend())
+        self._make_database()
+        self._stamp = time.time()
+
+    def _restore(self):
+        engine.bear_db, engine.bear_image_path = self._saved
+
+    def _make_database(self):
+        conn = sqlite3.connect(self.db)
+        with conn:
+            for stmt in _SCHEMA:
+                conn.execute(stmt)
+            tags = {}
+            for pk, (title, tag) in enumerate(_NOTES, 1):
+                text = f'# {title}\nBody of {title}\n'
+                if tag:
+                    text += f'#{tag}\n'
+                    for depth in range(1, tag.count('/') + 2):
+                        name = '/'.join(tag.split('/')[:depth])
+                        tag_pk = tags.setdefault(name, len(tags) + 1)
+                        conn.execute("INSERT OR IGNORE INTO Z_5TAGS VALUES (?, ?)",
+                                     (pk, tag_pk))
+                conn.execute(
+                    "INSERT INTO ZSFNOTE VALUES (?, 0, 0, ?, ?, ?, ?, ?)",
+                    (pk, 600000000.0 + pk, 600000100.0 + pk, title, text,
+                     f'00000000-0000-4000-8000-{pk:012d}'))
+            conn.executemany("INSERT INTO ZSFNOTETAG VALUES (?, ?, ?)",
+                             [(pk, name, f'TAG-{pk}') for name, pk in tags.items()])
+        conn.close()
+
+    def export(self, **options):
+        """Run one export as if Bear had just written its database."""
+        self._stamp += 10
+        os.utime(self.db, (self._stamp, self._stamp))
+        config = engine.SyncConfig(out=self.out,
+                                   backup=os.path.join(self.root, 'backup'),
+                                   **options)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = engine.export(config)
+        self.assertTrue(result['exported'])
+        return result
+
+    def note_files(self):
+        found = []
+        for root, dirs, files in os.walk(self.out):
+            dirs[:] = [d for d in dirs if d != 'BearImages']
+            found += [os.path.relpath(os.path.join(root, f), self.out)
+                      for f in files if f.endswith('.md')]
+        return sorted(found)
+
+    def test_second_export_writes_nothing(self):
+        for tag_folders in (False, True):
+            with self.subTest(tag_folders=tag_folders):
+                self.export(tag_folders=tag_folders)
+                first = self.note_files()
+                result = self.export(tag_folders=tag_folders)
+                self.assertEqual(result['writes']['written'], 0)
+                self.assertEqual(result['targets'][0]['written'], 0)
+                self.assertEqual(result['targets'][0]['removed'], 0)
+                self.assertEqual(self.note_files(), first)
+                # Every exported name is NFC, whatever Bear stored.
+                self.assertEqual(first, [nfc(p) for p in first])
+
+    def test_nfd_spelled_file_is_adopted(self):
+        os.makedirs(self.out)
+        stale = os.path.join(self.out, nfd('Café') + '.md')
+        with open(stale, 'w', encoding='utf-8') as f:
+            f.write('old text\n')
+        self.export()
+        names = [n for n in os.listdir(self.out) if nfc(n) == nfc('Café.md')]
+        self.assertEqual(names, [nfc('Café.md')])
+        with open(os.path.join(self.out, names[0]), encoding='utf-8') as f:
+            self.assertIn('Body of Café', f.read())
+        self.assertEqual(self.export()['writes']['written'], 0)
+
+    def test_nfd_renamed_vault_causes_no_writes(self):
+        # A sync client hands the exported tree back with NFD names.
+        self.export(tag_folders=True)
+        for root, dirs, files in os.walk(self.out, topdown=False):
+            for name in files + dirs:
+                if nfd(name) != name:
+                    os.rename(os.path.join(root, name),
+                              os.path.join(root, nfd(name)))
+        result = self.export(tag_folders=True)
+        self.assertEqual(result['writes']['written'], 0)
+        self.assertEqual(result['targets'][0]['removed'], 0)
+        keys = [nfc(p) for p in self.note_files()]
+        self.assertEqual(len(keys), len(set(keys)))
+
+
+if __name__ == '__main__':
+    unittest.main()